@@ -13,6 +13,12 @@ from lighthouse.validators.samples_declarations import (
 
 scheduler = APScheduler()
 
+# the scheduled jobs of optional features, with the config flag which enables each of them
+OPTIONAL_JOBS = {
+    "refill_cog_barcode_reservoirs": "COG_BARCODE_RESERVOIR_ENABLE",
+    "update_plate_summaries": "PLATE_SUMMARIES_ENABLE",
+}
+
 
 def create_app() -> Eve:
     app = Eve(__name__, validator=SamplesDeclarationsValidator, auth=APIKeyAuth)
@@ -36,12 +42,71 @@ def create_app() -> Eve:
         app.register_blueprint(cherrypicked_plates.bp)
         app.register_blueprint(plate_events.bp)
 
+    from lighthouse.commands.dates_tested import backfill_dates_tested_command
+    from lighthouse.commands.outbox import replay_outbox_command
+    from lighthouse.commands.plate_summaries import update_plate_summaries_command
+
+    app.cli.add_command(update_plate_summaries_command)
+    app.cli.add_command(replay_outbox_command)
+    app.cli.add_command(backfill_dates_tested_command)
+
     if app.config.get("SCHEDULER_RUN", False):
+        # only schedule the jobs of the optional features which are enabled
+        app.config["JOBS"] = [
+            job
+            for job in app.config["JOBS"]
+            if job["id"] not in OPTIONAL_JOBS or app.config.get(OPTIONAL_JOBS[job["id"]], False)
+        ]
         scheduler.init_app(app)
         scheduler.start()
 
+    # start the background workers with the first request rather than with the app, so that they
+    # run only in the process serving the app (each gunicorn worker) and not in flask CLI commands,
+    # which could exit in the middle of a job. The work left queued before the app (re)started is
+    # picked up with the first request, e.g. a health check
+    @app.before_first_request
+    def start_background_workers():
+        if app.config.get("PLATE_JOBS_ASYNC", False) and app.config.get(
+            "PLATE_JOB_WORKERS_RUN", False
+        ):
+            from lighthouse.helpers.plate_jobs import get_plate_job_workers
+
+            get_plate_job_workers()
+
+        if app.config.get("OUTBOX_ENABLE", False) and app.config.get("OUTBOX_FLUSHER_RUN", False):
+            from lighthouse.messages.outbox import get_outbox
+
+            get_outbox()
+
     @app.route("/health")
     def health_check():
         return "Factory working", HTTPStatus.OK
 
+    @app.route("/health/http-clients")
+    def http_clients_health_check():
+        from lighthouse.helpers.http_client import get_http_clients_metrics
+
+        return get_http_clients_metrics(), HTTPStatus.OK
+
+    @app.route("/health/dart")
+    def dart_health_check():
+        from lighthouse.helpers.dart_db import get_dart_connection_pool_metrics
+
+        return get_dart_connection_pool_metrics(), HTTPStatus.OK
+
+    @app.route("/health/timings")
+    def timings_health_check():
+        from lighthouse.helpers.timing import get_timing_registry
+
+        return get_timing_registry().snapshot(), HTTPStatus.OK
+
+    @app.route("/health/outbox")
+    def outbox_health_check():
+        from lighthouse.messages.outbox import get_outbox
+
+        if not app.config.get("OUTBOX_ENABLE", False):
+            return {"enabled": False}, HTTPStatus.OK
+
+        return {"enabled": True, **get_outbox().metrics()}, HTTPStatus.OK
+
     return app
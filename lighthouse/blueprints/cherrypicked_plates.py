@@ -1,38 +1,46 @@
 import logging
 from http import HTTPStatus
-from typing import Any, Dict, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 from flask import Blueprint
 from flask import current_app as app
 from flask import request
 from flask_cors import CORS  # type: ignore
-from lighthouse.constants import PLATE_EVENT_DESTINATION_FAILED
+from lighthouse.constants import (
+    FIELD_COG_BARCODE,
+    FIELD_DART_RUN_ID,
+    PLATE_EVENT_DESTINATION_FAILED,
+)
+from lighthouse.helpers.concurrency import ConcurrentCallError, run_concurrently
 from lighthouse.helpers.events import get_routing_key
+from lighthouse.helpers.idempotency import IdempotentRequest, run_idempotently
 from lighthouse.helpers.plates import (
     add_cog_barcodes,
-    add_controls_to_samples,
-    check_matching_sample_numbers,
     construct_cherrypicking_plate_failed_message,
     create_cherrypicked_post_body,
+    find_cherrypicked_samples,
     find_dart_source_samples_rows,
-    find_samples,
     get_source_plates_for_samples,
-    join_rows_with_samples,
+    join_dart_rows_with_samples,
     map_to_ss_columns,
-    query_for_cherrypicked_samples,
     send_to_ss,
     update_mlwh_with_cog_uk_ids,
 )
-from lighthouse.messages.broker import Broker
+from lighthouse.helpers.timing import current_stage_timer, timed_request, timed_stage
+from lighthouse.messages.outbox import send_message
 
 logger = logging.getLogger(__name__)
 
 bp = Blueprint("cherrypicked-plates", __name__)
 CORS(bp)
 
+# the name of the COG UK ids saved in the record of an idempotent request
+RESERVED_COG_BARCODES = "reserved_cog_barcodes"
+
 
 # TODO - reduce method length/complexity
 @bp.route("/cherrypicked-plates/create", methods=["GET"])
+@timed_request("cherrypicked_plates.create")
 def create_plate_from_barcode() -> Tuple[Dict[str, Any], int]:  # noqa: C901
     try:
         user_id = request.args.get("user_id", "")
@@ -53,49 +61,117 @@ def create_plate_from_barcode() -> Tuple[Dict[str, Any], int]:  # noqa: C901
         return bad_request_response_with_error("Missing/invalid query parameters in url")
 
     try:
-        dart_samples = find_dart_source_samples_rows(barcode)
+        with timed_stage("dart"):
+            dart_samples = find_dart_source_samples_rows(barcode)
         if len(dart_samples) == 0:
             msg = "Failed to find sample data in DART for plate barcode: " + barcode
             logger.error(msg)
             return internal_server_error_response_with_error(msg)
 
-        mongo_samples = find_samples(query_for_cherrypicked_samples(dart_samples))
+        def create(
+            idempotent_request: Optional[IdempotentRequest] = None,
+        ) -> Tuple[Dict[str, Any], int, bool]:
+            return create_cherrypicked_plate(
+                user_id, barcode, robot_serial_number, dart_samples, idempotent_request
+            )
+
+        if not app.config["CHERRYPICKED_IDEMPOTENCY_ENABLE"]:
+            response_json, status_code, _ = create()
+            return response_json, status_code
+
+        # the Beckman software retries on timeout: a retry for the same DART run of the plate is
+        #   given the response of the first request instead of creating the plate again
+        dart_run_id = getattr(dart_samples[0], FIELD_DART_RUN_ID)
+        return run_idempotently(f"cherrypicked-plates/create:{barcode}:{dart_run_id}", create)
+    except Exception as e:
+        logger.exception(e)
+        return internal_server_error_response_with_error(type(e).__name__)
+
+
+def create_cherrypicked_plate(
+    user_id: str,
+    barcode: str,
+    robot_serial_number: str,
+    dart_samples: List[Any],
+    idempotent_request: Optional[IdempotentRequest] = None,
+) -> Tuple[Dict[str, Any], int, bool]:
+    """Create a cherrypicked plate in Sequencescape from its DART rows and the matching samples in
+    Mongo, and write the COG UK ids of the samples to the MLWH.
+
+    Arguments:
+        user_id {str} -- the id of the user who cherrypicked the plate
+        barcode {str} -- the barcode of the destination plate
+        robot_serial_number {str} -- the serial number of the robot which cherrypicked the plate
+        dart_samples {List[Any]} -- the DART rows of the destination plate
+        idempotent_request {Optional[IdempotentRequest]} -- the record of the request, in which the
+        COG UK ids of the samples are saved for retries (default: {None})
+
+    Returns:
+        Tuple[Dict[str, Any], int, bool] -- the JSON response, its status code and whether the
+        plate was created in Sequencescape
+    """
+    try:
+        with timed_stage("mongo_samples"):
+            mongo_samples = find_cherrypicked_samples(dart_samples)
 
         if not mongo_samples:
-            return bad_request_response_with_error("No samples for this barcode: " + barcode)
+            return (
+                *bad_request_response_with_error("No samples for this barcode: " + barcode),
+                False,
+            )
 
-        if not check_matching_sample_numbers(dart_samples, mongo_samples):
+        samples, controls = join_dart_rows_with_samples(dart_samples, mongo_samples)
+
+        if len(mongo_samples) != len(samples):
             msg = f"Mismatch in destination and source sample data for plate '{barcode}'"
             logger.error(msg)
-            return internal_server_error_response_with_error(msg)
+            return (*internal_server_error_response_with_error(msg), False)
 
-        # add COG barcodes to samples
+        # adding COG barcodes (from the centre prefix and baracoda) and finding the source plates
+        # are independent, so run them concurrently
+        timer = current_stage_timer()
         try:
-            centre_prefix = add_cog_barcodes(mongo_samples)
-        except (Exception) as e:
-            logger.exception(e)
-            return bad_request_response_with_error(
-                "Failed to add COG barcodes to plate: " + barcode
+            results = run_concurrently(
+                {
+                    "centre_prefix": timer.wrap(
+                        "cog_barcodes",
+                        lambda: add_reserved_cog_barcodes(mongo_samples, idempotent_request),
+                    ),
+                    "source_plates": timer.wrap(
+                        "mongo_source_plates", lambda: get_source_plates_for_samples(mongo_samples)
+                    ),
+                }
             )
+        except ConcurrentCallError as e:
+            logger.exception(e.__cause__)
+            if e.name == "centre_prefix":
+                return (
+                    *bad_request_response_with_error(
+                        "Failed to add COG barcodes to plate: " + barcode
+                    ),
+                    False,
+                )
+            return (*internal_server_error_response_with_error(type(e.__cause__).__name__), False)
 
-        samples = join_rows_with_samples(dart_samples, mongo_samples)
-
-        all_samples = add_controls_to_samples(dart_samples, samples)
-
-        mapped_samples = map_to_ss_columns(all_samples)
+        centre_prefix = results["centre_prefix"]
+        source_plates = results["source_plates"]
 
-        source_plates = get_source_plates_for_samples(mongo_samples)
+        mapped_samples = map_to_ss_columns(samples + controls)
 
         if not source_plates:
-            return bad_request_response_with_error(
-                "No source plate UUIDs for samples of destination plate: " + barcode
+            return (
+                *bad_request_response_with_error(
+                    "No source plate UUIDs for samples of destination plate: " + barcode
+                ),
+                False,
             )
 
         body = create_cherrypicked_post_body(
             user_id, barcode, mapped_samples, robot_serial_number, source_plates
         )
 
-        response = send_to_ss(body)
+        with timed_stage("sequencescape"):
+            response = send_to_ss(body)
 
         if response.ok:
             response_json = {
@@ -107,21 +183,68 @@ def create_plate_from_barcode() -> Tuple[Dict[str, Any], int]:  # noqa: C901
             }
 
             try:
-                update_mlwh_with_cog_uk_ids(mongo_samples)
+                with timed_stage("mlwh"):
+                    update_mlwh_with_cog_uk_ids(mongo_samples)
             except (Exception) as e:
                 logger.exception(e)
-                return internal_server_error_response_with_error(
-                    "Failed to update MLWH with COG UK ids. The samples should have "
-                    "been successfully inserted into Sequencescape."
+                return (
+                    *internal_server_error_response_with_error(
+                        "Failed to update MLWH with COG UK ids. The samples should have "
+                        "been successfully inserted into Sequencescape."
+                    ),
+                    True,
                 )
         else:
             response_json = response.json()
 
         # return the JSON and status code directly from SS (act as a proxy)
-        return response_json, response.status_code
+        return response_json, response.status_code, response.ok
     except Exception as e:
         logger.exception(e)
-        return internal_server_error_response_with_error(type(e).__name__)
+        return (*internal_server_error_response_with_error(type(e).__name__), False)
+
+
+def add_reserved_cog_barcodes(
+    samples: List[Dict[str, Any]], idempotent_request: Optional[IdempotentRequest]
+) -> Optional[str]:
+    """Add COG UK ids to the samples, reusing those saved by an earlier attempt of the request which
+    did not complete, so that a retry does not reserve new ones; new ids are saved for retries.
+
+    Arguments:
+        samples {List[Dict[str, Any]]} -- the samples to add COG UK ids to
+        idempotent_request {Optional[IdempotentRequest]} -- the record of the request, if any
+
+    Returns:
+        Optional[str] -- the centre prefix of the samples
+    """
+    if idempotent_request is None:
+        return add_cog_barcodes(samples)
+
+    sample_ids = [str(sample["_id"]) for sample in samples]
+
+    reserved = idempotent_request.get(RESERVED_COG_BARCODES)
+    if reserved is not None and all(
+        sample_id in reserved["cog_barcodes"] for sample_id in sample_ids
+    ):
+        logger.info(f"Reusing the COG UK ids reserved for {len(samples)} samples")
+        for sample, sample_id in zip(samples, sample_ids):
+            sample[FIELD_COG_BARCODE] = reserved["cog_barcodes"][sample_id]
+
+        return reserved["centre_prefix"]
+
+    centre_prefix = add_cog_barcodes(samples)
+    idempotent_request.save(
+        RESERVED_COG_BARCODES,
+        {
+            "centre_prefix": centre_prefix,
+            "cog_barcodes": {
+                sample_id: sample.get(FIELD_COG_BARCODE)
+                for sample, sample_id in zip(samples, sample_ids)
+            },
+        },
+    )
+
+    return centre_prefix
 
 
 @bp.route("/cherrypicked-plates/fail", methods=["GET"])
@@ -158,16 +281,9 @@ def fail_plate_from_barcode() -> Tuple[Dict[str, Any], int]:
         routing_key = get_routing_key(PLATE_EVENT_DESTINATION_FAILED)
 
         logger.info("Attempting to publish the destination failed event message")
-        broker = Broker()
-        broker.connect()
-        try:
-            broker.publish(message, routing_key)
-            broker.close_connection()
-            logger.info(f"Successfully published a '{PLATE_EVENT_DESTINATION_FAILED}' message")
-            return {"errors": errors}, HTTPStatus.OK
-        except Exception:
-            broker.close_connection()
-            raise
+        send_message(message, routing_key)
+        logger.info(f"Successfully published a '{PLATE_EVENT_DESTINATION_FAILED}' message")
+        return {"errors": errors}, HTTPStatus.OK
     except Exception as e:
         logger.error("Failed recording cherrypicking plate failure: an unexpected error occurred")
         logger.exception(e)
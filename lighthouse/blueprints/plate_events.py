@@ -5,9 +5,9 @@ from typing import Any, Dict, Tuple
 from flask import Blueprint, request
 from flask_cors import CORS  # type: ignore
 from lighthouse.helpers.events import get_routing_key
-from lighthouse.helpers.plate_event_callbacks import fire_callbacks
+from lighthouse.helpers.plate_event_callbacks import dispatch_callbacks
 from lighthouse.helpers.plate_events import construct_event_message
-from lighthouse.messages.broker import Broker
+from lighthouse.messages.outbox import send_message
 
 logger = logging.getLogger(__name__)
 
@@ -39,21 +39,14 @@ def create_plate_event() -> Tuple[Dict[str, Any], int]:
         routing_key = get_routing_key(event_type)
 
         logger.info("Attempting to publish the constructed plate event message")
-        broker = Broker()
-        broker.connect()
-        try:
-            broker.publish(message, routing_key)
-            broker.close_connection()
-            logger.info(f"Successfully published a '{event_type}' plate event message")
-            success, messages = fire_callbacks(message)
-            if success:
-                return ({"errors": []}, HTTPStatus.OK)
-            else:
-                logger.error("Failed to update labwhere", messages)
-                return ({"errors": messages}, HTTPStatus.INTERNAL_SERVER_ERROR)
-        except Exception:
-            broker.close_connection()
-            raise
+        send_message(message, routing_key)
+        logger.info(f"Successfully published a '{event_type}' plate event message")
+        success, messages = dispatch_callbacks(message)
+        if success:
+            return ({"errors": []}, HTTPStatus.OK)
+        else:
+            logger.error("Failed to update labwhere", messages)
+            return ({"errors": messages}, HTTPStatus.INTERNAL_SERVER_ERROR)
 
     except Exception as e:
         logger.error("Failed publishing plate event message: an unexpected error occurred")
@@ -1,19 +1,19 @@
 import logging
 from http import HTTPStatus
-from typing import Any, Dict, Tuple
+from typing import Any, Dict, List, Tuple
 
-from flask import Blueprint, request
+from flask import Blueprint
+from flask import current_app as app
+from flask import request
 from flask_cors import CORS  # type: ignore
-from lighthouse.constants import FIELD_PLATE_BARCODE
-from lighthouse.helpers.plates import (
-    add_cog_barcodes,
-    create_post_body,
-    get_positive_samples,
-    get_positive_samples_count,
-    has_sample_data,
-    send_to_ss,
-    update_mlwh_with_cog_uk_ids,
+from lighthouse.helpers.plate_jobs import (
+    create_plate,
+    create_plates,
+    enqueue_plate_job,
+    get_plate_job,
 )
+from lighthouse.helpers.plates import get_plates_sample_counts
+from lighthouse.helpers.timing import timed_request
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +22,7 @@ CORS(bp)
 
 
 @bp.route("/plates/new", methods=["POST"])
+@timed_request("plates.create")
 def create_plate_from_barcode() -> Tuple[Dict[str, Any], int]:
     try:
         barcode = request.get_json()["barcode"]
@@ -30,76 +31,88 @@ def create_plate_from_barcode() -> Tuple[Dict[str, Any], int]:
         logger.exception(e)
         return {"errors": ["POST request needs 'barcode' in body"]}, HTTPStatus.BAD_REQUEST
 
+    if app.config["PLATE_JOBS_ASYNC"]:
+        job_id = enqueue_plate_job(barcode)
+        return {"data": {"job_id": job_id}}, HTTPStatus.ACCEPTED
+
+    return create_plate(barcode)
+
+
+@bp.route("/plates/new/bulk", methods=["POST"])
+@timed_request("plates.create_bulk")
+def create_plates_from_barcodes() -> Tuple[Dict[str, Any], int]:
+    """A Flask route which creates plates in Sequencescape from a list of barcodes, as POST
+    /plates/new would for each of them, batching the calls made for each plate.
+    For example:
+    POST http://host:port/plates/new/bulk with {"barcodes": ["123", "456"]}
+    This endpoint responds with json and the body is in the format
+    {"plates":[{"barcode":"123","status_code":201,"data":{...}}]}, with the "errors" of each plate
+    which could not be created instead of its "data"
+    Arguments:
+        None
+    Returns:
+        {}, HTTPStatus
+    """
     try:
-        # get samples for barcode
-        samples = get_positive_samples(barcode)
-
-        if not samples:
-            return {"errors": ["No samples for this barcode: " + barcode]}, HTTPStatus.BAD_REQUEST
-
-        # add COG barcodes to samples
-        try:
-            centre_prefix = add_cog_barcodes(samples)
-        except (Exception) as e:
-            logger.exception(e)
-            return (
-                {"errors": ["Failed to add COG barcodes to plate: " + barcode]},
-                HTTPStatus.BAD_REQUEST,
-            )
-
-        body = create_post_body(barcode, samples)
-
-        response = send_to_ss(body)
-
-        if response.ok:
-            response_json = {
-                "data": {
-                    "plate_barcode": samples[0][FIELD_PLATE_BARCODE],
-                    "centre": centre_prefix,
-                    "number_of_positives": len(samples),
-                }
-            }
+        barcodes = request.get_json()["barcodes"]
+        if not isinstance(barcodes, list) or not all(isinstance(b, str) for b in barcodes):
+            raise TypeError("'barcodes' should be a list of barcodes")
+        logger.info(f"Attempting to create {len(barcodes)} plates in SS")
+    except (KeyError, TypeError) as e:
+        logger.exception(e)
+        return {"errors": ["POST request needs 'barcodes' in body"]}, HTTPStatus.BAD_REQUEST
+
+    if len(barcodes) > app.config["PLATES_BULK_MAX_BARCODES"]:
+        return (
+            {"errors": [f"No more than {app.config['PLATES_BULK_MAX_BARCODES']} barcodes"]},
+            HTTPStatus.BAD_REQUEST,
+        )
 
-            try:
-                update_mlwh_with_cog_uk_ids(samples)
-            except (Exception) as e:
-                logger.exception(e)
-                return (
-                    {
-                        "errors": [
-                            (
-                                "Failed to update MLWH with COG UK ids. The samples should have "
-                                "been successfully inserted into Sequencescape."
-                            )
-                        ]
-                    },
-                    HTTPStatus.INTERNAL_SERVER_ERROR,
-                )
-        else:
-            response_json = response.json()
-
-        # return the JSON and status code directly from SS (act as a proxy)
-        return response_json, response.status_code
+    try:
+        return {"plates": create_plates(barcodes)}, HTTPStatus.OK
     except Exception as e:
         logger.exception(e)
         return {"errors": [type(e).__name__]}, HTTPStatus.INTERNAL_SERVER_ERROR
 
 
-def format_plate(barcode: str) -> Dict[str, Any]:
-    """Used by flask route /plates to format each plate
+@bp.route("/plates/jobs/<job_id>", methods=["GET"])
+def find_plate_job(job_id: str) -> Tuple[Dict[str, Any], int]:
+    """A Flask route which returns the stage of a job enqueued by POST /plates/new and, once it has
+    finished, the response and status code the plate was created with.
     Arguments:
-        barcode
+        job_id {str} -- the id of the job
     Returns:
         {}, HTTPStatus
     """
-    plate_map = has_sample_data(barcode)
-    number_of_positives = get_positive_samples_count(barcode) if plate_map else None
+    job = get_plate_job(job_id)
+    if job is None:
+        return {"errors": [f"No job with id: {job_id}"]}, HTTPStatus.NOT_FOUND
+
+    return {"data": job}, HTTPStatus.OK
+
+
+def format_plates(barcodes: List[str]) -> List[Dict[str, Any]]:
+    """Used by flask route /plates to format the plates, in the order requested, using a single
+    query for the sample counts of all the plates
+    Arguments:
+        barcodes
+    Returns:
+        [{}]
+    """
+    counts = get_plates_sample_counts(barcodes)
+
+    plates = []
+    for barcode in barcodes:
+        plate_counts = counts.get(barcode)
+        plates.append(
+            {
+                "plate_barcode": barcode,
+                "plate_map": plate_counts is not None,
+                "number_of_positives": plate_counts.get("positives") if plate_counts else None,
+            }
+        )
 
-    return {
-        "plate_barcode": barcode,
-        "plate_map": plate_map,
-        "number_of_positives": number_of_positives,
-    }
+    return plates
 
 
 @bp.route("/plates", methods=["GET"])
@@ -118,7 +131,7 @@ def find_plate_from_barcode() -> Tuple[Dict[str, Any], int]:
     """
     barcodes = request.args.getlist("barcodes[]")
     try:
-        plates = [format_plate(barcode) for barcode in barcodes]
+        plates = format_plates(barcodes)
         return {"plates": plates}, HTTPStatus.OK
     except Exception as e:
         logger.exception(e)
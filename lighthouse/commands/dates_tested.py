@@ -0,0 +1,11 @@
+import click
+from flask.cli import with_appcontext
+from lighthouse.helpers.dates_tested import update_dates_tested
+
+
+@click.command("backfill-dates-tested")
+@with_appcontext
+def backfill_dates_tested_command() -> None:
+    """Set the parsed date tested of every sample in the samples collection."""
+    samples_updated = update_dates_tested(full_backfill=True)
+    click.echo(f"Set the date tested of {samples_updated} samples")
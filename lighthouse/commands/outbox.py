@@ -0,0 +1,30 @@
+import click
+from flask import current_app as app
+from flask.cli import with_appcontext
+from lighthouse.messages.broker import BrokerPublisher
+from lighthouse.messages.outbox import MessageOutbox, flush_outbox, new_outbox_owner
+
+
+@click.command("replay-outbox")
+@with_appcontext
+def replay_outbox_command() -> None:
+    """Publish all the messages waiting in the outbox."""
+    outbox = MessageOutbox(app.config["OUTBOX_PATH"])
+    publisher = BrokerPublisher(confirm_delivery=True)
+    owner = new_outbox_owner()
+    total_published = 0
+    try:
+        while True:
+            published, failed = flush_outbox(outbox, publisher, owner)
+            total_published += published
+            if failed or published == 0:
+                break
+    finally:
+        publisher.close()
+
+    metrics = outbox.metrics()
+    outbox.close()
+
+    click.echo(
+        f"Published {total_published} messages, {metrics['backlog']} messages left in the outbox"
+    )
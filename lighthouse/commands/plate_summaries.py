@@ -0,0 +1,14 @@
+import click
+from flask.cli import with_appcontext
+from lighthouse.helpers.plate_summaries import update_plate_summaries
+
+
+@click.command("update-plate-summaries")
+@click.option(
+    "--full", is_flag=True, help="Recount every plate, not only those changed since the last run"
+)
+@with_appcontext
+def update_plate_summaries_command(full: bool) -> None:
+    """Update the plate_summaries collection from the samples collection."""
+    plates_updated = update_plate_summaries(full_rebuild=full)
+    click.echo(f"Updated summaries of {plates_updated} plates")
@@ -18,6 +18,29 @@ REPORTS_DIR = "data/reports"
 DOWNLOAD_REPORTS_URL = f"http://{LOCALHOST}:5000/reports"
 X_DOMAINS = "*"
 REPORT_WINDOW_SIZE = 84  # The window size when generating the positive samples report
+# the number of warehouse queries run at once to find the cherrypicked samples of a report
+REPORTS_WAREHOUSE_QUERY_WORKERS = 4
+# join the cherrypicked samples queries of a report to temporary tables of its root sample ids and
+# plate barcodes instead of passing them as IN lists; the warehouse user needs the CREATE TEMPORARY
+# TABLES privilege
+REPORTS_WAREHOUSE_TEMP_TABLE_JOIN = False
+# the number of rows inserted into the temporary tables at once
+REPORTS_TEMP_TABLE_INSERT_CHUNK_SIZE = 1000
+# stream the rows of the cherrypicked samples queries of a report with a server side cursor, in
+# chunks of REPORTS_WAREHOUSE_STREAM_CHUNK_SIZE rows, keeping only the distinct rows
+REPORTS_WAREHOUSE_STREAM_RESULTS = False
+REPORTS_WAREHOUSE_STREAM_CHUNK_SIZE = 10000
+# the maximum number of threads used to make independent calls to other services concurrently
+CONCURRENT_CALLS_MAX_WORKERS = 8
+
+###
+# Timing config
+###
+# the timings of requests slower than this are logged at WARNING level and kept in the timing
+# registry; those of a random sample of the other requests are logged at INFO level
+TIMING_SLOW_REQUEST_SECONDS = 5
+TIMING_SAMPLE_RATE = 0.01
+TIMING_SLOW_SAMPLES_KEPT = 50
 
 ###
 # Eve config
@@ -46,9 +69,26 @@ SAMPLES_DECLARATIONS_SCHEMA = {
     },
 }
 DOMAIN = {
-    "samples": {},
+    "samples": {
+        "mongo_indexes": {
+            # supports looking up cherrypicked samples by root sample id, rna id and lab id
+            "root_sample_id_rna_id_lab_id": [("Root Sample ID", 1), ("RNA ID", 1), ("Lab ID", 1)],
+            # supports finding the filtered positive samples tested within the report window
+            "filtered_positive_date_tested": [("filtered_positive", 1), ("date_tested", 1)],
+            # supports finding the samples updated since a watermark
+            "updated_at": [("updated_at", 1)],
+        },
+    },
     "imports": {},
     "centres": {},
+    # the COG-UK barcodes reserved from baracoda for each centre prefix, not exposed by the API
+    "cog_barcode_reservoir": {
+        "internal_resource": True,
+        "mongo_indexes": {
+            # supports taking the unclaimed barcodes of a centre prefix
+            "centre_prefix_claimed_by": [("centre_prefix", 1), ("claimed_by", 1)],
+        },
+    },
     "samples_declarations": {
         "resource_methods": ["GET", "POST"],
         "bulk_enabled": True,
@@ -57,11 +97,32 @@ DOMAIN = {
     "schema": {},
 }
 
+###
+# HTTP client config
+###
+# requests to each upstream service use their own pooled, keep-alive session; the defaults can be
+# overridden per upstream in HTTP_CLIENTS
+HTTP_CLIENT_DEFAULTS = {"connect_timeout": 5, "read_timeout": 60, "pool_maxsize": 10}
+HTTP_CLIENTS: Dict[str, Dict[str, float]] = {
+    "baracoda": {"read_timeout": 30},
+    "sequencescape": {"read_timeout": 120},
+    "labwhere": {"read_timeout": 30},
+}
+
 ###
 # Baracoda config
 ###
 BARACODA_URL = f"{LOCALHOST}:5000"
 BARACODA_RETRY_ATTEMPTS = 3
+# seconds to wait before retrying a request to baracoda, doubled after each failed attempt
+BARACODA_RETRY_BACKOFF_SECONDS = 0.5
+# take COG-UK barcodes from a reservoir of barcodes per centre prefix (stored in mongo) which is
+# topped up from baracoda in the background when it holds fewer than the low water mark
+COG_BARCODE_RESERVOIR_ENABLE = False
+COG_BARCODE_RESERVOIR_BLOCK_SIZE = 500
+COG_BARCODE_RESERVOIR_LOW_WATER = 200
+# seconds after which barcodes claimed by a request which did not take them return to the reservoir
+COG_BARCODE_RESERVOIR_CLAIM_TTL_SECONDS = 300
 
 ###
 # Labwhere config
@@ -71,6 +132,58 @@ LABWHERE_DESTROYED_BARCODE = os.environ.get(
     "LABWHERE_DESTROYED_BARCODE", "lw-heron-destroyed-17338"
 )
 
+###
+# Plate event callbacks config
+###
+# fire the callbacks of plate events (e.g. recording transfers in labwhere) in the background,
+# retrying those which fail and recording them in plate_event_callback_failures once all the
+# attempts have failed. The callbacks waiting to be fired are only held in memory, so those pending
+# when lighthouse stops are lost; they are fired inline (and their failures returned to the caller)
+# unless this is set
+PLATE_EVENT_CALLBACKS_ASYNC = False
+PLATE_EVENT_CALLBACK_WORKERS = 4
+PLATE_EVENT_CALLBACK_RETRY_ATTEMPTS = 5
+PLATE_EVENT_CALLBACK_RETRY_BACKOFF_SECONDS = 1
+PLATE_EVENT_CALLBACK_RETRY_MAX_BACKOFF_SECONDS = 60
+# transfers of labware to the bin by the same robot are merged into one labwhere scan for this
+# many seconds after the first one, or until the scan has LABWHERE_SCAN_MAX_LABWARE labware
+# (0 sends every transfer straight away)
+LABWHERE_SCAN_COALESCE_SECONDS = 0
+LABWHERE_SCAN_MAX_LABWARE = 50
+# seconds that callbacks fired inline wait for their coalesced scan to be sent, including retries
+LABWHERE_SCAN_WAIT_SECONDS = 30
+
+###
+# Cherrypicked plates config
+###
+# a request to create a cherrypicked plate which is retried for the same DART run of the plate is
+# given the recorded response of the first request, waiting for it while it is in progress, or a
+# conflict if it is still in progress after the wait; the COG-UK barcodes of a request which did
+# not complete are reused by its retry
+CHERRYPICKED_IDEMPOTENCY_ENABLE = True
+# how long, and how often, a duplicate of a request in progress checks whether it has completed
+IDEMPOTENCY_WAIT_SECONDS = 30
+IDEMPOTENCY_POLL_INTERVAL_SECONDS = 0.5
+# a request still in progress after this many seconds is assumed to have died and can be run again
+IDEMPOTENCY_LEASE_SECONDS = 300
+IDEMPOTENCY_RECORD_TTL_SECONDS = 7 * 24 * 60 * 60
+
+###
+# Plate jobs config
+###
+# POST /plates/new enqueues a job in the plate_jobs collection and returns 202 with the id of the
+# job, which is run by a pool of workers; its progress is reported by GET /plates/jobs/<job_id>
+PLATE_JOBS_ASYNC = False
+PLATE_JOB_WORKERS_RUN = True
+PLATE_JOB_WORKERS = 4
+PLATE_JOB_POLL_INTERVAL_SECONDS = 5
+# a job still running after this many seconds is marked as failed
+PLATE_JOB_CLAIM_SECONDS = 600
+# POST /plates/new/bulk creates at most this many plates, sending at most
+# PLATES_BULK_MAX_CONCURRENT_SS of them to Sequencescape at once
+PLATES_BULK_MAX_BARCODES = 100
+PLATES_BULK_MAX_CONCURRENT_SS = 4
+
 ###
 # Sequencescape config
 ###
@@ -88,7 +201,16 @@ SS_UUID_STUDY_CHERRYPICKED = ""
 MLWH_DB = "unified_warehouse_test"
 EVENTS_WH_DB = "events_wh_db"
 MLWH_LIGHTHOUSE_SAMPLE_TABLE = "lighthouse_sample"
+# seconds before a cached reflection of an MLWH table is refreshed
+MLWH_TABLE_CACHE_SECONDS = 3600
+# number of samples written to the MLWH by each set-based update
+MLWH_BULK_UPDATE_CHUNK_SIZE = 1000
+# a transaction which deadlocks is tried again, waiting twice as long between each attempt
+MLWH_DEADLOCK_RETRY_ATTEMPTS = 3
+MLWH_DEADLOCK_RETRY_BACKOFF_SECONDS = 0.5
 
+# the MLWH is updated through a temporary table, so the RW user needs the CREATE TEMPORARY TABLES
+# privilege on the MLWH database (as does the RO user when REPORTS_WAREHOUSE_TEMP_TABLE_JOIN is set)
 WAREHOUSES_RO_CONN_STRING = f"root@{LOCALHOST}"
 WAREHOUSES_RW_CONN_STRING = f"root:root@{LOCALHOST}"
 
@@ -114,7 +236,25 @@ JOBS = [
         "trigger": "cron",
         "day": "*",
         "hour": 2,
-    }
+    },
+    {
+        "id": "refill_cog_barcode_reservoirs",
+        "func": "lighthouse.jobs.cog_barcodes:refill_cog_barcode_reservoirs_job",
+        "trigger": "interval",
+        "minutes": 1,
+    },
+    {
+        "id": "update_plate_summaries",
+        "func": "lighthouse.jobs.plate_summaries:update_plate_summaries_job",
+        "trigger": "interval",
+        "minutes": 5,
+    },
+    {
+        "id": "update_dates_tested",
+        "func": "lighthouse.jobs.dates_tested:update_dates_tested_job",
+        "trigger": "interval",
+        "minutes": 5,
+    },
 ]
 # We need to define timezone because current flask_apscheduler does not load from TZ env
 SCHEDULER_TIMEZONE = "Europe/London"
@@ -129,6 +269,28 @@ MONGO_USERNAME = ""
 MONGO_PASSWORD = ""
 MONGO_DBNAME = ""
 MONGO_QUERY_BLACKLIST = ["$where"]
+# seconds before the cached prefixes of the centres are loaded again
+CENTRES_CACHE_TTL_SECONDS = 300
+
+###
+# Plate summaries config
+###
+# read the sample counts of plates from the plate_summaries collection (kept up to date by the
+# update_plate_summaries job), falling back to counting the samples of plates without a summary
+PLATE_SUMMARIES_ENABLE = False
+PLATE_SUMMARIES_CHUNK_SIZE = 1000
+# seconds by which each update goes back before the previous one, to recount the plates of samples
+# written by the crawler (with its own clock) while the previous update ran
+PLATE_SUMMARIES_WATERMARK_OVERLAP_SECONDS = 300
+# seconds between full rebuilds, which recount the plates that samples were deleted or moved from
+PLATE_SUMMARIES_FULL_REBUILD_SECONDS = 3600
+
+###
+# Dates tested config
+###
+# seconds by which each update_dates_tested run goes back before the previous one, to parse the
+# dates of samples written by the crawler (with its own clock) while the previous run ran
+DATES_TESTED_WATERMARK_OVERLAP_SECONDS = 300
 
 ###
 # DART config
@@ -140,6 +302,12 @@ DART_SQL_SERVER_DATABASE = "DartDevDB"
 
 DART_RESULT_VIEW = "CherrypickingInfo"
 
+# DART connections are pooled: the maximum number of connections open at once, how long an idle
+# connection is kept for and how long to wait for a connection when they are all in use
+DART_POOL_MAX_SIZE = 5
+DART_POOL_MAX_IDLE_SECONDS = 300
+DART_POOL_CHECKOUT_TIMEOUT_SECONDS = 10
+
 # NB: Remember to copy this definition to any config which redefines any of the variables that are used to create it.
 DART_SQL_SERVER_CONNECTION_STRING = (
     "DRIVER={ODBC Driver 17 for SQL Server};"
@@ -162,6 +330,33 @@ RMQ_EXCHANGE = "lighthouse.examples"
 RMQ_EXCHANGE_TYPE = "topic"
 RMQ_ROUTING_KEY = "staging.event.#"
 RMQ_LIMS_ID = "LH_LOCAL"
+# the connection to the broker is kept open between messages; when it has been lost a message is
+# published again after reconnecting, waiting twice as long after each failed attempt
+RMQ_PUBLISH_RETRY_ATTEMPTS = 3
+RMQ_RECONNECT_BACKOFF_SECONDS = 0.5
+RMQ_RECONNECT_MAX_BACKOFF_SECONDS = 10
+# the heartbeat timeout of the publisher's connection, so that a publish waiting for its confirm on
+# a half-open connection fails rather than holding the publisher's lock forever. A blocking
+# connection only services heartbeats while it is being used, so the broker closes the connection
+# of a publisher left idle for longer than the timeout, and the next message reconnects
+RMQ_HEARTBEAT_SECONDS = 60
+# how long a publish waits while the broker blocks the connection (e.g. on a memory alarm), and how
+# long opening the connection may take, before it fails
+RMQ_BLOCKED_CONNECTION_TIMEOUT_SECONDS = 30
+RMQ_SOCKET_TIMEOUT_SECONDS = 10
+
+###
+# Outbox config
+###
+# store event messages in a local outbox and return straight away; a background thread (the
+# flusher) publishes them to the broker, with publisher confirms, in batches
+OUTBOX_ENABLE = False
+OUTBOX_FLUSHER_RUN = True
+OUTBOX_PATH = "data/outbox.sqlite3"
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_FLUSH_INTERVAL_SECONDS = 5
+# how long a flusher has to publish a batch before another one can claim it
+OUTBOX_CLAIM_SECONDS = 300
 
 ###
 # Backman config
@@ -18,6 +18,18 @@ REPORTS_DIR = "tests/data/reports"
 ###
 SCHEDULER_RUN = False
 
+###
+# Baracoda config
+###
+BARACODA_RETRY_BACKOFF_SECONDS = 0
+COG_BARCODE_RESERVOIR_ENABLE = False
+
+###
+# Outbox config
+###
+OUTBOX_FLUSHER_RUN = False
+OUTBOX_PATH = "tests/data/outbox.sqlite3"
+
 ###
 # mongo config
 ###
@@ -29,6 +41,12 @@ MONGO_QUERY_BLACKLIST = ["$where"]  # not sure why this was required...
 # Labwhere config
 ###
 LABWHERE_DESTROYED_BARCODE = "heron-bin"
+LABWHERE_SCAN_COALESCE_SECONDS = 0
+
+###
+# Plate jobs config
+###
+PLATE_JOB_WORKERS_RUN = False
 
 ###
 # logging config
@@ -41,6 +59,7 @@ LOGGING["loggers"]["lighthouse"]["handlers"] = ["colored_stream"]
 ###
 MLWH_DB = "unified_warehouse_test"
 EVENTS_WH_DB = "event_warehouse_test"
+MLWH_DEADLOCK_RETRY_BACKOFF_SECONDS = 0
 
 WAREHOUSES_RO_CONN_STRING = f"root@{LOCALHOST}"
 WAREHOUSES_RW_CONN_STRING = f"root@{LOCALHOST}"
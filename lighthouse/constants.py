@@ -21,6 +21,9 @@ FIELD_SOURCE = "source"
 FIELD_LAB_ID = "Lab ID"
 FIELD_PLATE_BARCODE = "plate_barcode"
 FIELD_DATE_TESTED = "Date Tested"
+FIELD_UPDATED_AT = "updated_at"
+# the date of FIELD_DATE_TESTED as a date, set by the update_dates_tested job
+FIELD_PARSED_DATE_TESTED = "date_tested"
 
 # UUID fields
 FIELD_LH_SOURCE_PLATE_UUID = "lh_source_plate_uuid"
@@ -29,6 +32,10 @@ FIELD_LH_SAMPLE_UUID = "lh_sample_uuid"
 # Filtered positive fields
 FIELD_FILTERED_POSITIVE = "filtered_positive"
 
+# Plate summary fields
+FIELD_PLATE_SUMMARY_TOTAL = "total"
+FIELD_PLATE_SUMMARY_POSITIVES = "positives"
+
 ###
 # DART specific column names:
 ###
@@ -77,3 +77,18 @@ class ReportCreationError(Error):
             return f"ReportCreationError: {self.message}"
         else:
             return f"ReportCreationError: {default_message}"
+
+
+class PlateJobClaimLostError(Error):
+    """Raised when a job to create a plate is no longer claimed by the worker running it."""
+
+    def __init__(self, message=None):
+        self.message = message
+
+    def __str__(self):
+        default_message = "The job is no longer claimed by this worker"
+
+        if self.message:
+            return f"PlateJobClaimLostError: {self.message}"
+        else:
+            return f"PlateJobClaimLostError: {default_message}"
@@ -0,0 +1,142 @@
+"""Look up the prefixes of centres
+
+The centres collection is small and rarely changes, so the prefixes of the centres are loaded into
+a map keyed by the lower-cased name of the centre, which is shared by the requests of the app. The
+map is loaded again when it is older than CENTRES_CACHE_TTL_SECONDS, when a centre is not found in
+it, or when reload_centre_prefixes is called (e.g. after the centres have been changed). A name
+which is still not found once the map has been loaded again is remembered for
+CENTRES_CACHE_TTL_SECONDS, so that repeated unknown names do not load the map every time.
+
+This file contains the following functions:
+
+  * get_centre_prefix_from_cache - get the prefix of a centre from the map of the current app
+  * reload_centre_prefixes - load the map of the current app from the centres collection again
+"""
+import logging
+import threading
+import time
+from typing import Dict, Optional, Set
+
+from flask import current_app as app
+from lighthouse.exceptions import DataError
+
+logger = logging.getLogger(__name__)
+
+_cache_lock = threading.Lock()
+
+
+class CentrePrefixCache:
+    """A map of the lower-cased names of centres to their prefixes."""
+
+    def __init__(self, ttl_seconds: float):
+        self._ttl = ttl_seconds
+        self._lock = threading.Lock()
+        self._prefixes: Dict[str, str] = {}
+        self._duplicates: Set[str] = set()
+        # the names not found, with when they were last looked for in the centres collection
+        self._misses: Dict[str, float] = {}
+        self._loaded_at: Optional[float] = None
+
+    def get(self, centre_name: str) -> Optional[str]:
+        """Get the prefix of a centre, ignoring the case of its name.
+
+        Arguments:
+            centre_name {str} -- the name of the centre
+
+        Raises:
+            DataError: there are several centres with the name
+
+        Returns:
+            Optional[str] -- the prefix of the centre, or None if there is no centre with the name
+        """
+        key = centre_name.lower()
+        with self._lock:
+            if self._loaded_at is None or (time.monotonic() - self._loaded_at) >= self._ttl:
+                self._load()
+
+            if key not in self._prefixes and key not in self._duplicates:
+                # the centre may have been added since the map was loaded, unless the name was not
+                # found when it was last looked for
+                missed_at = self._misses.get(key)
+                if missed_at is None or (time.monotonic() - missed_at) >= self._ttl:
+                    self._load()
+                    if key not in self._prefixes and key not in self._duplicates:
+                        self._add_miss(key)
+
+            if key in self._duplicates:
+                raise DataError("Multiple centres with the same name")
+
+            return self._prefixes.get(key)
+
+    def reload(self) -> None:
+        """Load the map from the centres collection again, forgetting the names not found."""
+        with self._lock:
+            self._misses = {}
+            self._load()
+
+    def _add_miss(self, key: str) -> None:
+        now = time.monotonic()
+        # forget the names whose miss has expired, so that the map of misses does not keep growing
+        self._misses = {
+            name: missed_at
+            for name, missed_at in self._misses.items()
+            if now - missed_at < self._ttl
+        }
+        self._misses[key] = now
+
+    def _load(self) -> None:
+        prefixes: Dict[str, str] = {}
+        duplicates: Set[str] = set()
+        for centre in app.data.driver.db.centres.find({}, {"name": 1, "prefix": 1}):
+            name = centre.get("name")
+            if not isinstance(name, str):
+                continue
+
+            key = name.lower()
+            if key in prefixes or key in duplicates:
+                duplicates.add(key)
+                prefixes.pop(key, None)
+            else:
+                prefixes[key] = centre.get("prefix")
+
+        if duplicates:
+            logger.error(f"Multiple centres with the same name: {sorted(duplicates)}")
+
+        self._prefixes = prefixes
+        self._duplicates = duplicates
+        self._loaded_at = time.monotonic()
+
+        logger.debug(f"Loaded the prefixes of {len(prefixes)} centres")
+
+
+def get_centre_prefix_from_cache(centre_name: str) -> Optional[str]:
+    """Get the prefix of a centre from the map of the current app, creating it on first use.
+
+    Arguments:
+        centre_name {str} -- the name of the centre, in any case
+
+    Raises:
+        DataError: there are several centres with the name
+
+    Returns:
+        Optional[str] -- the prefix of the centre, or None if there is no centre with the name
+    """
+    return __get_cache().get(centre_name)
+
+
+def reload_centre_prefixes() -> None:
+    """Load the map of the current app from the centres collection again."""
+    __get_cache().reload()
+
+
+# Private methods
+
+
+def __get_cache() -> CentrePrefixCache:
+    with _cache_lock:
+        cache = app.extensions.get("centre_prefix_cache")
+        if cache is None:
+            cache = CentrePrefixCache(app.config["CENTRES_CACHE_TTL_SECONDS"])
+            app.extensions["centre_prefix_cache"] = cache
+
+    return cache
@@ -0,0 +1,241 @@
+"""Get COG-UK barcodes for samples from baracoda
+
+To keep baracoda out of the way of creating plates, a reservoir of barcodes is kept for each centre
+prefix in the cog_barcode_reservoir collection (when COG_BARCODE_RESERVOIR_ENABLE is set). Plates
+take their barcodes from the reservoir and the reservoir is topped up with blocks of barcodes from
+baracoda in the background, when it runs low. As the reservoir is stored in mongo, unused barcodes
+are not lost when lighthouse restarts. Barcodes are claimed by a request before being taken; claims
+left behind by a request which died in between are released when the reservoir is topped up.
+
+This file contains the following functions:
+
+  * fetch_cog_barcodes - get new barcodes from baracoda
+  * take_cog_barcodes - take barcodes from the reservoir of a centre prefix
+  * refill_cog_barcode_reservoir - top up the reservoir of a centre prefix from baracoda
+  * refill_cog_barcode_reservoirs - top up the reservoirs of all the centres
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from http import HTTPStatus
+from typing import Dict, List, Optional, Set
+from uuid import uuid4
+
+import requests
+from flask import current_app as app
+from lighthouse.helpers.concurrency import run_in_background
+from lighthouse.helpers.http_client import UPSTREAM_BARACODA, get_http_client
+
+logger = logging.getLogger(__name__)
+
+FIELD_RESERVOIR_CENTRE_PREFIX = "centre_prefix"
+FIELD_RESERVOIR_BARCODE = "barcode"
+FIELD_RESERVOIR_CLAIMED_BY = "claimed_by"
+FIELD_RESERVOIR_CLAIMED_AT = "claimed_at"
+FIELD_RESERVOIR_RESERVED_AT = "reserved_at"
+
+_refills_lock = threading.Lock()
+_refills_in_progress: Set[str] = set()
+
+
+def fetch_cog_barcodes(centre_prefix: str, count: int) -> List[str]:
+    """Get new COG-UK barcodes from baracoda, retrying with an exponential backoff.
+
+    Arguments:
+        centre_prefix {str} -- the prefix of the centre to get barcodes for
+        count {int} -- the number of barcodes to get
+
+    Raises:
+        Exception: baracoda failed to create the barcodes after all the attempts
+        requests.ConnectionError: baracoda could not be reached, or did not respond in time, after
+        all the attempts
+
+    Returns:
+        List[str] -- the barcodes
+    """
+    baracoda_url = (
+        f"http://{app.config['BARACODA_URL']}/barcodes_group/{centre_prefix}/new?count={count}"
+    )
+
+    attempts = app.config["BARACODA_RETRY_ATTEMPTS"]
+    backoff = app.config["BARACODA_RETRY_BACKOFF_SECONDS"]
+    except_obj: Exception = Exception("Unable to create COG barcodes")
+
+    for attempt in range(1, attempts + 1):
+        if attempt > 1:
+            time.sleep(backoff * 2 ** (attempt - 2))
+
+        try:
+            response = get_http_client(UPSTREAM_BARACODA).post(baracoda_url)
+            if response.status_code == HTTPStatus.CREATED:
+                return response.json()["barcodes_group"]["barcodes"]
+
+            logger.error("Unable to create COG barcodes")
+            logger.error(response.json())
+            except_obj = Exception("Unable to create COG barcodes")
+        except requests.RequestException as e:
+            # includes timeouts, which the pooled client raises when baracoda is slow to respond
+            logger.error(f"Unable to access baracoda: {e}")
+            except_obj = requests.ConnectionError("Unable to access baracoda")
+
+    raise except_obj
+
+
+def take_cog_barcodes(centre_prefix: str, count: int) -> Optional[List[str]]:
+    """Take barcodes from the reservoir of a centre prefix, topping the reservoir up in the
+    background if it is running low.
+
+    Arguments:
+        centre_prefix {str} -- the prefix of the centre to take barcodes for
+        count {int} -- the number of barcodes to take
+
+    Returns:
+        Optional[List[str]] -- the barcodes, or None if the reservoir does not have enough of them
+    """
+    if centre_prefix is None:
+        return None
+
+    reservoir = app.data.driver.db.cog_barcode_reservoir
+    available = {FIELD_RESERVOIR_CENTRE_PREFIX: centre_prefix, FIELD_RESERVOIR_CLAIMED_BY: None}
+
+    candidate_ids = [
+        doc["_id"]
+        for doc in reservoir.find(available, {"_id": 1}).sort("_id", 1).limit(count)
+    ]
+
+    barcodes = None
+    if len(candidate_ids) == count:
+        # claim the barcodes so that they cannot be taken by another request at the same time
+        token = uuid4().hex
+        reservoir.update_many(
+            {"_id": {"$in": candidate_ids}, FIELD_RESERVOIR_CLAIMED_BY: None},
+            {
+                "$set": {
+                    FIELD_RESERVOIR_CLAIMED_BY: token,
+                    FIELD_RESERVOIR_CLAIMED_AT: datetime.utcnow(),
+                }
+            },
+        )
+        claimed = list(reservoir.find({FIELD_RESERVOIR_CLAIMED_BY: token}).sort("_id", 1))
+        if len(claimed) == count:
+            # only use the barcodes if none of them had their claim released in the meantime, as
+            # they could then have been taken by another request too
+            if reservoir.delete_many({FIELD_RESERVOIR_CLAIMED_BY: token}).deleted_count == count:
+                barcodes = [doc[FIELD_RESERVOIR_BARCODE] for doc in claimed]
+        else:
+            # some of the barcodes were taken by another request
+            reservoir.update_many(
+                {FIELD_RESERVOIR_CLAIMED_BY: token},
+                {"$set": {FIELD_RESERVOIR_CLAIMED_BY: None, FIELD_RESERVOIR_CLAIMED_AT: None}},
+            )
+
+    logger.debug(
+        f"{'Took' if barcodes else 'Could not take'} {count} COG-UK barcodes from the reservoir "
+        f"of '{centre_prefix}'"
+    )
+
+    __request_refill(centre_prefix)
+
+    return barcodes
+
+
+def refill_cog_barcode_reservoir(centre_prefix: str) -> int:
+    """Top up the reservoir of a centre prefix with a block of barcodes from baracoda if it holds
+    fewer than COG_BARCODE_RESERVOIR_LOW_WATER barcodes. Claims older than
+    COG_BARCODE_RESERVOIR_CLAIM_TTL_SECONDS are released first, returning their barcodes to the
+    reservoir.
+
+    Arguments:
+        centre_prefix {str} -- the prefix of the centre to top up the reservoir of
+
+    Returns:
+        int -- the number of barcodes added to the reservoir
+    """
+    reservoir = app.data.driver.db.cog_barcode_reservoir
+
+    __release_expired_claims(centre_prefix)
+
+    available = reservoir.count_documents(
+        {FIELD_RESERVOIR_CENTRE_PREFIX: centre_prefix, FIELD_RESERVOIR_CLAIMED_BY: None}
+    )
+    if available >= app.config["COG_BARCODE_RESERVOIR_LOW_WATER"]:
+        return 0
+
+    barcodes = fetch_cog_barcodes(centre_prefix, app.config["COG_BARCODE_RESERVOIR_BLOCK_SIZE"])
+
+    reserved_at = datetime.utcnow()
+    reservoir.insert_many(
+        [
+            {
+                FIELD_RESERVOIR_CENTRE_PREFIX: centre_prefix,
+                FIELD_RESERVOIR_BARCODE: barcode,
+                FIELD_RESERVOIR_CLAIMED_BY: None,
+                FIELD_RESERVOIR_CLAIMED_AT: None,
+                FIELD_RESERVOIR_RESERVED_AT: reserved_at,
+            }
+            for barcode in barcodes
+        ]
+    )
+
+    logger.info(f"Added {len(barcodes)} COG-UK barcodes to the reservoir of '{centre_prefix}'")
+
+    return len(barcodes)
+
+
+def refill_cog_barcode_reservoirs() -> Dict[str, int]:
+    """Top up the reservoirs of all the centres which are running low.
+
+    Returns:
+        Dict[str, int] -- the number of barcodes added to the reservoir of each centre prefix
+    """
+    added = {}
+    for centre_prefix in app.data.driver.db.centres.distinct("prefix"):
+        if not centre_prefix:
+            continue
+
+        try:
+            added[centre_prefix] = refill_cog_barcode_reservoir(centre_prefix)
+        except Exception as e:
+            logger.error(f"Failed to top up the COG-UK barcode reservoir of '{centre_prefix}'")
+            logger.exception(e)
+
+    return added
+
+
+# Private methods
+
+
+def __release_expired_claims(centre_prefix: str) -> None:
+    expired_before = datetime.utcnow() - timedelta(
+        seconds=app.config["COG_BARCODE_RESERVOIR_CLAIM_TTL_SECONDS"]
+    )
+    result = app.data.driver.db.cog_barcode_reservoir.update_many(
+        {
+            FIELD_RESERVOIR_CENTRE_PREFIX: centre_prefix,
+            FIELD_RESERVOIR_CLAIMED_BY: {"$ne": None},
+            FIELD_RESERVOIR_CLAIMED_AT: {"$lt": expired_before},
+        },
+        {"$set": {FIELD_RESERVOIR_CLAIMED_BY: None, FIELD_RESERVOIR_CLAIMED_AT: None}},
+    )
+    if result.modified_count:
+        logger.warning(
+            f"Released {result.modified_count} expired claims on the COG-UK barcode reservoir of "
+            f"'{centre_prefix}'"
+        )
+
+
+def __request_refill(centre_prefix: str) -> None:
+    with _refills_lock:
+        if centre_prefix in _refills_in_progress:
+            return
+        _refills_in_progress.add(centre_prefix)
+
+    def refill() -> int:
+        try:
+            return refill_cog_barcode_reservoir(centre_prefix)
+        finally:
+            with _refills_lock:
+                _refills_in_progress.discard(centre_prefix)
+
+    run_in_background(refill)
@@ -0,0 +1,148 @@
+"""Run independent calls concurrently
+
+Calls which do not depend on each other, e.g. requests to different services, are run on a bounded
+pool of threads shared by the app so that the caller waits for the slowest call rather than for the
+sum of all of them. Each call runs in the application context of the caller.
+
+This file contains the following functions:
+
+  * get_executor - get the pool of threads of the current app
+  * run_concurrently - run calls concurrently and collect their results
+  * run_each_concurrently - run calls concurrently, a bounded number at once, even if some fail
+  * run_in_background - run a call without waiting for it
+"""
+import logging
+import threading
+from concurrent.futures import FIRST_EXCEPTION, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict
+
+from flask import current_app as app
+
+logger = logging.getLogger(__name__)
+
+_executor_lock = threading.Lock()
+
+
+class ConcurrentCallError(Exception):
+    """Raised when one of the calls run concurrently fails. The exception raised by the call is
+    the cause of this one."""
+
+    def __init__(self, name: str):
+        super().__init__(f"Concurrent call '{name}' failed")
+        self.name = name
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Get the pool of threads of the current app, creating it on first use.
+
+    Returns:
+        ThreadPoolExecutor -- the app's pool of threads
+    """
+    with _executor_lock:
+        executor = app.extensions.get("concurrent_calls_executor")
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                max_workers=app.config["CONCURRENT_CALLS_MAX_WORKERS"],
+                thread_name_prefix="lighthouse-io",
+            )
+            app.extensions["concurrent_calls_executor"] = executor
+
+    return executor
+
+
+def run_concurrently(calls: Dict[str, Callable[[], Any]]) -> Dict[str, Any]:
+    """Run calls which do not depend on each other concurrently and wait for all of them to
+    finish. If a call fails, the calls which have not started yet are cancelled and the first
+    failure is raised without waiting for the calls still running.
+
+    Arguments:
+        calls {Dict[str, Callable[[], Any]]} -- the calls to run, keyed by a name for each
+
+    Raises:
+        ConcurrentCallError: the first call which failed, with the exception it raised as cause
+
+    Returns:
+        {Dict[str, Any]} -- the result of each call, keyed by the name of the call
+    """
+    flask_app = app._get_current_object()
+    executor = get_executor()
+
+    def run_in_app_context(call: Callable[[], Any]) -> Any:
+        with flask_app.app_context():
+            return call()
+
+    futures: Dict[Future, str] = {
+        executor.submit(run_in_app_context, call): name for name, call in calls.items()
+    }
+
+    done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+
+    for future in done:
+        error = future.exception()
+        if error is not None:
+            for pending in not_done:
+                pending.cancel()
+
+            name = futures[future]
+            logger.error(f"Concurrent call '{name}' failed")
+            raise ConcurrentCallError(name) from error
+
+    return {name: future.result() for future, name in futures.items()}
+
+
+def run_each_concurrently(
+    calls: Dict[str, Callable[[], Any]], max_concurrent: int
+) -> Dict[str, Future]:
+    """Run calls which do not depend on each other concurrently, with at most max_concurrent of
+    them running at once, and wait for all of them to finish. Unlike run_concurrently, a call which
+    fails does not stop the others.
+
+    Arguments:
+        calls {Dict[str, Callable[[], Any]]} -- the calls to run, keyed by a name for each
+        max_concurrent {int} -- the maximum number of calls running at once
+
+    Returns:
+        {Dict[str, Future]} -- the finished future of each call, keyed by the name of the call
+    """
+    flask_app = app._get_current_object()
+    executor = get_executor()
+    slots = threading.BoundedSemaphore(max_concurrent)
+
+    def run_in_app_context(call: Callable[[], Any]) -> Any:
+        try:
+            with flask_app.app_context():
+                return call()
+        finally:
+            slots.release()
+
+    futures: Dict[str, Future] = {}
+    for name, call in calls.items():
+        slots.acquire()
+        futures[name] = executor.submit(run_in_app_context, call)
+
+    wait(futures.values())
+
+    return futures
+
+
+def run_in_background(call: Callable[[], Any]) -> Future:
+    """Run a call on the app's pool of threads without waiting for it. A failure of the call is
+    logged.
+
+    Arguments:
+        call {Callable[[], Any]} -- the call to run
+
+    Returns:
+        {Future} -- the future of the call
+    """
+    flask_app = app._get_current_object()
+
+    def run_in_app_context() -> Any:
+        with flask_app.app_context():
+            try:
+                return call()
+            except Exception as e:
+                logger.exception(e)
+                raise
+
+    return get_executor().submit(run_in_app_context)
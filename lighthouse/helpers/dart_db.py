@@ -1,59 +1,275 @@
 import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Tuple
 
 import pyodbc  # type: ignore
 from flask import current_app as app
 from lighthouse.constants import (
     FIELD_DART_CONTROL,
     FIELD_DART_DESTINATION_BARCODE,
+    FIELD_DART_DESTINATION_COORDINATE,
     FIELD_DART_LAB_ID,
     FIELD_DART_RNA_ID,
     FIELD_DART_ROOT_SAMPLE_ID,
     FIELD_DART_RUN_ID,
+    FIELD_DART_SOURCE_BARCODE,
+    FIELD_DART_SOURCE_COORDINATE,
 )
 
 logger = logging.getLogger(__name__)
 
+_pool_lock = threading.Lock()
+
+# SQL Server accepts at most 2100 parameters per statement
+DART_QUERY_MAX_BARCODES = 1024
+DART_COLUMNS = [
+    FIELD_DART_RUN_ID,
+    FIELD_DART_DESTINATION_BARCODE,
+    FIELD_DART_DESTINATION_COORDINATE,
+    FIELD_DART_SOURCE_BARCODE,
+    FIELD_DART_SOURCE_COORDINATE,
+    FIELD_DART_CONTROL,
+    FIELD_DART_ROOT_SAMPLE_ID,
+    FIELD_DART_RNA_ID,
+    FIELD_DART_LAB_ID,
+]
+
+
+class DartConnectionPoolTimeoutError(Exception):
+    pass
+
+
+class DartConnectionPool:
+    """A bounded, thread-safe pool of connections to DART. Idle connections are checked before
+    being handed out and are closed once they have been idle for too long."""
+
+    def __init__(
+        self,
+        connect: Callable[[], Any],
+        max_size: int,
+        max_idle_seconds: float,
+        checkout_timeout: float,
+    ) -> None:
+        self._connect = connect
+        self._max_idle_seconds = max_idle_seconds
+        self._checkout_timeout = checkout_timeout
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        # idle connections with the time they were returned, most recently returned last
+        self._idle: List[Tuple[Any, float]] = []
+        self._metrics = {
+            "checked_out": 0,
+            "connections_created": 0,
+            "connections_reused": 0,
+            "connections_discarded": 0,
+            "checkout_timeouts": 0,
+        }
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        """Borrow a connection for the duration of the context. The connection is returned to the
+        pool afterwards, unless an exception was raised in which case it is discarded."""
+        cnxn = self.checkout()
+        try:
+            yield cnxn
+        except Exception:
+            self.checkin(cnxn, discard=True)
+            raise
+        else:
+            self.checkin(cnxn)
+
+    def checkout(self) -> Any:
+        if not self._slots.acquire(timeout=self._checkout_timeout):
+            self._increment("checkout_timeouts")
+            raise DartConnectionPoolTimeoutError(
+                f"No DART connection available after {self._checkout_timeout}s"
+            )
+
+        try:
+            cnxn = self._checkout_idle_connection()
+            if cnxn is None:
+                cnxn = self._connect()
+                self._increment("connections_created")
+        except Exception:
+            self._slots.release()
+            raise
+
+        self._increment("checked_out")
+        logger.debug(f"DART connection pool metrics: {self.metrics()}")
+        return cnxn
+
+    def checkin(self, cnxn: Any, discard: bool = False) -> None:
+        try:
+            if discard:
+                self._discard(cnxn)
+            else:
+                with self._lock:
+                    self._idle.append((cnxn, time.monotonic()))
+        finally:
+            self._increment("checked_out", -1)
+            self._slots.release()
+
+    def metrics(self) -> Dict[str, int]:
+        """The counters of the pool and its number of idle connections, as on /health/dart."""
+        with self._lock:
+            return {**self._metrics, "idle": len(self._idle)}
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+
+        for cnxn, _ in idle:
+            self._discard(cnxn)
+
+    def _checkout_idle_connection(self) -> Any:
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                cnxn, returned_at = self._idle.pop()
+
+            if time.monotonic() - returned_at > self._max_idle_seconds:
+                logger.debug("Discarding DART connection which has been idle for too long")
+                self._discard(cnxn)
+            elif not self._is_healthy(cnxn):
+                logger.info("Discarding DART connection which failed its health check")
+                self._discard(cnxn)
+            else:
+                self._increment("connections_reused")
+                return cnxn
+
+    def _is_healthy(self, cnxn: Any) -> bool:
+        try:
+            cursor = cnxn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, cnxn: Any) -> None:
+        self._increment("connections_discarded")
+        try:
+            cnxn.close()
+        except Exception as e:
+            logger.debug(f"Failed to close DART connection: {e}")
+
+    def _increment(self, metric: str, amount: int = 1) -> None:
+        with self._lock:
+            self._metrics[metric] += amount
+
 
 def create_dart_connection():
     return pyodbc.connect(app.config["DART_SQL_SERVER_CONNECTION_STRING"])
 
 
+def get_dart_connection_pool() -> DartConnectionPool:
+    """Get the pool of DART connections of the current app, creating it on first use.
+
+    Returns:
+        DartConnectionPool -- the app's pool of DART connections
+    """
+    with _pool_lock:
+        pool = app.extensions.get("dart_connection_pool")
+        if pool is None:
+            pool = DartConnectionPool(
+                # look create_dart_connection up on each call so it can be replaced
+                lambda: create_dart_connection(),
+                max_size=app.config["DART_POOL_MAX_SIZE"],
+                max_idle_seconds=app.config["DART_POOL_MAX_IDLE_SECONDS"],
+                checkout_timeout=app.config["DART_POOL_CHECKOUT_TIMEOUT_SECONDS"],
+            )
+            app.extensions["dart_connection_pool"] = pool
+
+    return pool
+
+
+def get_dart_connection_pool_metrics() -> Dict[str, int]:
+    """Get the counters of the pool of DART connections of the current app, without creating it.
+
+    Returns:
+        Dict[str, int] -- the counters of the pool, or an empty dict if it has not been used yet
+    """
+    with _pool_lock:
+        pool = app.extensions.get("dart_connection_pool")
+
+    return {} if pool is None else pool.metrics()
+
+
 def get_samples_for_barcode(cnxn, barcode):
-    cursor = cnxn.cursor()
-    cursor.execute(
-        f"SELECT * FROM {app.config['DART_RESULT_VIEW']}"
-        f" WHERE [{FIELD_DART_DESTINATION_BARCODE}]='{barcode}'"
-        f" AND (([{FIELD_DART_ROOT_SAMPLE_ID}] IS NOT NULL"
-        f" AND [{FIELD_DART_ROOT_SAMPLE_ID}]<>''"
-        f" AND [{FIELD_DART_RNA_ID}] IS NOT NULL"
-        f" AND [{FIELD_DART_RNA_ID}]<>''"
-        f" AND [{FIELD_DART_LAB_ID}] IS NOT NULL"
-        f" AND [{FIELD_DART_LAB_ID}]<>'')"
-        f" OR ([{FIELD_DART_CONTROL}] IS NOT NULL AND [{FIELD_DART_CONTROL}]<>''))"
-        f" AND [{FIELD_DART_RUN_ID}]=("
-        f"  SELECT MAX([{FIELD_DART_RUN_ID}])"
-        f"  FROM {app.config['DART_RESULT_VIEW']}"
-        f"  WHERE [{FIELD_DART_DESTINATION_BARCODE}]='{barcode}');"
-    )
-    rows = cursor.fetchall()
-    return rows
+    return get_samples_for_barcodes(cnxn, [barcode]).get(barcode, [])
 
 
-def find_dart_source_samples_rows(barcode):
-    cnxn = None
-    samples = None
+def get_samples_for_barcodes(cnxn, barcodes: List[str]) -> Dict[str, List[Any]]:
+    """Fetch the sample and control rows of the latest DART run of each destination plate in one
+    parameterised query.
+
+    Arguments:
+        cnxn -- the DART connection to use
+        barcodes {List[str]} -- the destination plate barcodes
+
+    Returns:
+        {Dict[str, List[Any]]} -- the rows of each destination plate which has any, by the barcode
+        it was requested with
+    """
+    rows_by_barcode: Dict[str, List[Any]] = {}
+    if not barcodes:
+        return rows_by_barcode
+
+    unique_barcodes = list(dict.fromkeys(barcodes))
+
+    # SQL Server matches barcodes regardless of case and trailing spaces, so the rows are mapped
+    # back to the barcodes which were requested by their normalised barcode
+    requested_barcodes: Dict[str, List[str]] = {}
+    for barcode in unique_barcodes:
+        requested_barcodes.setdefault(__normalise_barcode(barcode), []).append(barcode)
+
+    cursor = cnxn.cursor()
     try:
-        cnxn = create_dart_connection()
+        for i in range(0, len(unique_barcodes), DART_QUERY_MAX_BARCODES):
+            chunk = unique_barcodes[i : (i + DART_QUERY_MAX_BARCODES)]  # noqa: E203
+            params = __pad_parameters(chunk)
+            cursor.execute(__samples_for_barcodes_query(len(params)), params)
+            for row in cursor.fetchall():
+                dart_barcode = getattr(row, FIELD_DART_DESTINATION_BARCODE)
+                for barcode in requested_barcodes.get(__normalise_barcode(dart_barcode), []):
+                    rows_by_barcode.setdefault(barcode, []).append(row)
+    finally:
+        cursor.close()
+
+    return rows_by_barcode
+
 
+def find_dart_source_samples_rows(barcode):
+    with get_dart_connection_pool().connection() as cnxn:
         logger.info(f"Querying samples for destination {barcode}")
         samples = get_samples_for_barcode(cnxn, barcode)
         logger.info(f"{len(samples)} samples found")
-    finally:
-        if cnxn is not None:
-            cnxn.close()
+
     return samples
 
 
+def find_dart_source_samples_rows_for_barcodes(barcodes: List[str]) -> Dict[str, List[Any]]:
+    """Prefetch the DART rows of several destination plates, e.g. all the plates of a robot run,
+    in one round trip.
+
+    Arguments:
+        barcodes {List[str]} -- the destination plate barcodes
+
+    Returns:
+        {Dict[str, List[Any]]} -- the rows of each destination plate; plates without any rows map
+        to an empty list
+    """
+    with get_dart_connection_pool().connection() as cnxn:
+        logger.info(f"Querying samples for {len(barcodes)} destinations")
+        rows_by_barcode = get_samples_for_barcodes(cnxn, barcodes)
+
+    return {barcode: rows_by_barcode.get(barcode, []) for barcode in barcodes}
+
+
 def load_sql_server_script(app, script_path):
     logger.info("Connecting via ODBC")
     conn = create_dart_connection()
@@ -69,3 +285,46 @@ def load_sql_server_script(app, script_path):
 
     conn.close()
     logger.info("Connection closed")
+
+
+# Private methods
+
+
+def __normalise_barcode(barcode: str) -> str:
+    return str(barcode).strip().upper()
+
+
+def __pad_parameters(barcodes: List[str]) -> List[str]:
+    """Pad the barcodes to the next power of two by repeating the last one, so that only a handful
+    of distinct statements are prepared and their plans can be reused by SQL Server."""
+    size = 1
+    while size < len(barcodes):
+        size *= 2
+
+    return barcodes + [barcodes[-1]] * (size - len(barcodes))
+
+
+def __samples_for_barcodes_query(number_of_barcodes: int) -> str:
+    """The statement selecting the rows of the latest run of each destination plate. The latest run
+    is found with a window function over all the rows of each plate, before filtering out the rows
+    which are neither samples nor controls."""
+    columns = ", ".join(f"[{column}]" for column in DART_COLUMNS)
+    placeholders = ", ".join("?" for _ in range(number_of_barcodes))
+    return (
+        f"SELECT {columns} FROM ("
+        f"  SELECT {columns}, DENSE_RANK() OVER ("
+        f"   PARTITION BY [{FIELD_DART_DESTINATION_BARCODE}] ORDER BY [{FIELD_DART_RUN_ID}] DESC"
+        f"  ) AS [run_rank]"
+        f"  FROM {app.config['DART_RESULT_VIEW']}"
+        f"  WHERE [{FIELD_DART_DESTINATION_BARCODE}] IN ({placeholders})"
+        f" ) AS [latest_runs]"
+        f" WHERE [run_rank] = 1"
+        f" AND (([{FIELD_DART_ROOT_SAMPLE_ID}] IS NOT NULL"
+        f" AND [{FIELD_DART_ROOT_SAMPLE_ID}]<>''"
+        f" AND [{FIELD_DART_RNA_ID}] IS NOT NULL"
+        f" AND [{FIELD_DART_RNA_ID}]<>''"
+        f" AND [{FIELD_DART_LAB_ID}] IS NOT NULL"
+        f" AND [{FIELD_DART_LAB_ID}]<>'')"
+        f" OR ([{FIELD_DART_CONTROL}] IS NOT NULL AND [{FIELD_DART_CONTROL}]<>''))"
+        f" ORDER BY [{FIELD_DART_DESTINATION_BARCODE}], [{FIELD_DART_DESTINATION_COORDINATE}];"
+    )
@@ -0,0 +1,108 @@
+"""Maintain the parsed date tested of samples
+
+Samples are imported with their date tested as a string, in one of two formats (e.g.
+"2020-05-10 07:30:00 UTC" or "10/05/2020 07:30"). The date_tested field holds the same date as a
+date, so that the positive samples report can find the samples tested within its window with an
+index rather than parsing the date of every filtered positive sample. Dates which cannot be parsed
+are set to null.
+
+Dates are updated incrementally: only samples updated since the previous update (the watermark,
+kept in the watermarks collection) are parsed. A full backfill parses the date of every sample. The
+positive samples report parses the date of the samples which have not been updated yet itself.
+
+This file contains the following functions:
+
+  * update_dates_tested - set the parsed date tested of the samples changed since the watermark
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from flask import current_app as app
+from lighthouse.constants import FIELD_DATE_TESTED, FIELD_PARSED_DATE_TESTED, FIELD_UPDATED_AT
+
+logger = logging.getLogger(__name__)
+
+DATES_TESTED_WATERMARK = "dates_tested"
+
+# the date is extracted using substring since most dates look like this: "2020-05-10 07:30:00 UTC"
+# but the `dateFromString` function does not handle the timezone string "UTC"
+DATE_TESTED_EXTRACTED = {"$substrBytes": [f"${FIELD_DATE_TESTED}", 0, 19]}
+
+# converts the extracted date string to a mongo date type using the specified format. If it cannot
+# parse the date using the first format it tries with the other format found in the data
+DATE_TESTED_CONVERTED = {
+    "$dateFromString": {
+        "dateString": DATE_TESTED_EXTRACTED,
+        "format": "%Y-%m-%d %H:%M:%S",
+        "timezone": "UTC",
+        "onError": {
+            "$dateFromString": {
+                "dateString": DATE_TESTED_EXTRACTED,
+                "format": "%d/%m/%Y %H:%M",
+                "timezone": "UTC",
+                "onError": None,
+            },
+        },
+    },
+}
+
+
+def update_dates_tested(full_backfill: bool = False) -> int:
+    """Parse the date tested of the samples which have changed since the watermark and store it in
+    their date_tested field. Without a watermark, or when a full backfill is requested, the dates of
+    all the samples are parsed.
+
+    Arguments:
+        full_backfill {bool} -- Ignore the watermark and parse the date of every sample
+        (default: {False})
+
+    Returns:
+        {int} -- The number of samples updated.
+    """
+    samples = app.data.driver.db.samples
+
+    # take the new watermark before updating so that samples updated during this run are parsed
+    # again on the next one
+    started_at = datetime.utcnow()
+
+    watermark = None if full_backfill else __get_watermark()
+
+    sample_filter: Dict[str, Any] = {FIELD_DATE_TESTED: {"$exists": True, "$nin": [None, ""]}}
+    if watermark is not None:
+        # the watermark overlaps the previous run, as updated_at is written by the crawler with its
+        # own clock and samples written just before the previous run may have been committed after
+        # it; parsing a date twice is harmless
+        since = watermark - timedelta(seconds=app.config["DATES_TESTED_WATERMARK_OVERLAP_SECONDS"])
+        logger.info(f"Setting the date tested of samples changed since {since}")
+        sample_filter[FIELD_UPDATED_AT] = {"$gte": since}
+    else:
+        logger.info("Setting the date tested of all samples")
+
+    # the dates are parsed by mongo, with an update pipeline, so that the samples are not read
+    result = samples.update_many(
+        sample_filter, [{"$set": {FIELD_PARSED_DATE_TESTED: DATE_TESTED_CONVERTED}}]
+    )
+
+    __set_watermark(started_at)
+
+    logger.info(f"Set the date tested of {result.modified_count} samples")
+
+    return result.modified_count
+
+
+# Private methods
+
+
+def __get_watermark() -> Optional[datetime]:
+    watermark = app.data.driver.db.watermarks.find_one({"_id": DATES_TESTED_WATERMARK})
+    if watermark is None:
+        return None
+
+    return watermark.get(FIELD_UPDATED_AT)
+
+
+def __set_watermark(updated_at: datetime) -> None:
+    app.data.driver.db.watermarks.update_one(
+        {"_id": DATES_TESTED_WATERMARK}, {"$set": {FIELD_UPDATED_AT: updated_at}}, upsert=True
+    )
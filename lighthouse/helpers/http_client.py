@@ -0,0 +1,145 @@
+"""Make HTTP requests to the services lighthouse depends on
+
+Each upstream service (baracoda, sequencescape and labwhere) has its own pooled requests Session, so
+that connections are kept alive and reused between requests, with the connect and read timeouts and
+the pool size configured for it in HTTP_CLIENTS. The number of requests, failures and their latency
+are counted per upstream.
+
+This file contains the following functions:
+
+  * get_http_client - get the client of an upstream for the current app
+  * get_http_clients_metrics - get the counters of all the clients of the current app
+"""
+import logging
+import threading
+import time
+from typing import Any, Dict
+
+import requests
+from flask import current_app as app
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+UPSTREAM_BARACODA = "baracoda"
+UPSTREAM_SEQUENCESCAPE = "sequencescape"
+UPSTREAM_LABWHERE = "labwhere"
+
+_clients_lock = threading.Lock()
+
+
+class HttpClient:
+    """A pooled, keep-alive session to an upstream service, which counts the requests made."""
+
+    def __init__(self, name: str, connect_timeout: float, read_timeout: float, pool_maxsize: int):
+        self.name = name
+        self.timeout = (connect_timeout, read_timeout)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._metrics_lock = threading.Lock()
+        self._requests = 0
+        self._failures = 0
+        self._total_seconds = 0.0
+        self._max_seconds = 0.0
+
+    def request(self, method: str, url: str, **kwargs: Any) -> requests.Response:
+        """Make a request to the upstream, with the client's timeouts unless others are given.
+
+        Arguments:
+            method {str} -- the HTTP method
+            url {str} -- the URL to request
+            kwargs {Any} -- any other arguments of requests.Session.request
+
+        Returns:
+            requests.Response -- the response
+        """
+        kwargs.setdefault("timeout", self.timeout)
+
+        started_at = time.perf_counter()
+        failed = False
+        try:
+            return self.session.request(method, url, **kwargs)
+        except requests.RequestException:
+            failed = True
+            raise
+        finally:
+            self._record(time.perf_counter() - started_at, failed)
+
+    def get(self, url: str, **kwargs: Any) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs: Any) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def metrics(self) -> Dict[str, float]:
+        """Get the counters of the client.
+
+        Returns:
+            Dict[str, float] -- the number of requests and of those which failed to get a response,
+            and the mean and maximum latency of the requests in milliseconds
+        """
+        with self._metrics_lock:
+            mean_seconds = self._total_seconds / self._requests if self._requests else 0.0
+            return {
+                "requests": self._requests,
+                "failures": self._failures,
+                "mean_ms": round(mean_seconds * 1000, 3),
+                "max_ms": round(self._max_seconds * 1000, 3),
+            }
+
+    def close(self) -> None:
+        self.session.close()
+
+    def _record(self, seconds: float, failed: bool) -> None:
+        with self._metrics_lock:
+            self._requests += 1
+            self._total_seconds += seconds
+            self._max_seconds = max(self._max_seconds, seconds)
+            if failed:
+                self._failures += 1
+
+
+def get_http_client(upstream: str) -> HttpClient:
+    """Get the client of an upstream service for the current app, creating it on first use from the
+    HTTP_CLIENTS config of the upstream (or HTTP_CLIENT_DEFAULTS).
+
+    Arguments:
+        upstream {str} -- the name of the upstream, e.g. UPSTREAM_BARACODA
+
+    Returns:
+        HttpClient -- the app's client of the upstream
+    """
+    with _clients_lock:
+        clients = app.extensions.setdefault("http_clients", {})
+        client = clients.get(upstream)
+        if client is None:
+            config = {
+                **app.config["HTTP_CLIENT_DEFAULTS"],
+                **app.config["HTTP_CLIENTS"].get(upstream, {}),
+            }
+            logger.debug(f"Creating HTTP client for '{upstream}' with {config}")
+            client = HttpClient(
+                upstream,
+                connect_timeout=config["connect_timeout"],
+                read_timeout=config["read_timeout"],
+                pool_maxsize=config["pool_maxsize"],
+            )
+            clients[upstream] = client
+
+    return client
+
+
+def get_http_clients_metrics() -> Dict[str, Dict[str, float]]:
+    """Get the counters of all the clients created by the current app.
+
+    Returns:
+        Dict[str, Dict[str, float]] -- the counters of each client, keyed by upstream
+    """
+    with _clients_lock:
+        clients = dict(app.extensions.get("http_clients", {}))
+
+    return {upstream: client.metrics() for upstream, client in clients.items()}
@@ -0,0 +1,218 @@
+"""Run requests which must not be repeated only once
+
+A client which retries a request, e.g. after a timeout, should get the response of the first request
+rather than have its work done again. Requests are identified by a key and recorded in the
+idempotency_records collection: the first request with a key claims it and runs, while duplicates of
+a request still in progress wait, for at most IDEMPOTENCY_WAIT_SECONDS, for it to complete and are
+then given its response. A duplicate which is still waiting after that is told that the request is
+in progress (409 Conflict), and can retry later to be given its response. Only the
+responses of requests which changed something upstream are kept, so that a request which failed
+before doing anything can simply be tried again. Records are removed by mongo
+IDEMPOTENCY_RECORD_TTL_SECONDS after their request finished.
+
+A request can save values in its record, e.g. identifiers it reserved upstream, which are given back
+to the next attempt of the request when it did not complete, rather than being reserved again.
+
+A request whose process dies while it is running holds its key for IDEMPOTENCY_LEASE_SECONDS, after
+which it can be claimed again.
+
+This file contains the following functions:
+
+  * run_idempotently - run a request once per key and return the response of the first one
+
+It also contains IdempotentRequest, which is given to the request to save values in its record.
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from http import HTTPStatus
+from typing import Any, Callable, Dict, Optional, Tuple
+from uuid import uuid4
+
+from flask import current_app as app
+from pymongo import ReturnDocument  # type: ignore
+from pymongo.errors import DuplicateKeyError  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_STATUS_IN_PROGRESS = "in_progress"
+IDEMPOTENCY_STATUS_COMPLETED = "completed"
+# the request did not complete and can be run again, with the values it saved
+IDEMPOTENCY_STATUS_RELEASED = "released"
+
+_indexes_lock = threading.Lock()
+
+
+class IdempotentRequest:
+    """The record of a request run by run_idempotently, in which the request can save values to be
+    given back to the next attempt of the request if it does not complete."""
+
+    def __init__(self, key: str, owner: str, saved: Dict[str, Any]):
+        self._key = key
+        self._owner = owner
+        self._saved = saved
+
+    def get(self, name: str) -> Any:
+        """Get a value saved by this or an earlier attempt of the request.
+
+        Arguments:
+            name {str} -- the name of the value
+
+        Returns:
+            Any -- the value, or None if it has not been saved
+        """
+        return self._saved.get(name)
+
+    def save(self, name: str, value: Any) -> None:
+        """Save a value in the record of the request.
+
+        Arguments:
+            name {str} -- the name of the value
+            value {Any} -- the value, which must be storable in mongo
+        """
+        app.data.driver.db.idempotency_records.update_one(
+            {"_id": self._key, "owner": self._owner}, {"$set": {f"saved.{name}": value}}
+        )
+        self._saved[name] = value
+
+
+def run_idempotently(
+    key: str, call: Callable[[IdempotentRequest], Tuple[Dict[str, Any], int, bool]]
+) -> Tuple[Dict[str, Any], int]:
+    """Run a request once per key. A duplicate of a completed request is given its response without
+    running. A duplicate of a request in progress polls its record every
+    IDEMPOTENCY_POLL_INTERVAL_SECONDS, for at most IDEMPOTENCY_WAIT_SECONDS: it is given the
+    response once the request completes, runs if the request is released or its lease expires, and
+    is given a conflict response if the request is still in progress at the end.
+
+    Arguments:
+        key {str} -- the key identifying the request
+        call {Callable[[IdempotentRequest], Tuple[Dict[str, Any], int, bool]]} -- runs the request,
+        returning its JSON response, its status code and whether the response should be kept for
+        duplicates
+
+    Returns:
+        Tuple[Dict[str, Any], int] -- the JSON response and its status code
+    """
+    records = app.data.driver.db.idempotency_records
+    __ensure_indexes()
+
+    owner = uuid4().hex
+    deadline = time.monotonic() + app.config["IDEMPOTENCY_WAIT_SECONDS"]
+    while True:
+        record = __claim(key, owner)
+        if record is not None:
+            break
+
+        record = records.find_one({"_id": key})
+        if record is not None and record["status"] == IDEMPOTENCY_STATUS_COMPLETED:
+            logger.info(f"Returning the recorded response of '{key}'")
+            return record["response"], record["status_code"]
+
+        if time.monotonic() >= deadline:
+            logger.warning(f"A request for '{key}' is still in progress")
+            return (
+                {"errors": [f"A request for '{key}' is already in progress, try again later"]},
+                HTTPStatus.CONFLICT,
+            )
+
+        time.sleep(app.config["IDEMPOTENCY_POLL_INTERVAL_SECONDS"])
+
+    try:
+        response, status_code, keep = call(IdempotentRequest(key, owner, record.get("saved", {})))
+    except Exception:
+        __release(key, owner)
+        raise
+
+    if keep:
+        records.update_one(
+            {"_id": key, "owner": owner},
+            {
+                "$set": {
+                    "status": IDEMPOTENCY_STATUS_COMPLETED,
+                    "response": response,
+                    "status_code": int(status_code),
+                    "completed_at": datetime.utcnow(),
+                },
+                "$unset": {"lease_expires_at": ""},
+            },
+        )
+    else:
+        __release(key, owner)
+
+    return response, status_code
+
+
+# Private methods
+
+
+def __claim(key: str, owner: str) -> Optional[Dict[str, Any]]:
+    """Claim a key which is not recorded, whose request was released, or whose request in progress
+    has outlived its lease.
+
+    Returns:
+        Optional[Dict[str, Any]] -- the claimed record, or None if the key could not be claimed
+    """
+    records = app.data.driver.db.idempotency_records
+    now = datetime.utcnow()
+    lease_expires_at = now + timedelta(seconds=app.config["IDEMPOTENCY_LEASE_SECONDS"])
+
+    record = {
+        "_id": key,
+        "status": IDEMPOTENCY_STATUS_IN_PROGRESS,
+        "owner": owner,
+        "started_at": now,
+        "lease_expires_at": lease_expires_at,
+    }
+    try:
+        records.insert_one(record)
+        return record
+    except DuplicateKeyError:
+        pass
+
+    claimed = records.find_one_and_update(
+        {
+            "_id": key,
+            "$or": [
+                {"status": IDEMPOTENCY_STATUS_RELEASED},
+                {"status": IDEMPOTENCY_STATUS_IN_PROGRESS, "lease_expires_at": {"$lt": now}},
+            ],
+        },
+        {
+            "$set": {
+                "status": IDEMPOTENCY_STATUS_IN_PROGRESS,
+                "owner": owner,
+                "started_at": now,
+                "lease_expires_at": lease_expires_at,
+            },
+            "$unset": {"completed_at": ""},
+        },
+        return_document=ReturnDocument.AFTER,
+    )
+    if claimed is not None:
+        logger.info(f"Claimed '{key}' from an earlier attempt which did not complete")
+
+    return claimed
+
+
+def __release(key: str, owner: str) -> None:
+    """Release a key so that the request can be run again, keeping the values it saved."""
+    app.data.driver.db.idempotency_records.update_one(
+        {"_id": key, "owner": owner},
+        {
+            "$set": {"status": IDEMPOTENCY_STATUS_RELEASED, "completed_at": datetime.utcnow()},
+            "$unset": {"owner": "", "lease_expires_at": ""},
+        },
+    )
+
+
+def __ensure_indexes() -> None:
+    with _indexes_lock:
+        if app.extensions.get("idempotency_indexes"):
+            return
+
+        app.data.driver.db.idempotency_records.create_index(
+            "completed_at", expireAfterSeconds=app.config["IDEMPOTENCY_RECORD_TTL_SECONDS"]
+        )
+        app.extensions["idempotency_indexes"] = True
@@ -4,12 +4,24 @@ This file contains the following functions:
 
   * get_locations_from_labwhere - Make an API call to labwhere to get locations
   * set_locations_in_labwhere - Make an API call to labwhere to update locations
+
+It also contains ScanCoalescer, which merges scans of labware into the same
+location by the same user which arrive close together into a single scan.
+When a merged scan fails, the scans merged into it are sent separately so that
+only the scans which labwhere rejects fail.
 """
 
-from typing import List
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
 
-import requests
 from flask import current_app as app
+from lighthouse.helpers.http_client import UPSTREAM_LABWHERE, get_http_client
+
+logger = logging.getLogger(__name__)
 
 
 def get_locations_from_labwhere(labware_barcodes):
@@ -18,7 +30,7 @@ def get_locations_from_labwhere(labware_barcodes):
     { 'barcode': 'GLA001024R', 'location_barcode': 'lw-uk-biocentre-box-gsw--98-14813'}
     """
 
-    return requests.post(
+    return get_http_client(UPSTREAM_LABWHERE).post(
         f"http://{app.config['LABWHERE_URL']}/api/labwares_by_barcode?known=true",
         json={"barcodes": labware_barcodes},
     )
@@ -48,7 +60,7 @@ def set_locations_in_labwhere(
         {requests.Response} -- The labwhere response object
     """
 
-    return requests.post(
+    return get_http_client(UPSTREAM_LABWHERE).post(
         f"http://{app.config['LABWHERE_URL']}/api/scans",
         json={
             "scan": {
@@ -58,3 +70,251 @@ def set_locations_in_labwhere(
             }
         },
     )
+
+
+class Scan:
+    """A scan of labware added to a ScanCoalescer, resolved with its errors once the batch it was
+    merged into has been sent, or has failed after all the attempts."""
+
+    def __init__(self, labware_barcodes: List[str]):
+        self.labware_barcodes = labware_barcodes
+        self.errors: List[str] = []
+        self._done = threading.Event()
+
+    def resolve(self, errors: List[str]) -> None:
+        self.errors = errors
+        self._done.set()
+
+    def wait(self, timeout: float) -> bool:
+        """Wait for the scan to be sent, including its retries.
+
+        Arguments:
+            timeout {float} - The maximum number of seconds to wait
+
+        Returns:
+            {bool} -- True if the scan has been resolved, whether it succeeded or not
+        """
+        return self._done.wait(timeout)
+
+
+class _ScanBatch:
+    def __init__(self, key: Tuple[str, str], attempt: int = 1):
+        self.key = key
+        self.scans: List[Scan] = []
+        self.labware_barcodes: List[str] = []
+        self.attempt = attempt
+        self.dispatched = False
+
+    def extend(self, scan: Scan) -> None:
+        self.scans.append(scan)
+        for barcode in scan.labware_barcodes:
+            if barcode not in self.labware_barcodes:
+                self.labware_barcodes.append(barcode)
+
+
+class ScanCoalescer:
+    """Merges scans into the same location by the same user into one labwhere
+    scan. The labware of a scan is buffered, keyed by (user barcode, location
+    barcode), for window_seconds after the first scan of the buffer or until it
+    holds max_labware labware, and then sent as a single scan.
+
+    When a merged scan fails, the scans merged into it are sent again
+    separately. A scan which fails is retried with an exponential backoff and
+    passed to on_failure once all the attempts have failed. Scans are sent by a
+    background thread in the application context of flask_app.
+    """
+
+    def __init__(
+        self,
+        flask_app,
+        window_seconds: float,
+        max_labware: int,
+        attempts: int,
+        backoff_seconds: float,
+        max_backoff_seconds: float,
+        on_failure: Optional[Callable[[str, str, List[str], List[str], int], None]] = None,
+    ):
+        self._app = flask_app
+        self._window = window_seconds
+        self._max_labware = max_labware
+        self._attempts = attempts
+        self._backoff = backoff_seconds
+        self._max_backoff = max_backoff_seconds
+        self._on_failure = on_failure
+
+        # the buffers still accepting labware, and every batch by when it is due to be sent
+        self._open: Dict[Tuple[str, str], _ScanBatch] = {}
+        self._due: List[Tuple[float, int, _ScanBatch]] = []
+        self._sequence = itertools.count()
+        self._sending = 0
+        self._thread: Optional[threading.Thread] = None
+        self._condition = threading.Condition()
+        self.scans_requested = 0
+        self.scans_sent = 0
+
+    def add(self, labware_barcodes: List[str], location_barcode: str, user_barcode: str) -> Scan:
+        """Buffer a scan of labware into a location.
+
+        Arguments:
+            labware_barcodes {List[str]} - The barcodes of the labware scanned
+            location_barcode {str} - The barcode of the location scanned into
+            user_barcode {str} - The swipecard/barcode for the user or robot
+                                 associated with the scan.
+
+        Returns:
+            {Scan} -- The scan, which can be waited on for its result
+        """
+        scan = Scan(labware_barcodes)
+        key = (user_barcode, location_barcode)
+        with self._condition:
+            self.scans_requested += 1
+            batch = self._open.get(key)
+            if batch is None:
+                batch = _ScanBatch(key)
+                self._open[key] = batch
+                self._push(batch, self._window)
+
+            batch.extend(scan)
+            if len(batch.labware_barcodes) >= self._max_labware:
+                del self._open[key]
+                self._push(batch, 0)
+
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="lighthouse-labwhere-scans", daemon=True
+                )
+                self._thread.start()
+
+            self._condition.notify()
+
+        return scan
+
+    def flush(self) -> None:
+        """Send all the buffered scans now, without waiting for their window to end."""
+        with self._condition:
+            for batch in self._open.values():
+                self._push(batch, 0)
+            self._open.clear()
+            self._condition.notify()
+
+    def wait_until_idle(self, timeout: float) -> bool:
+        """Wait for all the buffered scans to be sent, including their retries.
+
+        Arguments:
+            timeout {float} - The maximum number of seconds to wait
+
+        Returns:
+            {bool} -- True if all the scans have been sent
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self._sending or any(not batch.dispatched for _, _, batch in self._due):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+
+        return True
+
+    def _push(self, batch: _ScanBatch, delay: float) -> None:
+        heapq.heappush(self._due, (time.monotonic() + delay, next(self._sequence), batch))
+
+    def _next_batch(self) -> _ScanBatch:
+        with self._condition:
+            while True:
+                if not self._due:
+                    self._condition.wait()
+                    continue
+
+                wait_for = self._due[0][0] - time.monotonic()
+                if wait_for > 0:
+                    self._condition.wait(wait_for)
+                    continue
+
+                _, _, batch = heapq.heappop(self._due)
+                # a buffer which filled up before its window ended is due twice
+                if batch.dispatched:
+                    self._condition.notify_all()
+                    continue
+
+                batch.dispatched = True
+                if self._open.get(batch.key) is batch:
+                    del self._open[batch.key]
+
+                self._sending += 1
+                return batch
+
+    def _run(self) -> None:
+        with self._app.app_context():
+            while True:
+                batch = self._next_batch()
+                try:
+                    self._send(batch)
+                except Exception as e:
+                    logger.exception(e)
+                finally:
+                    with self._condition:
+                        self._sending -= 1
+                        self._condition.notify_all()
+
+    def _send(self, batch: _ScanBatch) -> None:
+        user_barcode, location_barcode = batch.key
+        try:
+            response = set_locations_in_labwhere(
+                labware_barcodes=batch.labware_barcodes,
+                location_barcode=location_barcode,
+                user_barcode=user_barcode,
+            )
+            errors = []
+            if not response.ok:
+                errors.append(f"LabWhere responded with status {response.status_code}")
+        except Exception as e:
+            errors = [f"{type(e).__name__}: {str(e)}"]
+
+        with self._condition:
+            self.scans_sent += 1
+
+        if not errors:
+            logger.debug(f"Scanned {len(batch.labware_barcodes)} labware into '{location_barcode}'")
+            for scan in batch.scans:
+                scan.resolve([])
+            return
+
+        if len(batch.scans) > 1:
+            # the failure may be caused by the labware of only some of the scans, so send the scans
+            # separately to fail only those; this does not use up an attempt of the scans
+            logger.warning(
+                f"Merged scan into '{location_barcode}' failed, sending its {len(batch.scans)} "
+                f"scans separately: {errors}"
+            )
+            with self._condition:
+                for scan in batch.scans:
+                    single = _ScanBatch(batch.key, batch.attempt)
+                    single.extend(scan)
+                    self._push(single, 0)
+                self._condition.notify()
+            return
+
+        if batch.attempt < self._attempts:
+            delay = min(self._backoff * 2 ** (batch.attempt - 1), self._max_backoff)
+            logger.warning(
+                f"Scan into '{location_barcode}' failed (attempt {batch.attempt}), retrying in "
+                f"{delay} seconds: {errors}"
+            )
+            retry = _ScanBatch(batch.key, batch.attempt + 1)
+            retry.extend(batch.scans[0])
+            with self._condition:
+                self._push(retry, delay)
+                self._condition.notify()
+            return
+
+        logger.error(
+            f"Scan into '{location_barcode}' failed after {batch.attempt} attempts: {errors}"
+        )
+        try:
+            if self._on_failure is not None:
+                self._on_failure(
+                    user_barcode, location_barcode, batch.labware_barcodes, errors, batch.attempt
+                )
+        finally:
+            batch.scans[0].resolve(errors)
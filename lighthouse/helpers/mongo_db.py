@@ -1,7 +1,15 @@
 from flask import current_app as app
 import logging
 from typing import List, Dict, Any, Optional
-from lighthouse.constants import FIELD_LH_SOURCE_PLATE_UUID, FIELD_BARCODE, FIELD_RESULT
+from lighthouse.constants import (
+    FIELD_BARCODE,
+    FIELD_LH_SOURCE_PLATE_UUID,
+    FIELD_PLATE_BARCODE,
+    FIELD_PLATE_SUMMARY_POSITIVES,
+    FIELD_PLATE_SUMMARY_TOTAL,
+    FIELD_RESULT,
+    STAGE_MATCH_FILTERED_POSITIVE,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -53,3 +61,46 @@ def get_positive_samples_in_source_plate(source_plate_uuid: str) -> Optional[Lis
         )
         logger.exception(e)
         return None
+
+
+def count_samples_for_plates(plate_barcodes: List[str]) -> Dict[str, Dict[str, int]]:
+    """Count the samples, and the filtered positive samples, for a list of plates in a single
+    aggregation, rather than querying each plate in turn.
+
+    Arguments:
+        plate_barcodes {List[str]} -- The barcodes of the plates to count samples for.
+
+    Returns:
+        {Dict[str, Dict[str, int]]} -- A mapping of plate barcode to the "total" number of samples
+        and the number of filtered "positives" on that plate. Plates without any samples are not
+        present in the mapping and plates without filtered positive samples have no "positives" key.
+    """
+    if not plate_barcodes:
+        return {}
+
+    samples_collection = app.data.driver.db.samples
+    count_by_plate = {"$group": {"_id": f"${FIELD_PLATE_BARCODE}", "count": {"$sum": 1}}}
+
+    # The pipeline defines stages which execute in sequence
+    pipeline = [
+        # 1. We are only interested in the samples for the requested plates
+        {"$match": {FIELD_PLATE_BARCODE: {"$in": list(plate_barcodes)}}},
+        # 2. Then count all the samples and the filtered positive samples of each plate
+        {
+            "$facet": {
+                "totals": [count_by_plate],
+                "positives": [STAGE_MATCH_FILTERED_POSITIVE, count_by_plate],
+            }
+        },
+    ]
+
+    counts: Dict[str, Dict[str, int]] = {}
+    for result in samples_collection.aggregate(pipeline):
+        for total in result["totals"]:
+            counts[total["_id"]] = {FIELD_PLATE_SUMMARY_TOTAL: total["count"]}
+        for positives in result["positives"]:
+            counts[positives["_id"]][FIELD_PLATE_SUMMARY_POSITIVES] = positives["count"]
+
+    logger.info(f"Found samples for {len(counts)} of {len(plate_barcodes)} plates")
+
+    return counts
@@ -1,16 +1,130 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple, TypeVar
+
 import sqlalchemy
-from sqlalchemy import MetaData
+from sqlalchemy import MetaData, Table
 from sqlalchemy.engine.base import Engine
+from sqlalchemy.exc import OperationalError
+
+logger = logging.getLogger(__name__)
+
+# MySQL errors after which the transaction has been rolled back and can be tried again
+MYSQL_ER_LOCK_WAIT_TIMEOUT = 1205
+MYSQL_ER_LOCK_DEADLOCK = 1213
+
+T = TypeVar("T")
+
+# Engines (and so their connection pools) and reflected tables are shared by the whole process
+_engines: Dict[Tuple[str, Optional[str]], Engine] = {}
+_tables: Dict[Tuple[str, str], Tuple[Table, float]] = {}
+_registry_lock = threading.Lock()
 
 
 def create_mysql_connection_engine(connection_string: str, database: str = None) -> Engine:
     create_engine_string = f"mysql+pymysql://{connection_string}"
     if database:
         create_engine_string += f"/{database}"
-    return sqlalchemy.create_engine(create_engine_string, pool_recycle=3600)
+    return sqlalchemy.create_engine(create_engine_string, pool_recycle=3600, pool_pre_ping=True)
+
+
+def get_mysql_connection_engine(connection_string: str, database: str = None) -> Engine:
+    """Get the engine for a connection string and database, creating it the first time it is
+    requested. The same engine, and so the same connection pool, is returned to every caller in the
+    process.
+
+    Arguments:
+        connection_string {str} -- the connection string, without the driver prefix
+        database {str} -- the name of the database (default: {None})
+
+    Returns:
+        Engine -- the shared engine
+    """
+    key = (connection_string, database)
+    with _registry_lock:
+        engine = _engines.get(key)
+        if engine is None:
+            engine = create_mysql_connection_engine(connection_string, database)
+            _engines[key] = engine
+
+    return engine
+
+
+def get_table(sql_engine: Engine, table_name: str, max_age: Optional[float] = None) -> Table:
+    """Get a table reflected from the database of an engine. Only the requested table is reflected
+    and the reflection is cached for the process.
+
+    Arguments:
+        sql_engine {Engine} -- the engine of the database with the table
+        table_name {str} -- the name of the table
+        max_age {Optional[float]} -- the number of seconds after which a cached table is reflected
+        again; otherwise the cached table never expires (default: {None})
+
+    Returns:
+        Table -- the reflected table
+    """
+    key = (str(sql_engine.url), table_name)
+    with _registry_lock:
+        cached = _tables.get(key)
+
+    if cached is not None:
+        table, reflected_at = cached
+        if max_age is None or (time.monotonic() - reflected_at) < max_age:
+            return table
+
+    metadata = MetaData()
+    metadata.reflect(bind=sql_engine, only=[table_name])
+    table = metadata.tables[table_name]
+
+    with _registry_lock:
+        _tables[key] = (table, time.monotonic())
+
+    return table
+
+
+def clear_registry() -> None:
+    """Dispose of all the shared engines and forget the cached tables."""
+    with _registry_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+        _tables.clear()
+
+
+def is_deadlock_error(error: OperationalError) -> bool:
+    """Whether a MySQL error is a deadlock or a lock wait timeout.
+
+    Arguments:
+        error {OperationalError} -- the error raised by the database
+
+    Returns:
+        bool -- True if the transaction which raised the error can be tried again
+    """
+    args = getattr(error.orig, "args", ())
+    return len(args) > 0 and args[0] in (MYSQL_ER_LOCK_DEADLOCK, MYSQL_ER_LOCK_WAIT_TIMEOUT)
+
+
+def with_deadlock_retry(transaction: Callable[[], T], attempts: int, backoff_seconds: float) -> T:
+    """Run a transaction, running it again when it is rolled back because of a deadlock or a lock
+    wait timeout, waiting twice as long between each attempt.
+
+    Arguments:
+        transaction {Callable[[], T]} -- the transaction to run
+        attempts {int} -- the maximum number of times to run the transaction
+        backoff_seconds {float} -- how long to wait before the second attempt
 
+    Returns:
+        T -- the result of the transaction
+    """
+    attempt = 1
+    while True:
+        try:
+            return transaction()
+        except OperationalError as e:
+            if attempt >= attempts or not is_deadlock_error(e):
+                raise
 
-def get_table(sql_engine: Engine, table_name: str):
-    metadata = MetaData(sql_engine)
-    metadata.reflect()
-    return metadata.tables[table_name]
+            logger.warning(f"Transaction failed (attempt {attempt} of {attempts}): {e.orig}")
+            time.sleep(backoff_seconds * (2 ** (attempt - 1)))
+            attempt += 1
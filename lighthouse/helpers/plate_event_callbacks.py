@@ -15,21 +15,45 @@ action. For example the default _no_callback still returns a success,
 despite not doing anything, as this is the correct action for event types
 without callbacks.
 
+When PLATE_EVENT_CALLBACKS_ASYNC is set, dispatch_callbacks hands the message
+to a worker which fires the callbacks in the background, on a bounded number
+of threads. A callback which fails, including a scan rejected by labwhere, is
+retried with an exponential backoff; once all the attempts have failed the
+message and the errors are recorded in the plate_event_callback_failures
+collection. The queued messages are only held in memory: those not fired yet
+when lighthouse stops are lost.
+
+When LABWHERE_SCAN_COALESCE_SECONDS is greater than 0, transfers of labware to
+the bin are buffered and merged by a ScanCoalescer, so that the transfers of a
+busy run are recorded in labwhere with a few scans. Callbacks fired inline wait
+for their scan to be sent and return its result.
+
 This file contains the following functions:
 
   * fire_callbacks - fires the callbacks for the passed message
+  * dispatch_callbacks - fires the callbacks for the passed message, in the
+    background when enabled
+  * get_callback_worker - gets the callback worker of the current app
+  * get_scan_coalescer - gets the labwhere scan coalescer of the current app
 """
 
+import heapq
+import itertools
 import logging
+import threading
+import time
+from datetime import datetime
 from typing import List, Tuple
 
 from flask import current_app as app
 from lighthouse.constants import PLATE_EVENT_SOURCE_ALL_NEGATIVES, PLATE_EVENT_SOURCE_COMPLETED
-from lighthouse.helpers.labwhere import set_locations_in_labwhere
+from lighthouse.helpers.labwhere import ScanCoalescer, set_locations_in_labwhere
 from lighthouse.messages.message import Message
 
 logger = logging.getLogger(__name__)
 
+_worker_lock = threading.Lock()
+
 
 def fire_callbacks(event: Message) -> Tuple[bool, List[str]]:
     """Fire any callbacks set up for a particular event type
@@ -46,6 +70,222 @@ def fire_callbacks(event: Message) -> Tuple[bool, List[str]]:
     return callback(event)
 
 
+def dispatch_callbacks(event: Message) -> Tuple[bool, List[str]]:
+    """Fire any callbacks set up for a particular event type. When
+    PLATE_EVENT_CALLBACKS_ASYNC is set the callbacks are fired in the background
+    and this returns straight away.
+
+    Arguments:
+        event {Message} -- The event for which to fire a callback
+
+    Returns:
+        {bool} -- True if the operation completed (or was queued) successfully
+        {[str]} -- Any errors firing the callbacks, otherwise an empty array.
+    """
+    if not app.config["PLATE_EVENT_CALLBACKS_ASYNC"]:
+        return fire_callbacks(event)
+
+    get_callback_worker().submit(event)
+    return True, []
+
+
+class CallbackWorker:
+    """Fires the callbacks of events on a bounded number of background threads,
+    retrying those which fail with an exponential backoff.
+
+    Retries are kept in a queue ordered by when they are due, so a callback
+    waiting for a retry does not hold a thread.
+    """
+
+    def __init__(self, flask_app):
+        self._app = flask_app
+        self._max_workers = flask_app.config["PLATE_EVENT_CALLBACK_WORKERS"]
+        self._attempts = flask_app.config["PLATE_EVENT_CALLBACK_RETRY_ATTEMPTS"]
+        self._backoff = flask_app.config["PLATE_EVENT_CALLBACK_RETRY_BACKOFF_SECONDS"]
+        self._max_backoff = flask_app.config["PLATE_EVENT_CALLBACK_RETRY_MAX_BACKOFF_SECONDS"]
+
+        # (due, sequence, event, attempt); the sequence keeps events due at the same time in order
+        self._tasks: List[Tuple[float, int, Message, int]] = []
+        self._sequence = itertools.count()
+        self._running = 0
+        self._threads: List[threading.Thread] = []
+        self._condition = threading.Condition()
+
+    def submit(self, event: Message, attempt: int = 1, delay: float = 0) -> None:
+        """Queue the callbacks of an event to be fired.
+
+        Arguments:
+            event {Message} -- The event for which to fire a callback
+            attempt {int} -- The number of the attempt (default: {1})
+            delay {float} -- The number of seconds to wait before firing (default: {0})
+        """
+        with self._condition:
+            due = time.monotonic() + delay
+            heapq.heappush(self._tasks, (due, next(self._sequence), event, attempt))
+            if len(self._threads) < self._max_workers:
+                thread = threading.Thread(
+                    target=self._run, name="lighthouse-plate-event-callbacks", daemon=True
+                )
+                self._threads.append(thread)
+                thread.start()
+
+            self._condition.notify()
+
+    def pending(self) -> int:
+        """The number of events queued or firing."""
+        with self._condition:
+            return len(self._tasks) + self._running
+
+    def wait_until_idle(self, timeout: float) -> bool:
+        """Wait for all the queued events to be fired, including their retries.
+
+        Arguments:
+            timeout {float} -- The maximum number of seconds to wait
+
+        Returns:
+            {bool} -- True if all the events have been fired
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self._tasks or self._running:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+
+        return True
+
+    def _run(self) -> None:
+        with self._app.app_context():
+            while True:
+                event, attempt = self._next_task()
+                try:
+                    self._fire(event, attempt)
+                except Exception as e:
+                    logger.exception(e)
+                finally:
+                    with self._condition:
+                        self._running -= 1
+                        self._condition.notify_all()
+
+    def _next_task(self) -> Tuple[Message, int]:
+        with self._condition:
+            while True:
+                if not self._tasks:
+                    self._condition.wait()
+                    continue
+
+                wait_for = self._tasks[0][0] - time.monotonic()
+                if wait_for > 0:
+                    self._condition.wait(wait_for)
+                    continue
+
+                _, _, event, attempt = heapq.heappop(self._tasks)
+                self._running += 1
+                return event, attempt
+
+    def _fire(self, event: Message, attempt: int) -> None:
+        try:
+            success, errors = fire_callbacks(event)
+        except Exception as e:
+            success, errors = False, [f"{type(e).__name__}: {str(e)}"]
+
+        if success:
+            return
+
+        if attempt < self._attempts:
+            delay = min(self._backoff * 2 ** (attempt - 1), self._max_backoff)
+            logger.warning(
+                f"Callbacks of '{event.event_type()}' event failed (attempt {attempt}), "
+                f"retrying in {delay} seconds: {errors}"
+            )
+            self.submit(event, attempt + 1, delay)
+            return
+
+        logger.error(
+            f"Callbacks of '{event.event_type()}' event failed after {attempt} attempts: {errors}"
+        )
+        _record_callback_failure(event, errors, attempt)
+
+
+def get_callback_worker() -> CallbackWorker:
+    """Get the callback worker of the current app, creating it on first use.
+
+    Returns:
+        {CallbackWorker} -- The app's callback worker
+    """
+    with _worker_lock:
+        worker = app.extensions.get("plate_event_callback_worker")
+        if worker is None:
+            worker = CallbackWorker(app._get_current_object())
+            app.extensions["plate_event_callback_worker"] = worker
+
+    return worker
+
+
+def get_scan_coalescer() -> ScanCoalescer:
+    """Get the labwhere scan coalescer of the current app, creating it on first
+    use. Failed scans are retried like callbacks.
+
+    Returns:
+        {ScanCoalescer} -- The app's scan coalescer
+    """
+    with _worker_lock:
+        coalescer = app.extensions.get("labwhere_scan_coalescer")
+        if coalescer is None:
+            coalescer = ScanCoalescer(
+                app._get_current_object(),
+                window_seconds=app.config["LABWHERE_SCAN_COALESCE_SECONDS"],
+                max_labware=app.config["LABWHERE_SCAN_MAX_LABWARE"],
+                attempts=app.config["PLATE_EVENT_CALLBACK_RETRY_ATTEMPTS"],
+                backoff_seconds=app.config["PLATE_EVENT_CALLBACK_RETRY_BACKOFF_SECONDS"],
+                max_backoff_seconds=app.config["PLATE_EVENT_CALLBACK_RETRY_MAX_BACKOFF_SECONDS"],
+                on_failure=_record_scan_failure,
+            )
+            app.extensions["labwhere_scan_coalescer"] = coalescer
+
+    return coalescer
+
+
+def _record_callback_failure(event: Message, errors: List[str], attempts: int) -> None:
+    """Record the callbacks of an event which failed in the
+    plate_event_callback_failures collection, so they can be investigated and
+    replayed."""
+    app.data.driver.db.plate_event_callback_failures.insert_one(
+        {
+            "event_type": event.event_type(),
+            "event": event.message,
+            "errors": errors,
+            "attempts": attempts,
+            "failed_at": datetime.utcnow(),
+        }
+    )
+
+
+def _record_scan_failure(
+    user_barcode: str,
+    location_barcode: str,
+    labware_barcodes: List[str],
+    errors: List[str],
+    attempts: int,
+) -> None:
+    """Record a coalesced labwhere scan which failed in the
+    plate_event_callback_failures collection."""
+    app.data.driver.db.plate_event_callback_failures.insert_one(
+        {
+            "event_type": "labwhere_scan",
+            "scan": {
+                "user_barcode": user_barcode,
+                "location_barcode": location_barcode,
+                "labware_barcodes": labware_barcodes,
+            },
+            "errors": errors,
+            "attempts": attempts,
+            "failed_at": datetime.utcnow(),
+        }
+    )
+
+
 def _no_callback(event: Message) -> Tuple[bool, List[str]]:
     """Do nothing, but return a success"""
     logger.debug("_no_callback")
@@ -59,11 +299,33 @@ def _labwhere_transfer_to_bin(event: Message) -> Tuple[bool, List[str]]:
         labware_barcodes = _labware_barcodes(event)
         location_barcode = _labwhere_destroyed_barcode()
         robot_barcode = _robot_barcode(event)
-        set_locations_in_labwhere(
+        if app.config["LABWHERE_SCAN_COALESCE_SECONDS"] > 0:
+            scan = get_scan_coalescer().add(
+                labware_barcodes=labware_barcodes,
+                location_barcode=location_barcode,
+                user_barcode=robot_barcode,
+            )
+            # failures of scans fired in the background are recorded by the coalescer, but those
+            # fired inline are reported to the caller like uncoalesced scans
+            if app.config["PLATE_EVENT_CALLBACKS_ASYNC"]:
+                return True, []
+
+            if not scan.wait(app.config["LABWHERE_SCAN_WAIT_SECONDS"]):
+                return False, ["Timed out waiting for the LabWhere scan"]
+
+            return not scan.errors, scan.errors
+
+        response = set_locations_in_labwhere(
             labware_barcodes=labware_barcodes,
             location_barcode=location_barcode,
             user_barcode=robot_barcode,
         )
+        # a scan rejected by LabWhere fails the callback only when callbacks are fired in the
+        # background, where it is retried and recorded; callbacks fired inline succeed whatever the
+        # response, so that robots are answered as they were before callbacks could be retried
+        if not response.ok and app.config["PLATE_EVENT_CALLBACKS_ASYNC"]:
+            return False, [f"LabWhere responded with status {response.status_code}"]
+
         return True, []
     except Exception as e:
         return False, [f"{type(e).__name__}: {str(e)}"]
@@ -0,0 +1,532 @@
+"""Create plates in Sequencescape, in the request or as background jobs
+
+Creating a plate from its barcode runs a chain of calls: the positive samples are fetched from
+Mongo, COG UK barcodes are added to them from baracoda, the plate is sent to Sequencescape and the
+COG UK ids are written to the MLWH. create_plate runs the chain and returns the response of the
+POST /plates/new endpoint.
+
+When PLATE_JOBS_ASYNC is set, the endpoint enqueues a job in the plate_jobs collection instead and
+returns straight away. A pool of PLATE_JOB_WORKERS threads, started with the first request served
+by the app, claims the queued jobs in the order they were enqueued and runs the chain, recording
+the stage each job has reached and, once it has finished, its response. Each stage renews the claim
+of the worker for PLATE_JOB_CLAIM_SECONDS. A job whose claim has expired, e.g. because its process
+died, is queued again if it had not started sending the plate to Sequencescape, and is marked as
+failed otherwise, as the plate may already be in Sequencescape. A worker which has lost the claim
+of its job stops before sending the plate to Sequencescape; once the plate has been sent the worker
+always finishes the job, so that the COG UK ids reach the MLWH.
+
+create_plates runs the same chain for several plates at once: the samples of all the plates are
+fetched with one aggregation, the COG UK barcodes of each centre with one request to baracoda, the
+plates are sent to Sequencescape at most PLATES_BULK_MAX_CONCURRENT_SS at once and the COG UK ids
+of all the plates are written to the MLWH with one update.
+
+This file contains the following functions:
+
+  * create_plate - create a plate in Sequencescape from its barcode
+  * create_plates - create several plates in Sequencescape from their barcodes
+  * enqueue_plate_job - enqueue a job to create a plate
+  * get_plate_job - get a job to create a plate
+  * get_plate_job_workers - get the pool of job workers of the current app
+  * run_next_plate_job - claim the oldest queued job and run it
+"""
+import logging
+import os
+import socket
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from functools import partial
+from http import HTTPStatus
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from bson.errors import InvalidId  # type: ignore
+from bson.objectid import ObjectId  # type: ignore
+from flask import current_app as app
+from flask import g
+from lighthouse.constants import FIELD_PLATE_BARCODE
+from lighthouse.exceptions import PlateJobClaimLostError
+from lighthouse.helpers.concurrency import run_each_concurrently
+from lighthouse.helpers.plates import (
+    add_cog_barcodes,
+    add_cog_barcodes_to_plates,
+    create_post_body,
+    get_positive_samples,
+    get_positive_samples_for_plates,
+    send_to_ss,
+    update_mlwh_with_cog_uk_ids,
+)
+from lighthouse.helpers.timing import StageTimer, timed_stage
+from pymongo import ReturnDocument  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+PLATE_JOB_STATUS_QUEUED = "queued"
+PLATE_JOB_STATUS_RUNNING = "running"
+PLATE_JOB_STATUS_COMPLETED = "completed"
+PLATE_JOB_STATUS_FAILED = "failed"
+
+PLATE_JOB_STAGE_QUEUED = "queued"
+PLATE_JOB_STAGE_FETCHING_SAMPLES = "fetching_samples"
+PLATE_JOB_STAGE_ADDING_COG_BARCODES = "adding_cog_barcodes"
+PLATE_JOB_STAGE_SENDING_TO_SS = "sending_to_sequencescape"
+PLATE_JOB_STAGE_UPDATING_MLWH = "updating_mlwh"
+PLATE_JOB_STAGE_DONE = "done"
+
+# the stages of a job before anything is sent to Sequencescape, from which it can be run again
+PLATE_JOB_STAGES_BEFORE_SS = [
+    PLATE_JOB_STAGE_QUEUED,
+    PLATE_JOB_STAGE_FETCHING_SAMPLES,
+    PLATE_JOB_STAGE_ADDING_COG_BARCODES,
+]
+
+_workers_lock = threading.Lock()
+
+
+def create_plate(
+    barcode: str, on_stage: Optional[Callable[[str], None]] = None
+) -> Tuple[Dict[str, Any], int]:
+    """Create a plate in Sequencescape from the positive samples of a plate barcode and write the
+    COG UK ids of the samples to the MLWH.
+
+    Arguments:
+        barcode {str} -- the barcode of the plate
+        on_stage {Optional[Callable[[str], None]]} -- called with each stage of the chain as it
+        starts; it may raise PlateJobClaimLostError to stop the chain before the plate is sent to
+        Sequencescape (default: {None})
+
+    Returns:
+        Tuple[Dict[str, Any], int] -- the JSON response and its status code
+    """
+
+    @contextmanager
+    def stage(name: str) -> Iterator[None]:
+        if on_stage is not None:
+            on_stage(name)
+        with timed_stage(name):
+            yield
+
+    try:
+        # get samples for barcode
+        with stage(PLATE_JOB_STAGE_FETCHING_SAMPLES):
+            samples = get_positive_samples(barcode)
+
+        if not samples:
+            return {"errors": ["No samples for this barcode: " + barcode]}, HTTPStatus.BAD_REQUEST
+
+        # add COG barcodes to samples
+        try:
+            with stage(PLATE_JOB_STAGE_ADDING_COG_BARCODES):
+                centre_prefix = add_cog_barcodes(samples)
+        except PlateJobClaimLostError:
+            raise
+        except (Exception) as e:
+            logger.exception(e)
+            return (
+                {"errors": ["Failed to add COG barcodes to plate: " + barcode]},
+                HTTPStatus.BAD_REQUEST,
+            )
+
+        body = create_post_body(barcode, samples)
+
+        with stage(PLATE_JOB_STAGE_SENDING_TO_SS):
+            response = send_to_ss(body)
+
+        if response.ok:
+            response_json = {
+                "data": {
+                    "plate_barcode": samples[0][FIELD_PLATE_BARCODE],
+                    "centre": centre_prefix,
+                    "number_of_positives": len(samples),
+                }
+            }
+
+            try:
+                with stage(PLATE_JOB_STAGE_UPDATING_MLWH):
+                    update_mlwh_with_cog_uk_ids(samples)
+            except (Exception) as e:
+                logger.exception(e)
+                return (
+                    {
+                        "errors": [
+                            (
+                                "Failed to update MLWH with COG UK ids. The samples should have "
+                                "been successfully inserted into Sequencescape."
+                            )
+                        ]
+                    },
+                    HTTPStatus.INTERNAL_SERVER_ERROR,
+                )
+        else:
+            response_json = response.json()
+
+        # return the JSON and status code directly from SS (act as a proxy)
+        return response_json, response.status_code
+    except PlateJobClaimLostError:
+        raise
+    except Exception as e:
+        logger.exception(e)
+        return {"errors": [type(e).__name__]}, HTTPStatus.INTERNAL_SERVER_ERROR
+
+
+def create_plates(barcodes: List[str]) -> List[Dict[str, Any]]:
+    """Create plates in Sequencescape from the positive samples of several plate barcodes and write
+    the COG UK ids of their samples to the MLWH, batching the calls each plate would make. When the
+    batched MLWH update fails, the plates are updated one at a time so that only the plates which
+    failed are reported as such.
+
+    Arguments:
+        barcodes {List[str]} -- the barcodes of the plates
+
+    Returns:
+        List[Dict[str, Any]] -- for each plate, in the order requested, its "barcode", the
+        "status_code" it would have been created with by POST /plates/new and the JSON response
+    """
+    results: Dict[str, Tuple[Dict[str, Any], int]] = {}
+
+    with timed_stage(PLATE_JOB_STAGE_FETCHING_SAMPLES):
+        samples_by_plate = get_positive_samples_for_plates(barcodes)
+    for barcode in barcodes:
+        if barcode not in samples_by_plate:
+            results[barcode] = (
+                {"errors": ["No samples for this barcode: " + barcode]},
+                HTTPStatus.BAD_REQUEST,
+            )
+
+    with timed_stage(PLATE_JOB_STAGE_ADDING_COG_BARCODES):
+        centre_prefixes, failures = add_cog_barcodes_to_plates(samples_by_plate)
+    for barcode, error in failures.items():
+        logger.error(f"Failed to add COG barcodes to plate {barcode}: {repr(error)}")
+        results[barcode] = (
+            {"errors": ["Failed to add COG barcodes to plate: " + barcode]},
+            HTTPStatus.BAD_REQUEST,
+        )
+
+    def send_plate_to_ss(barcode: str) -> Any:
+        return send_to_ss(create_post_body(barcode, samples_by_plate[barcode]))
+
+    with timed_stage(PLATE_JOB_STAGE_SENDING_TO_SS):
+        futures = run_each_concurrently(
+            {barcode: partial(send_plate_to_ss, barcode) for barcode in centre_prefixes},
+            app.config["PLATES_BULK_MAX_CONCURRENT_SS"],
+        )
+
+    created_barcodes = []
+    for barcode, future in futures.items():
+        error = future.exception()
+        if error is not None:
+            logger.error(f"Failed to send plate {barcode} to SS: {repr(error)}")
+            results[barcode] = {"errors": [type(error).__name__]}, HTTPStatus.INTERNAL_SERVER_ERROR
+            continue
+
+        response = future.result()
+        if response.ok:
+            created_barcodes.append(barcode)
+            results[barcode] = (
+                {
+                    "data": {
+                        "plate_barcode": barcode,
+                        "centre": centre_prefixes[barcode],
+                        "number_of_positives": len(samples_by_plate[barcode]),
+                    }
+                },
+                response.status_code,
+            )
+        else:
+            results[barcode] = response.json(), response.status_code
+
+    if created_barcodes:
+        with timed_stage(PLATE_JOB_STAGE_UPDATING_MLWH):
+            failed_barcodes = __update_mlwh_for_plates(created_barcodes, samples_by_plate)
+        for barcode in failed_barcodes:
+            results[barcode] = (
+                {
+                    "errors": [
+                        (
+                            "Failed to update MLWH with COG UK ids. The samples should have "
+                            "been successfully inserted into Sequencescape."
+                        )
+                    ]
+                },
+                HTTPStatus.INTERNAL_SERVER_ERROR,
+            )
+
+    return [
+        {"barcode": barcode, "status_code": int(results[barcode][1]), **results[barcode][0]}
+        for barcode in barcodes
+    ]
+
+
+class PlateJobWorkers:
+    """A pool of threads which run the queued jobs to create plates. The threads wake up when they
+    are notified of a new job and at least every PLATE_JOB_POLL_INTERVAL_SECONDS, so jobs enqueued
+    by other processes are run too."""
+
+    def __init__(self, flask_app, workers: int):
+        self._app = flask_app
+        self._interval = flask_app.config["PLATE_JOB_POLL_INTERVAL_SECONDS"]
+        self._owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._threads = [
+            threading.Thread(target=self._run, name=f"lighthouse-plate-jobs-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def notify(self) -> None:
+        self._wake.set()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._wake.set()
+
+    def _run(self) -> None:
+        with self._app.app_context():
+            while not self._stopped.is_set():
+                try:
+                    if not run_next_plate_job(self._owner):
+                        self._wake.wait(self._interval)
+                        self._wake.clear()
+                except Exception as e:
+                    logger.exception(e)
+                    self._stopped.wait(self._interval)
+
+
+def get_plate_job_workers() -> PlateJobWorkers:
+    """Get the pool of job workers of the current app, starting it on first use. The pool is
+    started with the first request served by the app when PLATE_JOBS_ASYNC and
+    PLATE_JOB_WORKERS_RUN are set, so that jobs queued before the app started are run.
+
+    Returns:
+        PlateJobWorkers -- the app's pool of job workers
+    """
+    with _workers_lock:
+        workers = app.extensions.get("plate_job_workers")
+        if workers is None:
+            workers = PlateJobWorkers(app._get_current_object(), app.config["PLATE_JOB_WORKERS"])
+            app.extensions["plate_job_workers"] = workers
+
+    return workers
+
+
+def enqueue_plate_job(barcode: str) -> str:
+    """Enqueue a job to create a plate from its barcode, and wake the job workers (unless
+    PLATE_JOB_WORKERS_RUN is False).
+
+    Arguments:
+        barcode {str} -- the barcode of the plate
+
+    Returns:
+        str -- the id of the job
+    """
+    now = datetime.utcnow()
+    result = app.data.driver.db.plate_jobs.insert_one(
+        {
+            "barcode": barcode,
+            "status": PLATE_JOB_STATUS_QUEUED,
+            "stage": PLATE_JOB_STAGE_QUEUED,
+            "created_at": now,
+            "updated_at": now,
+        }
+    )
+    logger.info(f"Enqueued job {result.inserted_id} to create a plate from barcode: {barcode}")
+
+    if app.config["PLATE_JOB_WORKERS_RUN"]:
+        get_plate_job_workers().notify()
+
+    return str(result.inserted_id)
+
+
+def get_plate_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """Get the stage and, once it has finished, the response of a job to create a plate.
+
+    Arguments:
+        job_id {str} -- the id of the job
+
+    Returns:
+        Optional[Dict[str, Any]] -- the job, or None if there is no job with this id
+    """
+    try:
+        object_id = ObjectId(job_id)
+    except (InvalidId, TypeError):
+        return None
+
+    job = app.data.driver.db.plate_jobs.find_one({"_id": object_id})
+    if job is None:
+        return None
+
+    return {
+        "id": str(job["_id"]),
+        "barcode": job["barcode"],
+        "status": job["status"],
+        "stage": job["stage"],
+        "created_at": job["created_at"].isoformat(),
+        "updated_at": job["updated_at"].isoformat(),
+        "response": job.get("response"),
+        "status_code": job.get("status_code"),
+    }
+
+
+def run_next_plate_job(owner: str) -> bool:
+    """Claim the oldest queued job to create a plate and run it.
+
+    Arguments:
+        owner {str} -- who is claiming the job
+
+    Returns:
+        bool -- True if a job was run, False if the queue is empty
+    """
+    plate_jobs = app.data.driver.db.plate_jobs
+    claim_seconds = app.config["PLATE_JOB_CLAIM_SECONDS"]
+
+    __recover_abandoned_plate_jobs()
+
+    now = datetime.utcnow()
+    job = plate_jobs.find_one_and_update(
+        {"status": PLATE_JOB_STATUS_QUEUED},
+        {
+            "$set": {
+                "status": PLATE_JOB_STATUS_RUNNING,
+                "claimed_by": owner,
+                "claimed_until": now + timedelta(seconds=claim_seconds),
+                "updated_at": now,
+            }
+        },
+        sort=[("created_at", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+    if job is None:
+        return False
+
+    claim = {"_id": job["_id"], "status": PLATE_JOB_STATUS_RUNNING, "claimed_by": owner}
+    # once the plate is being sent to Sequencescape the job is never run again (see
+    # __recover_abandoned_plate_jobs), so from then on this worker records the job whatever its
+    # claim
+    sent_to_ss = {"_id": job["_id"]}
+    job_filter = claim
+
+    def on_stage(stage: str) -> None:
+        # each stage renews the claim; before the plate is sent to Sequencescape the chain stops if
+        # the job has been claimed again, e.g. because it was thought to be abandoned, so that only
+        # one worker sends the plate to Sequencescape. After that the chain always finishes, so that
+        # the COG UK ids of a plate in Sequencescape reach the MLWH
+        nonlocal job_filter
+        now = datetime.utcnow()
+        result = plate_jobs.update_one(
+            job_filter,
+            {
+                "$set": {
+                    "stage": stage,
+                    "claimed_until": now + timedelta(seconds=claim_seconds),
+                    "updated_at": now,
+                }
+            },
+        )
+        if result.matched_count == 0 and job_filter is claim:
+            raise PlateJobClaimLostError(f"Job {job['_id']} was claimed by another worker")
+
+        if stage == PLATE_JOB_STAGE_SENDING_TO_SS:
+            job_filter = sent_to_ss
+
+    logger.info(f"Running job {job['_id']} to create a plate from barcode: {job['barcode']}")
+    # jobs are timed as requests are, see lighthouse.helpers.timing
+    g.stage_timer = StageTimer("plate_jobs.run")
+    try:
+        response, status_code = create_plate(job["barcode"], on_stage=on_stage)
+    except PlateJobClaimLostError as e:
+        g.pop("stage_timer")
+        logger.warning(f"Stopped running job {job['_id']}: {e}")
+        return True
+    g.pop("stage_timer").finish(status_code)
+
+    result = plate_jobs.update_one(
+        job_filter,
+        {
+            "$set": {
+                "status": PLATE_JOB_STATUS_COMPLETED,
+                "stage": PLATE_JOB_STAGE_DONE,
+                "response": response,
+                "status_code": int(status_code),
+                "updated_at": datetime.utcnow(),
+            },
+            "$unset": {"claimed_by": "", "claimed_until": ""},
+        },
+    )
+    if result.matched_count == 0:
+        logger.warning(f"Job {job['_id']} was claimed by another worker before it finished")
+
+    return True
+
+
+# Private methods
+
+
+def __update_mlwh_for_plates(
+    barcodes: List[str], samples_by_plate: Dict[str, List[Dict[str, Any]]]
+) -> List[str]:
+    """Write the COG UK ids of the samples of the plates to the MLWH with one batched update. If it
+    fails, e.g. because some of the samples have no match in the MLWH, each plate is updated on its
+    own to find those which failed; an update only sets the COG UK ids, so it can be repeated."""
+    try:
+        update_mlwh_with_cog_uk_ids(
+            [sample for barcode in barcodes for sample in samples_by_plate[barcode]]
+        )
+        return []
+    except Exception as e:
+        logger.exception(e)
+
+    if len(barcodes) == 1:
+        return barcodes
+
+    logger.warning(f"Updating the MLWH for each of the {len(barcodes)} plates on its own")
+    failed_barcodes = []
+    for barcode in barcodes:
+        try:
+            update_mlwh_with_cog_uk_ids(samples_by_plate[barcode])
+        except Exception as e:
+            logger.error(f"Failed to update the MLWH for plate {barcode}")
+            logger.exception(e)
+            failed_barcodes.append(barcode)
+
+    return failed_barcodes
+
+
+def __recover_abandoned_plate_jobs() -> None:
+    # a job still running after its claim has expired has been abandoned by its worker; it is run
+    # again if it had not started sending the plate to Sequencescape, and is failed otherwise as the
+    # plate may already have been created
+    plate_jobs = app.data.driver.db.plate_jobs
+    now = datetime.utcnow()
+    result = plate_jobs.update_many(
+        {
+            "status": PLATE_JOB_STATUS_RUNNING,
+            "claimed_until": {"$lt": now},
+            "stage": {"$in": PLATE_JOB_STAGES_BEFORE_SS},
+        },
+        {
+            "$set": {
+                "status": PLATE_JOB_STATUS_QUEUED,
+                "stage": PLATE_JOB_STAGE_QUEUED,
+                "updated_at": now,
+            },
+            "$unset": {"claimed_by": "", "claimed_until": ""},
+        },
+    )
+    if result.modified_count:
+        logger.warning(f"Queued {result.modified_count} abandoned plate jobs again")
+
+    result = plate_jobs.update_many(
+        {"status": PLATE_JOB_STATUS_RUNNING, "claimed_until": {"$lt": now}},
+        {
+            "$set": {
+                "status": PLATE_JOB_STATUS_FAILED,
+                "response": {"errors": ["The job was abandoned before it finished"]},
+                "status_code": int(HTTPStatus.INTERNAL_SERVER_ERROR),
+                "updated_at": now,
+            },
+            "$unset": {"claimed_by": "", "claimed_until": ""},
+        },
+    )
+    if result.modified_count:
+        logger.error(f"Marked {result.modified_count} abandoned plate jobs as failed")
@@ -0,0 +1,235 @@
+"""Maintain and read the plate_summaries collection
+
+The plate_summaries collection holds a document per plate barcode with the number of samples, the
+number of filtered positive samples and the uuid of the source plate, so that plate lookups read a
+single document instead of counting the samples of the plate.
+
+Summaries are updated incrementally: only plates with samples updated since the previous update
+(the watermark, kept in the watermarks collection) are recounted. Samples which are deleted or moved
+to another plate leave no trace for the incremental update to find, so every plate is periodically
+recounted by a full rebuild, which also removes the summaries of plates which no longer have
+samples.
+
+This file contains the following functions:
+
+  * get_plate_summaries_counts - read the sample counts of plates from their summaries
+  * update_plate_summaries - recount the plates changed since the watermark
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from flask import current_app as app
+from lighthouse.constants import (
+    FIELD_BARCODE,
+    FIELD_DATE_TESTED,
+    FIELD_FILTERED_POSITIVE,
+    FIELD_LH_SOURCE_PLATE_UUID,
+    FIELD_PLATE_BARCODE,
+    FIELD_PLATE_SUMMARY_POSITIVES,
+    FIELD_PLATE_SUMMARY_TOTAL,
+    FIELD_UPDATED_AT,
+)
+from lighthouse.helpers.mongo_db import count_samples_for_plates
+from pymongo import DeleteOne, UpdateOne  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+PLATE_SUMMARIES_WATERMARK = "plate_summaries"
+# the field of the watermark with the time of the last full rebuild
+PLATE_SUMMARIES_REBUILT_AT = "rebuilt_at"
+
+
+def get_plate_summaries_counts(plate_barcodes: List[str]) -> Dict[str, Dict[str, int]]:
+    """Read the sample counts of plates from the plate_summaries collection.
+
+    Arguments:
+        plate_barcodes {List[str]} -- The barcodes of the plates to read the counts for.
+
+    Returns:
+        {Dict[str, Dict[str, int]]} -- A mapping of plate barcode to the "total" number of samples
+        and the number of filtered "positives" on that plate, in the same format as
+        count_samples_for_plates. Plates without a summary are not present in the mapping.
+    """
+    if not plate_barcodes:
+        return {}
+
+    plate_summaries = app.data.driver.db.plate_summaries
+
+    counts: Dict[str, Dict[str, int]] = {}
+    for summary in plate_summaries.find({FIELD_PLATE_BARCODE: {"$in": list(plate_barcodes)}}):
+        plate_counts = {FIELD_PLATE_SUMMARY_TOTAL: summary[FIELD_PLATE_SUMMARY_TOTAL]}
+        if summary.get(FIELD_PLATE_SUMMARY_POSITIVES):
+            plate_counts[FIELD_PLATE_SUMMARY_POSITIVES] = summary[FIELD_PLATE_SUMMARY_POSITIVES]
+
+        counts[summary[FIELD_PLATE_BARCODE]] = plate_counts
+
+    logger.debug(f"Found summaries for {len(counts)} of {len(plate_barcodes)} plates")
+
+    return counts
+
+
+def update_plate_summaries(full_rebuild: bool = False) -> int:
+    """Recount the samples of the plates which have changed since the watermark and store the
+    results in the plate_summaries collection. Without a watermark, when the last full rebuild is
+    older than PLATE_SUMMARIES_FULL_REBUILD_SECONDS or when a full rebuild is requested, all the
+    plates are recounted instead.
+
+    Arguments:
+        full_rebuild {bool} -- Ignore the watermark and recount every plate (default: {False})
+
+    Returns:
+        {int} -- The number of plates recounted.
+    """
+    db = app.data.driver.db
+
+    # take the new watermark before querying so that samples updated during this run are recounted
+    # on the next one
+    started_at = datetime.utcnow()
+
+    db.plate_summaries.create_index(FIELD_PLATE_BARCODE, unique=True)
+
+    watermark = None if full_rebuild else __get_watermark()
+    rebuild_interval = timedelta(seconds=app.config["PLATE_SUMMARIES_FULL_REBUILD_SECONDS"])
+    if watermark is None or watermark[PLATE_SUMMARIES_REBUILT_AT] <= started_at - rebuild_interval:
+        logger.info("Rebuilding summaries of all plates")
+        plates_recounted = __rebuild_plate_summaries(started_at)
+        __set_watermark(started_at, rebuilt_at=started_at)
+    else:
+        # the watermark overlaps the previous run, as updated_at is written by the crawler with its
+        # own clock and samples written just before the previous run may have been committed after
+        # it; recounting a plate twice is harmless
+        since = watermark[FIELD_UPDATED_AT] - timedelta(
+            seconds=app.config["PLATE_SUMMARIES_WATERMARK_OVERLAP_SECONDS"]
+        )
+        logger.info(f"Updating summaries of plates changed since {since}")
+        plate_barcodes = db.samples.distinct(
+            FIELD_PLATE_BARCODE,
+            {FIELD_PLATE_BARCODE: {"$nin": ["", None]}, FIELD_UPDATED_AT: {"$gte": since}},
+        )
+
+        chunk_size = app.config["PLATE_SUMMARIES_CHUNK_SIZE"]
+        for i in range(0, len(plate_barcodes), chunk_size):
+            __update_plate_summaries_chunk(plate_barcodes[i : (i + chunk_size)])  # noqa: E203
+
+        plates_recounted = len(plate_barcodes)
+        __set_watermark(started_at)
+
+    logger.info(f"Updated summaries of {plates_recounted} plates")
+
+    return plates_recounted
+
+
+# Private methods
+
+
+def __update_plate_summaries_chunk(plate_barcodes: List[str]) -> None:
+    counts = count_samples_for_plates(plate_barcodes)
+
+    source_plates = app.data.driver.db.source_plates.find(
+        {FIELD_BARCODE: {"$in": plate_barcodes}}
+    )
+    source_plate_uuids = {
+        source_plate[FIELD_BARCODE]: source_plate.get(FIELD_LH_SOURCE_PLATE_UUID)
+        for source_plate in source_plates
+    }
+
+    updated_at = datetime.utcnow()
+    operations = []
+    for plate_barcode in plate_barcodes:
+        plate_counts = counts.get(plate_barcode)
+        if plate_counts is None:
+            # all the samples of the plate have been moved or removed
+            operations.append(DeleteOne({FIELD_PLATE_BARCODE: plate_barcode}))
+            continue
+
+        summary = {
+            FIELD_PLATE_SUMMARY_TOTAL: plate_counts[FIELD_PLATE_SUMMARY_TOTAL],
+            FIELD_PLATE_SUMMARY_POSITIVES: plate_counts.get(FIELD_PLATE_SUMMARY_POSITIVES, 0),
+            FIELD_LH_SOURCE_PLATE_UUID: source_plate_uuids.get(plate_barcode),
+            FIELD_UPDATED_AT: updated_at,
+        }
+        operations.append(
+            UpdateOne({FIELD_PLATE_BARCODE: plate_barcode}, {"$set": summary}, upsert=True)
+        )
+
+    if operations:
+        app.data.driver.db.plate_summaries.bulk_write(operations, ordered=False)
+
+
+def __rebuild_plate_summaries(started_at: datetime) -> int:
+    """Recount every plate with a single aggregation which merges its results into the
+    plate_summaries collection, then remove the summaries which were not rewritten, i.e. those of
+    plates which no longer have any samples."""
+    db = app.data.driver.db
+
+    is_filtered_positive = {
+        "$and": [
+            {"$eq": [f"${FIELD_FILTERED_POSITIVE}", True]},
+            {"$not": [{"$in": [{"$ifNull": [f"${FIELD_DATE_TESTED}", None]}, [None, ""]]}]},
+        ]
+    }
+    pipeline = [
+        {"$match": {FIELD_PLATE_BARCODE: {"$nin": ["", None]}}},
+        {
+            "$group": {
+                "_id": f"${FIELD_PLATE_BARCODE}",
+                FIELD_PLATE_SUMMARY_TOTAL: {"$sum": 1},
+                FIELD_PLATE_SUMMARY_POSITIVES: {"$sum": {"$cond": [is_filtered_positive, 1, 0]}},
+            }
+        },
+        {
+            "$lookup": {
+                "from": "source_plates",
+                "localField": "_id",
+                "foreignField": FIELD_BARCODE,
+                "as": "source_plates",
+            }
+        },
+        {
+            "$project": {
+                "_id": False,
+                FIELD_PLATE_BARCODE: "$_id",
+                FIELD_PLATE_SUMMARY_TOTAL: True,
+                FIELD_PLATE_SUMMARY_POSITIVES: True,
+                FIELD_LH_SOURCE_PLATE_UUID: {
+                    "$ifNull": [
+                        {"$arrayElemAt": [f"$source_plates.{FIELD_LH_SOURCE_PLATE_UUID}", 0]},
+                        None,
+                    ]
+                },
+                FIELD_UPDATED_AT: {"$literal": started_at},
+            }
+        },
+        {
+            "$merge": {
+                "into": "plate_summaries",
+                "on": FIELD_PLATE_BARCODE,
+                "whenMatched": "merge",
+                "whenNotMatched": "insert",
+            }
+        },
+    ]
+    db.samples.aggregate(pipeline)
+
+    db.plate_summaries.delete_many({FIELD_UPDATED_AT: {"$lt": started_at}})
+
+    return db.plate_summaries.count_documents({})
+
+
+def __get_watermark() -> Optional[Dict[str, datetime]]:
+    watermark = app.data.driver.db.watermarks.find_one({"_id": PLATE_SUMMARIES_WATERMARK})
+    if watermark is None or PLATE_SUMMARIES_REBUILT_AT not in watermark:
+        return None
+
+    return watermark
+
+
+def __set_watermark(updated_at: datetime, rebuilt_at: Optional[datetime] = None) -> None:
+    fields = {FIELD_UPDATED_AT: updated_at}
+    if rebuilt_at is not None:
+        fields[PLATE_SUMMARIES_REBUILT_AT] = rebuilt_at
+
+    app.data.driver.db.watermarks.update_one(
+        {"_id": PLATE_SUMMARIES_WATERMARK}, {"$set": fields}, upsert=True
+    )
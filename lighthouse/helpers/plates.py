@@ -1,5 +1,4 @@
 import logging
-from http import HTTPStatus
 from typing import Any, Dict, List, Optional, Tuple
 from uuid import uuid4
 
@@ -21,6 +20,7 @@ from lighthouse.constants import (
     FIELD_LH_SAMPLE_UUID,
     FIELD_LH_SOURCE_PLATE_UUID,
     FIELD_PLATE_BARCODE,
+    FIELD_PLATE_SUMMARY_POSITIVES,
     FIELD_RESULT,
     FIELD_RNA_ID,
     FIELD_ROOT_SAMPLE_ID,
@@ -40,12 +40,9 @@ from lighthouse.constants import (
     PLATE_EVENT_DESTINATION_FAILED,
     STAGE_MATCH_FILTERED_POSITIVE,
 )
-from lighthouse.exceptions import (
-    DataError,
-    MissingCentreError,
-    MissingSourceError,
-    MultipleCentresError,
-)
+from lighthouse.exceptions import MissingCentreError, MissingSourceError, MultipleCentresError
+from lighthouse.helpers.centres import get_centre_prefix_from_cache
+from lighthouse.helpers.cog_barcodes import fetch_cog_barcodes, take_cog_barcodes
 from lighthouse.helpers.dart_db import find_dart_source_samples_rows
 from lighthouse.helpers.events import (
     construct_destination_plate_message_subject,
@@ -55,9 +52,17 @@ from lighthouse.helpers.events import (
     get_message_timestamp,
     get_robot_uuid,
 )
-from lighthouse.helpers.mysql_db import create_mysql_connection_engine, get_table
+from lighthouse.helpers.http_client import UPSTREAM_SEQUENCESCAPE, get_http_client
+from lighthouse.helpers.mongo_db import count_samples_for_plates
+from lighthouse.helpers.mysql_db import (
+    get_mysql_connection_engine,
+    get_table,
+    with_deadlock_retry,
+)
+from lighthouse.helpers.plate_summaries import get_plate_summaries_counts
 from lighthouse.messages.message import Message
-from sqlalchemy.sql.expression import and_, bindparam
+from sqlalchemy import Column, MetaData, Table, and_
+from sqlalchemy.sql.expression import text
 
 logger = logging.getLogger(__name__)
 
@@ -69,6 +74,11 @@ logger = logging.getLogger(__name__)
 # On refactoring be careful to heed the WARNs in the code: not losing distributed functionality
 
 
+MLWH_COG_UK_IDS_TEMP_TABLE = "tmp_lighthouse_cog_uk_ids"
+# the columns of the MLWH lighthouse sample table which are loaded into the temporary table
+MLWH_COG_UK_IDS_COLUMNS = ["root_sample_id", "rna_id", "result", "cog_uk_id"]
+
+
 class UnmatchedSampleError(Exception):
     pass
 
@@ -79,68 +89,86 @@ def add_cog_barcodes(samples: List[Dict[str, str]]) -> Optional[str]:
     centre_prefix = get_centre_prefix(centre_name)
     num_samples = len(samples)
 
-    logger.info(f"Getting COG-UK barcodes for {num_samples} samples")
+    barcodes = None
+    if app.config["COG_BARCODE_RESERVOIR_ENABLE"]:
+        barcodes = take_cog_barcodes(centre_prefix, num_samples)
 
-    baracoda_url = (
-        f"http://{app.config['BARACODA_URL']}"
-        f"/barcodes_group/{centre_prefix}/new?count={num_samples}"
-    )
+    if barcodes is None:
+        logger.info(f"Getting COG-UK barcodes for {num_samples} samples")
+        barcodes = fetch_cog_barcodes(centre_prefix, num_samples)
 
-    retries = app.config["BARACODA_RETRY_ATTEMPTS"]
-    success_operation = False
-    except_obj = None
-
-    while retries > 0:
-        try:
-            response = requests.post(baracoda_url)
-            if response.status_code == HTTPStatus.CREATED:
-                success_operation = True
-                retries = 0
-                barcodes = response.json()["barcodes_group"]["barcodes"]
-                for (sample, barcode) in zip(samples, barcodes):
-                    sample[FIELD_COG_BARCODE] = barcode
-            else:
-                retries = retries - 1
-                logger.error("Unable to create COG barcodes")
-                logger.error(response.json())
-                except_obj = Exception("Unable to create COG barcodes")
-        except requests.ConnectionError:
-            retries = retries - 1
-            logger.error("Unable to access baracoda")
-            except_obj = requests.ConnectionError("Unable to access baracoda")
-
-    if not success_operation and except_obj is not None:
-        raise except_obj
+    for (sample, barcode) in zip(samples, barcodes):
+        sample[FIELD_COG_BARCODE] = barcode
 
     # return centre prefix
     # TODO: I didn't know how else to get centre prefix?
     return centre_prefix
 
 
-def get_centre_prefix(centre_name: str) -> Optional[str]:
-    logger.debug(f"Getting the prefix for '{centre_name}'")
-    try:
-        #  get the centre collection
-        centres = app.data.driver.db.centres
+def add_cog_barcodes_to_plates(
+    samples_by_plate: Dict[str, List[Dict[str, str]]]
+) -> Tuple[Dict[str, Optional[str]], Dict[str, Exception]]:
+    """Add COG-UK barcodes to the samples of several plates, getting the barcodes of all the plates
+    of a centre with a single request to baracoda (or a single take from its reservoir).
 
-        # use a case insensitive search for the centre name
-        filter = {"name": {"$regex": f"^(?i){centre_name}$"}}
+    Arguments:
+        samples_by_plate {Dict[str, List[Dict[str, str]]]} -- the samples of each plate, keyed by
+        plate barcode
 
-        assert centres.count_documents(filter) == 1
+    Returns:
+        Tuple[Dict[str, Optional[str]], Dict[str, Exception]] -- the centre prefix of each plate
+        which has barcodes and the error of each plate which does not, keyed by plate barcode
+    """
+    centre_prefixes: Dict[str, Optional[str]] = {}
+    failures: Dict[str, Exception] = {}
+    for plate_barcode, samples in samples_by_plate.items():
+        try:
+            centre_prefixes[plate_barcode] = get_centre_prefix(__confirm_centre(samples))
+        except Exception as e:
+            failures[plate_barcode] = e
 
-        centre = centres.find_one(filter)
+    plates_by_prefix: Dict[Optional[str], List[str]] = {}
+    for plate_barcode, centre_prefix in centre_prefixes.items():
+        plates_by_prefix.setdefault(centre_prefix, []).append(plate_barcode)
 
-        prefix = centre["prefix"]
+    for centre_prefix, plate_barcodes in plates_by_prefix.items():
+        prefix_samples = [
+            sample for plate_barcode in plate_barcodes for sample in samples_by_plate[plate_barcode]
+        ]
+        try:
+            barcodes = None
+            if app.config["COG_BARCODE_RESERVOIR_ENABLE"]:
+                barcodes = take_cog_barcodes(centre_prefix, len(prefix_samples))
+
+            if barcodes is None:
+                logger.info(
+                    f"Getting COG-UK barcodes for {len(prefix_samples)} samples of "
+                    f"{len(plate_barcodes)} plates"
+                )
+                barcodes = fetch_cog_barcodes(centre_prefix, len(prefix_samples))
+        except Exception as e:
+            for plate_barcode in plate_barcodes:
+                del centre_prefixes[plate_barcode]
+                failures[plate_barcode] = e
+            continue
 
-        logger.debug(f"Prefix for '{centre_name}' is '{prefix}'")
+        for (sample, barcode) in zip(prefix_samples, barcodes):
+            sample[FIELD_COG_BARCODE] = barcode
 
-        return prefix
-    except Exception as e:
-        logger.exception(e)
+    return centre_prefixes, failures
+
+
+def get_centre_prefix(centre_name: str) -> Optional[str]:
+    logger.debug(f"Getting the prefix for '{centre_name}'")
+
+    prefix = get_centre_prefix_from_cache(centre_name)
+    if prefix is None:
+        logger.error(f"No centre found with the name '{centre_name}'")
         return None
-    except AssertionError as e:
-        logger.exception(e)
-        raise DataError("Multiple centres with the same name")
+
+    logger.debug(f"Prefix for '{centre_name}' is '{prefix}'")
+
+    return prefix
 
 
 # WARN - on refactoring this be careful not to lose the distributed functionality where
@@ -190,6 +218,32 @@ def get_positive_samples(plate_barcode: str) -> Optional[List[Dict[str, Any]]]:
     return samples_for_barcode
 
 
+def get_positive_samples_for_plates(plate_barcodes: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+    """Get the filtered positive samples of several plates with a single aggregation.
+
+    Args:
+        plate_barcodes (List[str]): the barcodes of the plates to get samples for.
+
+    Returns:
+        Dict[str, List[Dict[str, Any]]]: the samples of each plate, keyed by plate barcode. Plates
+        without filtered positive samples are not present in the mapping.
+    """
+    samples_collection = app.data.driver.db.samples
+
+    pipeline = [
+        {"$match": {FIELD_PLATE_BARCODE: {"$in": plate_barcodes}}},
+        STAGE_MATCH_FILTERED_POSITIVE,
+    ]
+
+    samples_by_plate: Dict[str, List[Dict[str, Any]]] = {}
+    for sample in samples_collection.aggregate(pipeline):
+        samples_by_plate.setdefault(sample[FIELD_PLATE_BARCODE], []).append(sample)
+
+    logger.info(f"Found samples for {len(samples_by_plate)} of {len(plate_barcodes)} plates")
+
+    return samples_by_plate
+
+
 def get_positive_samples_count(plate_barcode: str) -> Optional[int]:
     """Get a list of documents which correspond to filtered positive samples for a specific plate.
 
@@ -199,6 +253,11 @@ def get_positive_samples_count(plate_barcode: str) -> Optional[int]:
     Returns:
         Optional[List[Dict[str, Any]]]: the list of samples for this plate.
     """
+    if app.config.get("PLATE_SUMMARIES_ENABLE", False):
+        summary_counts = get_plate_summaries_counts([plate_barcode]).get(plate_barcode)
+        if summary_counts is not None:
+            return summary_counts.get(FIELD_PLATE_SUMMARY_POSITIVES)
+
     samples_collection = app.data.driver.db.samples
     count_name = "filtered_positives_for_plate"
     # The pipeline defines stages which execute in sequence
@@ -220,70 +279,165 @@ def get_positive_samples_count(plate_barcode: str) -> Optional[int]:
     return samples_for_barcode_count
 
 
-def has_sample_data(plate_barcode: str) -> bool:
-    sample_count = count_samples({FIELD_PLATE_BARCODE: plate_barcode})
-    return sample_count > 0
+def get_plates_sample_counts(plate_barcodes: List[str]) -> Dict[str, Dict[str, int]]:
+    """Count the samples, and the filtered positive samples, for a list of plates without querying
+    each plate in turn. When plate summaries are enabled the counts are read from the
+    plate_summaries collection, falling back to a live count for plates without a summary.
 
+    Args:
+        plate_barcodes (List[str]): the barcodes of the plates to count samples for.
 
-def row_is_normal_sample(row):
-    control_value = getattr(row, FIELD_DART_CONTROL)
-    return control_value is None or control_value == "NULL" or control_value == ""
+    Returns:
+        Dict[str, Dict[str, int]]: a mapping of plate barcode to a dictionary with the "total"
+        number of samples and the number of filtered "positives" on that plate. Plates without any
+        samples are not present in the mapping and plates without filtered positive samples have no
+        "positives" key.
+    """
+    counts: Dict[str, Dict[str, int]] = {}
+    if app.config.get("PLATE_SUMMARIES_ENABLE", False):
+        counts = get_plate_summaries_counts(plate_barcodes)
 
+    missing_barcodes = [barcode for barcode in plate_barcodes if barcode not in counts]
+    if missing_barcodes:
+        counts.update(count_samples_for_plates(missing_barcodes))
 
-def rows_without_controls(rows):
-    return list(filter(lambda x: row_is_normal_sample(x), rows))
+    return counts
 
 
-def rows_with_controls(rows):
-    return list(filter(lambda x: not row_is_normal_sample(x), rows))
+def row_is_normal_sample(row):
+    control_value = getattr(row, FIELD_DART_CONTROL)
+    return control_value is None or control_value == "NULL" or control_value == ""
 
 
 def query_for_cherrypicked_samples(rows):
+    """A query for the candidate samples of the sample rows, using a single $in on the indexed
+    Root Sample ID. The candidates still need to be filtered with filter_cherrypicked_samples.
+    """
     if rows is None or (len(rows) == 0):
         return None
 
-    return {
-        "$or": [
-            {
-                FIELD_ROOT_SAMPLE_ID: getattr(row, FIELD_DART_ROOT_SAMPLE_ID),
-                FIELD_RNA_ID: getattr(row, FIELD_DART_RNA_ID),
-                FIELD_LAB_ID: getattr(row, FIELD_DART_LAB_ID),
-                FIELD_RESULT: {"$regex": "^positive", "$options": "i"},
-            }
-            for row in rows_without_controls(rows)
-        ]
+    sample_rows, _ = partition_rows(rows)
+    root_sample_ids = dict.fromkeys(getattr(row, FIELD_DART_ROOT_SAMPLE_ID) for row in sample_rows)
+
+    return {FIELD_ROOT_SAMPLE_ID: {"$in": list(root_sample_ids)}}
+
+
+def filter_cherrypicked_samples(rows, samples: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Keep the positive samples which match the root sample ID, RNA ID and lab ID of a sample
+    row. A result is positive when it starts with "positive", ignoring case.
+    """
+    sample_rows, _ = partition_rows(rows)
+    row_keys = {
+        (
+            getattr(row, FIELD_DART_ROOT_SAMPLE_ID),
+            getattr(row, FIELD_DART_RNA_ID),
+            getattr(row, FIELD_DART_LAB_ID),
+        )
+        for row in sample_rows
     }
 
+    cherrypicked_samples = []
+    for sample in samples:
+        result = sample.get(FIELD_RESULT)
+        key = (sample.get(FIELD_ROOT_SAMPLE_ID), sample.get(FIELD_RNA_ID), sample.get(FIELD_LAB_ID))
+        if isinstance(result, str) and result.lower().startswith("positive") and key in row_keys:
+            cherrypicked_samples.append(sample)
 
-def equal_row_and_sample(row, sample):
-    return (
-        (sample[FIELD_ROOT_SAMPLE_ID] == getattr(row, FIELD_DART_ROOT_SAMPLE_ID))
-        and (sample[FIELD_RNA_ID] == getattr(row, FIELD_DART_RNA_ID))
-        and (sample[FIELD_LAB_ID] == getattr(row, FIELD_DART_LAB_ID))
-        and sample[FIELD_RESULT].lower() == "positive"
-    )
+    return cherrypicked_samples
 
 
-def find_sample_matching_row(row, samples):
-    return next((sample for sample in samples if equal_row_and_sample(row, sample)), None)
+# WARN - on refactoring this be careful not to lose the distributed functionality where
+# None or empty dart rows returns None
+def find_cherrypicked_samples(rows) -> Optional[List[Dict[str, Any]]]:
+    """Find the positive mongo samples which were picked into the wells of the DART rows.
 
+    Arguments:
+        rows {List} -- the DART rows
 
-def join_rows_with_samples(rows, samples):
-    return [
-        {"row": row_to_dict(row), "sample": find_sample_matching_row(row, samples)}
-        for row in rows_without_controls(rows)
-    ]
+    Returns:
+        {Optional[List[Dict[str, Any]]]} -- the matching samples; otherwise None if there are no
+        rows
+    """
+    candidates = find_samples(query_for_cherrypicked_samples(rows))
+    if candidates is None:
+        return None
 
+    return filter_cherrypicked_samples(rows, candidates)
 
-def add_controls_to_samples(rows, samples):
-    control_samples = [
-        {"row": row_to_dict(row), "sample": None} for row in rows_with_controls(rows)
-    ]
-    return samples + control_samples
 
+def partition_rows(rows) -> Tuple[List[Any], List[Any]]:
+    """Separate DART rows into sample rows and control rows in a single pass.
+
+    Arguments:
+        rows {List} -- the DART rows
+
+    Returns:
+        {Tuple[List, List]} -- the sample rows and the control rows, each in their original order
+    """
+    sample_rows, control_rows = [], []
+    for row in rows:
+        if row_is_normal_sample(row):
+            sample_rows.append(row)
+        else:
+            control_rows.append(row)
+
+    return sample_rows, control_rows
+
+
+def index_samples_by_row_key(
+    samples: List[Dict[str, Any]]
+) -> Dict[Tuple[str, str, str], Dict[str, Any]]:
+    """Index the positive samples on the fields a DART row is matched on: root sample ID, RNA ID and
+    lab ID. Where several samples share a key the first is kept.
+
+    Arguments:
+        samples {List[Dict[str, Any]]} -- the mongo samples
 
-def check_matching_sample_numbers(rows, samples):
-    return len(samples) == len(rows_without_controls(rows))
+    Returns:
+        {Dict[Tuple[str, str, str], Dict[str, Any]]} -- the positive samples by key
+    """
+    index: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+    for sample in samples:
+        if sample[FIELD_RESULT].lower() == "positive":
+            key = (sample[FIELD_ROOT_SAMPLE_ID], sample[FIELD_RNA_ID], sample[FIELD_LAB_ID])
+            index.setdefault(key, sample)
+
+    return index
+
+
+def join_dart_rows_with_samples(
+    rows, samples: List[Dict[str, Any]]
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Join DART rows with the mongo samples they were picked from, in a single pass over each.
+
+    Arguments:
+        rows {List} -- the DART rows
+        samples {List[Dict[str, Any]]} -- the mongo samples
+
+    Returns:
+        {Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]} -- the sample rows joined with their
+        matching sample (or None), and the control rows, which have no sample
+    """
+    index = index_samples_by_row_key(samples)
+
+    joined_samples, joined_controls = [], []
+    for row in rows:
+        if row_is_normal_sample(row):
+            key = (
+                getattr(row, FIELD_DART_ROOT_SAMPLE_ID),
+                getattr(row, FIELD_DART_RNA_ID),
+                getattr(row, FIELD_DART_LAB_ID),
+            )
+            joined_samples.append({"row": row_to_dict(row), "sample": index.get(key)})
+        else:
+            joined_controls.append({"row": row_to_dict(row), "sample": None})
+
+    return joined_samples, joined_controls
+
+
+def join_rows_with_samples(rows, samples):
+    joined_samples, _ = join_dart_rows_with_samples(rows, samples)
+    return joined_samples
 
 
 def row_to_dict(row):
@@ -347,7 +501,7 @@ def send_to_ss(body: Dict[str, Any]) -> requests.Response:
     headers = {"X-Sequencescape-Client-Id": app.config["SS_API_KEY"]}
 
     try:
-        response = requests.post(ss_url, json=body, headers=headers)
+        response = get_http_client(UPSTREAM_SEQUENCESCAPE).post(ss_url, json=body, headers=headers)
         logger.debug(response.status_code)
     except requests.ConnectionError:
         raise requests.ConnectionError("Unable to access SS")
@@ -364,43 +518,9 @@ def update_mlwh_with_cog_uk_ids(samples: List[Dict[str, str]]) -> None:
     if len(samples) == 0:
         return None
 
-    # assign db_connection to avoid UnboundLocalError in 'finally' block, in case of exception
-    db_connection = None
     try:
-        data = []
-        for sample in samples:
-            # using 'b_' prefix for the keys because bindparam() doesn't allow you to use the real
-            # column names
-            data.append(
-                {
-                    "b_root_sample_id": sample[FIELD_ROOT_SAMPLE_ID],
-                    "b_rna_id": sample[FIELD_RNA_ID],
-                    "b_result": sample[FIELD_RESULT],
-                    "b_cog_uk_id": sample[FIELD_COG_BARCODE],
-                }
-            )
+        rows_matched = bulk_update_mlwh_with_cog_uk_ids(samples)
 
-        sql_engine = create_mysql_connection_engine(
-            app.config["WAREHOUSES_RW_CONN_STRING"], app.config["MLWH_DB"]
-        )
-        table = get_table(sql_engine, app.config["MLWH_LIGHTHOUSE_SAMPLE_TABLE"])
-
-        stmt = (
-            table.update()
-            .where(
-                and_(
-                    table.c.root_sample_id == bindparam("b_root_sample_id"),
-                    table.c.rna_id == bindparam("b_rna_id"),
-                    table.c.result == bindparam("b_result"),
-                )
-            )
-            .values(cog_uk_id=bindparam("b_cog_uk_id"))
-        )
-        db_connection = sql_engine.connect()
-
-        results = db_connection.execute(stmt, data)
-
-        rows_matched = results.rowcount
         if rows_matched != len(samples):
             msg = f"""
             Updating MLWH {app.config['MLWH_LIGHTHOUSE_SAMPLE_TABLE']} table with COG UK ids was
@@ -418,9 +538,71 @@ def update_mlwh_with_cog_uk_ids(samples: List[Dict[str, str]]) -> None:
         """
         logger.error(msg)
         raise
-    finally:
-        if db_connection is not None:
-            db_connection.close()
+
+
+def bulk_update_mlwh_with_cog_uk_ids(samples: List[Dict[str, str]]) -> int:
+    """Write the COG UK barcode of each sample to the MLWH with a set-based update: the samples
+    are loaded into a temporary table with a multi-row insert and the MLWH table is updated with a
+    single UPDATE joined to it, in chunks of MLWH_BULK_UPDATE_CHUNK_SIZE samples. A chunk which
+    fails because of a deadlock (or a lock wait timeout) is rolled back and tried again. The
+    statements are built from the reflected MLWH table, which is cached for
+    MLWH_TABLE_CACHE_SECONDS; the MLWH user needs the CREATE TEMPORARY TABLES privilege.
+
+    Arguments:
+        samples {List[Dict[str, str]]} -- list of samples to be updated
+
+    Returns:
+        int -- the number of rows in the MLWH matched by the samples
+    """
+    rows = [
+        {
+            "root_sample_id": sample[FIELD_ROOT_SAMPLE_ID],
+            "rna_id": sample[FIELD_RNA_ID],
+            "result": sample[FIELD_RESULT],
+            "cog_uk_id": sample[FIELD_COG_BARCODE],
+        }
+        for sample in samples
+    ]
+
+    sql_engine = get_mysql_connection_engine(
+        app.config["WAREHOUSES_RW_CONN_STRING"], app.config["MLWH_DB"]
+    )
+    mlwh_table = get_table(
+        sql_engine,
+        app.config["MLWH_LIGHTHOUSE_SAMPLE_TABLE"],
+        max_age=app.config["MLWH_TABLE_CACHE_SECONDS"],
+    )
+    chunk_size = app.config["MLWH_BULK_UPDATE_CHUNK_SIZE"]
+
+    # the temporary table copies the types (and collations) of the columns of the MLWH table
+    temp_table = Table(
+        MLWH_COG_UK_IDS_TEMP_TABLE,
+        MetaData(),
+        *[Column(name, mlwh_table.c[name].type) for name in MLWH_COG_UK_IDS_COLUMNS],
+        prefixes=["TEMPORARY"],
+    )
+
+    drop_temp_table = text(f"DROP TEMPORARY TABLE IF EXISTS {MLWH_COG_UK_IDS_TEMP_TABLE}")
+
+    rows_matched = 0
+    with sql_engine.connect() as db_connection:
+        # a pooled connection may still have the table if dropping it failed
+        db_connection.execute(drop_temp_table)
+        temp_table.create(db_connection)
+        try:
+            for i in range(0, len(rows), chunk_size):
+                chunk = rows[i : (i + chunk_size)]  # noqa: E203
+                rows_matched += with_deadlock_retry(
+                    lambda: __update_mlwh_cog_uk_ids_chunk(
+                        db_connection, mlwh_table, temp_table, chunk
+                    ),
+                    app.config["MLWH_DEADLOCK_RETRY_ATTEMPTS"],
+                    app.config["MLWH_DEADLOCK_RETRY_BACKOFF_SECONDS"],
+                )
+        finally:
+            db_connection.execute(drop_temp_table)
+
+    return rows_matched
 
 
 def map_to_ss_columns(samples: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
@@ -588,19 +770,20 @@ def construct_cherrypicking_plate_failed_message(
             logger.info(msg)
             errors.append(msg)
         else:
-            mongo_samples = find_samples(query_for_cherrypicked_samples(dart_samples))
+            mongo_samples = find_cherrypicked_samples(dart_samples)
             if mongo_samples is None:
                 return [
                     f"No sample data found in Mongo matching DART samples in plate '{barcode}'"
                 ], None
 
-            if not check_matching_sample_numbers(dart_samples, mongo_samples):
+            dart_sample_rows, dart_control_rows = partition_rows(dart_samples)
+            if len(mongo_samples) != len(dart_sample_rows):
                 return [
                     f"Mismatch in destination and source sample data for plate '{barcode}'"
                 ], None
 
             # Add sample subjects for control and non-control DART entries
-            dart_control_rows = [row_to_dict(row) for row in rows_with_controls(dart_samples)]
+            dart_control_rows = [row_to_dict(row) for row in dart_control_rows]
             subjects.extend([__sample_subject_for_dart_control_row(r) for r in dart_control_rows])
             subjects.extend([construct_mongo_sample_message_subject(s) for s in mongo_samples])
 
@@ -638,6 +821,29 @@ def construct_cherrypicking_plate_failed_message(
 # Private methods
 
 
+def __update_mlwh_cog_uk_ids_chunk(
+    db_connection, mlwh_table: Table, temp_table: Table, rows: List[Dict[str, str]]
+) -> int:
+    # a multiple-table UPDATE, as the WHERE clause refers to the temporary table
+    update = (
+        mlwh_table.update()
+        .where(
+            and_(
+                mlwh_table.c.root_sample_id == temp_table.c.root_sample_id,
+                mlwh_table.c.rna_id == temp_table.c.rna_id,
+                mlwh_table.c.result == temp_table.c.result,
+            )
+        )
+        .values(cog_uk_id=temp_table.c.cog_uk_id)
+    )
+    with db_connection.begin():
+        db_connection.execute(temp_table.delete())
+        db_connection.execute(temp_table.insert().values(rows))
+        results = db_connection.execute(update)
+
+    return results.rowcount
+
+
 def __ss_sample_subjects(samples):
     subjects = []
     for sample in samples:
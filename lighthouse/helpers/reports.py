@@ -3,9 +3,11 @@ import math
 import os
 import pathlib
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from http import HTTPStatus
-from typing import Dict, List, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import pandas as pd
 
@@ -19,14 +21,16 @@ from lighthouse.constants import (
     EVENT_CHERRYPICK_LAYOUT_SET,
     FIELD_COORDINATE,
     FIELD_DATE_TESTED,
+    FIELD_FILTERED_POSITIVE,
+    FIELD_PARSED_DATE_TESTED,
     FIELD_PLATE_BARCODE,
     FIELD_RESULT,
     FIELD_ROOT_SAMPLE_ID,
     FIELD_SOURCE,
     PLATE_EVENT_DESTINATION_CREATED,
-    STAGE_MATCH_FILTERED_POSITIVE,
 )
 from lighthouse.exceptions import ReportCreationError
+from lighthouse.helpers.dates_tested import DATE_TESTED_CONVERTED
 from lighthouse.helpers.labwhere import get_locations_from_labwhere
 from lighthouse.utils import pretty
 from pandas import DataFrame
@@ -35,6 +39,21 @@ from pymongo.collection import Collection  # type: ignore
 logger = logging.getLogger(__name__)
 PROJECT_ROOT = pathlib.Path(__file__).parent.parent.parent
 
+# the columns of the cherrypicked samples queries, which identify a sample in the report
+CHERRYPICKED_SAMPLES_COLUMNS = [
+    FIELD_ROOT_SAMPLE_ID,
+    FIELD_PLATE_BARCODE,
+    "Result_lower",
+    FIELD_COORDINATE,
+]
+
+REPORT_ROOT_SAMPLE_IDS_TEMP_TABLE = "tmp_report_root_sample_ids"
+# the Sentinel and Beckman queries join the plate barcodes to different columns, so each has a table
+REPORT_SENTINEL_PLATE_BARCODES_TEMP_TABLE = "tmp_report_sentinel_plate_barcodes"
+REPORT_BECKMAN_PLATE_BARCODES_TEMP_TABLE = "tmp_report_beckman_plate_barcodes"
+# the length of the key of a temporary table joined to a TEXT column, which cannot be a key itself
+REPORT_TEMP_TABLE_TEXT_KEY_LENGTH = 255
+
 
 def get_reports_details(filename: str = None) -> List[Dict[str, str]]:
     """Get the details of reports, including:
@@ -134,6 +153,46 @@ def map_labware_to_location(labware_barcodes):
     return labware_to_location_barcode_df
 
 
+class CherrypickedSampleKeys:
+    """The distinct rows found by the cherrypicked samples queries of a report, folded in chunk by
+    chunk as they are streamed from the warehouses. Only the distinct rows are held, rather than
+    the full result set of each query and a frame built from each of them."""
+
+    def __init__(self, chunk_size: int):
+        self._chunk_size = chunk_size
+        self._lock = threading.Lock()
+        # the columns of the results, which are the key columns until a chunk is read: a query
+        # without any rows is not read as any chunks
+        self._columns: List[str] = list(CHERRYPICKED_SAMPLES_COLUMNS)
+        self._rows: Dict[Tuple[Any, ...], None] = {}
+
+    def read_sql(self, sql: str, db_connection, params: Dict[str, Any] = None) -> None:
+        """Run a query with an unbuffered, server side, cursor and fold its rows in as they arrive.
+
+        Arguments:
+            sql {str} -- the query to run
+            db_connection -- the connection to run the query on
+            params {Dict[str, Any]} -- the parameters of the query (default: {None})
+        """
+        streaming_connection = db_connection.execution_options(stream_results=True)
+        for chunk in pd.read_sql(
+            sql, streaming_connection, params=params, chunksize=self._chunk_size
+        ):
+            with self._lock:
+                self._columns = list(chunk.columns)
+                self._rows.update(dict.fromkeys(chunk.itertuples(index=False, name=None)))
+
+    def to_dataframe(self) -> DataFrame:
+        """Build the frame of the distinct rows, in the order they were first found. The frame has
+        the columns of the results even if there are no rows.
+
+        Returns:
+            DataFrame -- the distinct rows
+        """
+        with self._lock:
+            return pd.DataFrame.from_records(list(self._rows), columns=self._columns)
+
+
 def get_cherrypicked_samples(root_sample_ids, plate_barcodes, chunk_size=50000):
     # Find which samples have been cherrypicked using MLWH & Events warehouse
     # Returns dataframe with 4 columns: those needed to uniquely identify the sample
@@ -141,54 +200,61 @@ def get_cherrypicked_samples(root_sample_ids, plate_barcodes, chunk_size=50000):
     # (= those that have an entry for the relevant event type in the event warehouse)
     # TODO: move into external method.
 
+    sql_engine = None
     try:
-        # Create an empty DataFrame to merge into
-        concat_frame = pd.DataFrame()
-
-        chunk_root_sample_ids = [
-            root_sample_ids[x : (x + chunk_size)]  # noqa: E203
-            for x in range(0, len(root_sample_ids), chunk_size)
-        ]
-
+        workers = app.config["REPORTS_WAREHOUSE_QUERY_WORKERS"]
         sql_engine = sqlalchemy.create_engine(
-            f"mysql+pymysql://{app.config['WAREHOUSES_RO_CONN_STRING']}", pool_recycle=3600
+            f"mysql+pymysql://{app.config['WAREHOUSES_RO_CONN_STRING']}",
+            pool_recycle=3600,
+            pool_size=workers,
+            max_overflow=0,
         )
-        db_connection = sql_engine.connect()
 
         mlwh_db = app.config["MLWH_DB"]
         events_wh_db = app.config["EVENTS_WH_DB"]
 
-        for chunk_root_sample_id in chunk_root_sample_ids:
-            params = {
-                "root_sample_ids": tuple(chunk_root_sample_id),
-                "plate_barcodes": tuple(plate_barcodes),
-            }
-
-            sentinel_sql = __sentinel_cherrypicked_samples_query(mlwh_db, events_wh_db)
-            sentinel_frame = pd.read_sql(sentinel_sql, db_connection, params=params)
-
-            # drop_duplicates is needed because the same 'root sample id' could pop up in two
-            # different batches, and then it would retrieve the same rows for that root sample id
-            # twice do reset_index after dropping duplicates to make sure the rows are numbered in
-            # a way that makes sense
-            concat_frame = (
-                concat_frame.append(sentinel_frame).drop_duplicates().reset_index(drop=True)
+        # when streaming, the rows of each query are folded into the distinct rows of the report as
+        # they arrive, rather than each result set being buffered and turned into a frame
+        sample_keys = None
+        read_sql: Callable[..., Optional[DataFrame]] = pd.read_sql
+        if app.config["REPORTS_WAREHOUSE_STREAM_RESULTS"]:
+            sample_keys = CherrypickedSampleKeys(app.config["REPORTS_WAREHOUSE_STREAM_CHUNK_SIZE"])
+            read_sql = sample_keys.read_sql
+
+        if app.config["REPORTS_WAREHOUSE_TEMP_TABLE_JOIN"]:
+            frames = __read_cherrypicked_frames_with_temp_tables(
+                sql_engine, mlwh_db, events_wh_db, root_sample_ids, plate_barcodes, read_sql
+            )
+        else:
+            frames = __read_cherrypicked_frames_in_chunks(
+                sql_engine,
+                mlwh_db,
+                events_wh_db,
+                root_sample_ids,
+                plate_barcodes,
+                chunk_size,
+                read_sql,
             )
 
-            beckman_sql = __beckman_cherrypicked_samples_query(mlwh_db, events_wh_db)
-            beckman_frame = pd.read_sql(beckman_sql, db_connection, params=params)
+        if sample_keys is not None:
+            return sample_keys.to_dataframe()
 
-            # again we concatenate dropping duplicates here (same reason as outlined above)
-            concat_frame = (
-                concat_frame.append(beckman_frame).drop_duplicates().reset_index(drop=True)
-            )
+        if not frames:
+            return pd.DataFrame()
 
-        return concat_frame
+        # drop_duplicates is needed because the same 'root sample id' could pop up in two different
+        # batches, and then it would retrieve the same rows for that root sample id twice, and
+        # because a sample could be cherrypicked by both workflows. Concatenating and dropping the
+        # duplicates once, rather than after each query, keeps this linear in the size of the
+        # report. Do reset_index after dropping duplicates to make sure the rows are numbered in a
+        # way that makes sense
+        return pd.concat(frames).drop_duplicates().reset_index(drop=True)
     except Exception as e:
         print("Error while connecting to MySQL", e)
         return None
     finally:
-        db_connection.close()
+        if sql_engine is not None:
+            sql_engine.dispose()
 
 
 def get_all_positive_samples(samples_collection: Collection) -> DataFrame:
@@ -214,52 +280,34 @@ def get_all_positive_samples(samples_collection: Collection) -> DataFrame:
         FIELD_COORDINATE: True,
     }
 
-    DATE_EXTRACTED = "extracted_date"
-    DATE_CONVERTED = "converted_date"
-    DATE_ERROR = "date_conversion_error"
-
     # The pipeline defines stages which execute in sequence
+    window_start = report_query_window_start()
     pipeline = [
-        # 1. First run the positive match stage
-        STAGE_MATCH_FILTERED_POSITIVE,
+        # 1. Find the filtered positive samples tested within the report window, using the parsed
+        # date tested (set by update_dates_tested) so that the match is supported by the
+        # filtered_positive_date_tested index. Samples which the update_dates_tested job has not
+        # reached yet have no parsed date tested, so they are matched too...
         {
-            # 2. We then need to extract the date using substring since most dates look like this:
-            # "2020-05-10 07:30:00 UTC" but the `dateFromString` function does not handle the
-            # timezone string "UTC"
-            "$addFields": {
-                DATE_EXTRACTED: {
-                    "$substrBytes": [f"${FIELD_DATE_TESTED}", 0, 19],
-                },
-            },
+            "$match": {
+                FIELD_FILTERED_POSITIVE: True,
+                "$or": [
+                    {FIELD_PARSED_DATE_TESTED: {"$gte": window_start}},
+                    {FIELD_PARSED_DATE_TESTED: {"$exists": False}},
+                ],
+            }
         },
+        # 2. ...and their date tested is parsed here to check that it is within the window
         {
-            # 3. Then add a date field which converts the extracted date string to a mongo date
-            # type using the specified format. If it cannot parse the date using the first format
-            # it tries with the other format found in the data
-            # TODO: handle the case that no format is matched
-            "$addFields": {
-                DATE_CONVERTED: {
-                    "$dateFromString": {
-                        "dateString": f"${DATE_EXTRACTED}",
-                        "format": "%Y-%m-%d %H:%M:%S",
-                        "timezone": "UTC",
-                        "onError": {
-                            "$dateFromString": {
-                                "dateString": f"${DATE_EXTRACTED}",
-                                "format": "%d/%m/%Y %H:%M",
-                                "timezone": "UTC",
-                                "onError": DATE_ERROR,
-                            },
-                        },
-                    },
-                },
-            },
+            "$match": {
+                "$expr": {
+                    "$gte": [
+                        {"$ifNull": [f"${FIELD_PARSED_DATE_TESTED}", DATE_TESTED_CONVERTED]},
+                        window_start,
+                    ]
+                }
+            }
         },
-        # 4. We only want documents which have valid dates that we can compare against
-        {"$match": {DATE_CONVERTED: {"$ne": DATE_ERROR}}},
-        # 5. Find all the document after a certain date
-        {"$match": {DATE_CONVERTED: {"$gte": report_query_window_start()}}},
-        # 6. Define which fields to have in the output documents
+        # 3. Define which fields to have in the output documents
         {"$project": projection},
     ]
 
@@ -422,12 +470,165 @@ def __convert_size(size_in_bytes: int) -> str:
     return f"{s} {size_name[i]}"
 
 
-def __sentinel_cherrypicked_samples_query(mlwh_db: str, events_wh_db: str) -> str:
+def __read_cherrypicked_frames_in_chunks(
+    sql_engine, mlwh_db, events_wh_db, root_sample_ids, plate_barcodes, chunk_size, read_sql
+) -> List[Optional[DataFrame]]:
+    """Run the Sentinel and Beckman queries for each chunk of root sample ids, passing the root
+    sample ids and plate barcodes as IN lists. The queries of each chunk and workflow are
+    independent, so they are run concurrently on a small pool of threads, each with its own
+    connection from the engine's pool. Each query is run with read_sql."""
+    chunk_root_sample_ids = [
+        root_sample_ids[x : (x + chunk_size)]  # noqa: E203
+        for x in range(0, len(root_sample_ids), chunk_size)
+    ]
+
+    workflow_queries = [
+        __sentinel_cherrypicked_samples_query(mlwh_db, events_wh_db),
+        __beckman_cherrypicked_samples_query(mlwh_db, events_wh_db),
+    ]
+
+    def read_frame(sql: str, params: Dict[str, Tuple[str, ...]]) -> Optional[DataFrame]:
+        db_connection = sql_engine.connect()
+        try:
+            return read_sql(sql, db_connection, params=params)
+        finally:
+            db_connection.close()
+
+    with ThreadPoolExecutor(
+        max_workers=app.config["REPORTS_WAREHOUSE_QUERY_WORKERS"],
+        thread_name_prefix="lighthouse-reports",
+    ) as executor:
+        futures = [
+            executor.submit(
+                read_frame,
+                sql,
+                {
+                    "root_sample_ids": tuple(chunk_root_sample_id),
+                    "plate_barcodes": tuple(plate_barcodes),
+                },
+            )
+            for chunk_root_sample_id in chunk_root_sample_ids
+            for sql in workflow_queries
+        ]
+        # the frames are merged in the order the queries were submitted, whichever finishes first
+        return [future.result() for future in futures]
+
+
+def __read_cherrypicked_frames_with_temp_tables(
+    sql_engine, mlwh_db, events_wh_db, root_sample_ids, plate_barcodes, read_sql
+) -> List[Optional[DataFrame]]:
+    """Load the root sample ids and plate barcodes of the report into temporary tables and run the
+    Sentinel and Beckman queries joined to them, with read_sql, so that the statements have the
+    same size, and the same plan, however many samples the report has. Temporary tables belong to
+    the session which created them, so everything runs on one connection."""
+    if len(root_sample_ids) == 0 or len(plate_barcodes) == 0:
+        return []
+
+    # each temporary table holds the distinct values of its column as its primary key, with the
+    # type, character set and collation of the MLWH column it is joined to:
+    # (table, column, values, joined table, joined column)
+    temp_tables = [
+        (
+            REPORT_ROOT_SAMPLE_IDS_TEMP_TABLE,
+            "root_sample_id",
+            root_sample_ids,
+            "sample",
+            "description",
+        ),
+        (
+            REPORT_SENTINEL_PLATE_BARCODES_TEMP_TABLE,
+            "plate_barcode",
+            plate_barcodes,
+            "stock_resource",
+            "labware_human_barcode",
+        ),
+        (
+            REPORT_BECKMAN_PLATE_BARCODES_TEMP_TABLE,
+            "plate_barcode",
+            plate_barcodes,
+            "lighthouse_sample",
+            "plate_barcode",
+        ),
+    ]
+
+    db_connection = sql_engine.connect()
+    try:
+        try:
+            for table, column, values, joined_table, joined_column in temp_tables:
+                column_definition = __temp_table_key_definition(
+                    db_connection, mlwh_db, joined_table, joined_column
+                )
+                db_connection.execute(
+                    f"CREATE TEMPORARY TABLE {mlwh_db}.{table}"
+                    f" ({column} {column_definition}, PRIMARY KEY ({column}))"
+                )
+                __load_temp_table(db_connection, f"{mlwh_db}.{table}", column, values)
+
+            return [
+                read_sql(
+                    __sentinel_cherrypicked_samples_query(
+                        mlwh_db, events_wh_db, REPORT_SENTINEL_PLATE_BARCODES_TEMP_TABLE
+                    ),
+                    db_connection,
+                ),
+                read_sql(
+                    __beckman_cherrypicked_samples_query(
+                        mlwh_db, events_wh_db, REPORT_BECKMAN_PLATE_BARCODES_TEMP_TABLE
+                    ),
+                    db_connection,
+                ),
+            ]
+        finally:
+            db_connection.execute(
+                "DROP TEMPORARY TABLE IF EXISTS "
+                + ", ".join(f"{mlwh_db}.{table}" for table, *_ in temp_tables)
+            )
+    finally:
+        db_connection.close()
+
+
+def __temp_table_key_definition(
+    db_connection, mlwh_db: str, joined_table: str, joined_column: str
+) -> str:
+    """The definition of the key column of a temporary table joined to an MLWH column, with the
+    type, character set and collation of that column so that the join needs no conversion. A TEXT
+    column cannot be a key, so its values are held in a VARCHAR."""
+    data_type, column_type, character_set, collation = db_connection.execute(
+        "SELECT DATA_TYPE, COLUMN_TYPE, CHARACTER_SET_NAME, COLLATION_NAME"
+        " FROM information_schema.COLUMNS"
+        " WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s AND COLUMN_NAME = %s",
+        (mlwh_db, joined_table, joined_column),
+    ).fetchone()
+    if data_type not in ("char", "varchar"):
+        column_type = f"VARCHAR({REPORT_TEMP_TABLE_TEXT_KEY_LENGTH})"
+
+    return f"{column_type} CHARACTER SET {character_set} COLLATE {collation} NOT NULL"
+
+
+def __load_temp_table(db_connection, table_name: str, column_name: str, values) -> None:
+    """Insert the distinct values into a temporary table, in multi-row inserts of
+    REPORTS_TEMP_TABLE_INSERT_CHUNK_SIZE rows."""
+    distinct_values = list(dict.fromkeys(values))
+    chunk_size = app.config["REPORTS_TEMP_TABLE_INSERT_CHUNK_SIZE"]
+    for i in range(0, len(distinct_values), chunk_size):
+        chunk = distinct_values[i : (i + chunk_size)]  # noqa: E203
+        placeholders = ", ".join(["(%s)"] * len(chunk))
+        db_connection.execute(
+            f"INSERT INTO {table_name} ({column_name}) VALUES {placeholders}", tuple(chunk)
+        )
+
+
+def __sentinel_cherrypicked_samples_query(
+    mlwh_db: str, events_wh_db: str, plate_barcodes_temp_table: Optional[str] = None
+) -> str:
     """Forms the SQL query to identify samples cherrypicked via the Sentinel workflow.
 
     Arguments:
         mlwh_db {str} -- The name of the MLWH database
         events_wh_db {str} -- The name of the Events Warehouse database
+        plate_barcodes_temp_table {Optional[str]} -- join to the temporary table of root sample ids
+        and this temporary table of plate barcodes rather than take them as parameters
+        (default: {None})
 
     Returns:
         str -- the SQL query for Sentinel cherrypicked samples
@@ -441,19 +642,24 @@ def __sentinel_cherrypicked_samples_query(mlwh_db: str, events_wh_db: str) -> st
         f" JOIN {events_wh_db}.roles mlwh_events_roles ON (mlwh_events_roles.subject_id = mlwh_events_subjects.id)"  # noqa: E501
         f" JOIN {events_wh_db}.events mlwh_events_events ON (mlwh_events_roles.event_id = mlwh_events_events.id)"  # noqa: E501
         f" JOIN {events_wh_db}.event_types mlwh_events_event_types ON (mlwh_events_events.event_type_id = mlwh_events_event_types.id)"  # noqa: E501
-        f" WHERE mlwh_sample.description IN %(root_sample_ids)s"
-        f" AND mlwh_stock_resource.labware_human_barcode IN %(plate_barcodes)s"
-        f" AND mlwh_events_event_types.key = '{EVENT_CHERRYPICK_LAYOUT_SET}'"
+        f"{__report_keys_joins(mlwh_db, 'mlwh_stock_resource.labware_human_barcode', plate_barcodes_temp_table)}"  # noqa: E501
+        f" WHERE mlwh_events_event_types.key = '{EVENT_CHERRYPICK_LAYOUT_SET}'"
+        f"{__report_keys_conditions('mlwh_stock_resource.labware_human_barcode', plate_barcodes_temp_table)}"  # noqa: E501
         " GROUP BY mlwh_sample.description, mlwh_stock_resource.labware_human_barcode, mlwh_sample.phenotype, mlwh_stock_resource.labware_coordinate"  # noqa: E501
     )
 
 
-def __beckman_cherrypicked_samples_query(mlwh_db: str, events_wh_db: str) -> str:
+def __beckman_cherrypicked_samples_query(
+    mlwh_db: str, events_wh_db: str, plate_barcodes_temp_table: Optional[str] = None
+) -> str:
     """Forms the SQL query to identify samples cherrypicked via the Beckman workflow.
 
     Arguments:
         mlwh_db {str} -- The name of the MLWH database
         events_wh_db {str} -- The name of the Events Warehouse database
+        plate_barcodes_temp_table {Optional[str]} -- join to the temporary table of root sample ids
+        and this temporary table of plate barcodes rather than take them as parameters
+        (default: {None})
 
     Returns:
         str -- the SQL query for Beckman cherrypicked samples
@@ -467,8 +673,38 @@ def __beckman_cherrypicked_samples_query(mlwh_db: str, events_wh_db: str) -> str
         f" JOIN {events_wh_db}.roles AS mlwh_events_roles ON (mlwh_events_roles.subject_id = mlwh_events_subjects.id)"  # noqa: E501
         f" JOIN {events_wh_db}.events AS mlwh_events_events ON (mlwh_events_events.id = mlwh_events_roles.event_id)"  # noqa: E501
         f" JOIN {events_wh_db}.event_types AS mlwh_events_event_types ON (mlwh_events_event_types.id = mlwh_events_events.event_type_id)"  # noqa: E501
-        f" WHERE mlwh_sample.description IN %(root_sample_ids)s"
-        f" AND mlwh_lh_sample.plate_barcode IN %(plate_barcodes)s"
-        f" AND mlwh_events_event_types.key = '{PLATE_EVENT_DESTINATION_CREATED}'"
+        f"{__report_keys_joins(mlwh_db, 'mlwh_lh_sample.plate_barcode', plate_barcodes_temp_table)}"  # noqa: E501
+        f" WHERE mlwh_events_event_types.key = '{PLATE_EVENT_DESTINATION_CREATED}'"
+        f"{__report_keys_conditions('mlwh_lh_sample.plate_barcode', plate_barcodes_temp_table)}"
         " GROUP BY mlwh_sample.description, mlwh_lh_sample.plate_barcode, mlwh_sample.phenotype, mlwh_lh_sample.coordinate;"  # noqa: E501
     )
+
+
+def __report_keys_joins(
+    mlwh_db: str, plate_barcode_column: str, plate_barcodes_temp_table: Optional[str]
+) -> str:
+    """The joins to the temporary tables restricting a cherrypicked samples query to the root sample
+    ids and plate barcodes of the report, if it uses them."""
+    if plate_barcodes_temp_table is None:
+        return ""
+
+    return (
+        f" JOIN {mlwh_db}.{REPORT_ROOT_SAMPLE_IDS_TEMP_TABLE} AS report_root_sample_ids"
+        " ON (report_root_sample_ids.root_sample_id = mlwh_sample.description)"
+        f" JOIN {mlwh_db}.{plate_barcodes_temp_table} AS report_plate_barcodes"
+        f" ON (report_plate_barcodes.plate_barcode = {plate_barcode_column})"
+    )
+
+
+def __report_keys_conditions(
+    plate_barcode_column: str, plate_barcodes_temp_table: Optional[str]
+) -> str:
+    """The conditions restricting a cherrypicked samples query to the root sample ids and plate
+    barcodes of the report passed as parameters, if it does not use the temporary tables."""
+    if plate_barcodes_temp_table is not None:
+        return ""
+
+    return (
+        " AND mlwh_sample.description IN %(root_sample_ids)s"
+        f" AND {plate_barcode_column} IN %(plate_barcodes)s"
+    )
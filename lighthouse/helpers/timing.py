@@ -0,0 +1,294 @@
+"""Time the stages of requests
+
+A view decorated with timed_request gets a StageTimer for the request, and the stages of the request
+(e.g. querying DART or sending a plate to Sequencescape) are timed with timed_stage. When the
+request finishes:
+
+  * the duration of the request, and of each stage, is added to a histogram in the timing registry
+    of the app, which is reported by /health/timings
+  * the timings are logged as a JSON line: at ERROR level for requests which failed (status 500 or
+    above), at WARNING level for requests slower than TIMING_SLOW_REQUEST_SECONDS, at INFO level
+    for a random sample (TIMING_SAMPLE_RATE) of the other requests, and at DEBUG level otherwise
+  * the timings of the slowest requests are kept in the registry too, to be reported with the
+    histograms
+
+A timer can be used from other threads, e.g. by calls run with run_concurrently; wrap a call with
+StageTimer.wrap to time it as a stage of the request.
+
+This file contains the following functions:
+
+  * timed_request - decorator timing a Flask view and its stages
+  * timed_stage - time a stage of the current request
+  * current_stage_timer - get the timer of the current request
+  * get_timing_registry - get the timing registry of the current app
+"""
+import bisect
+import json
+import logging
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+from flask import current_app as app
+from flask import g
+
+logger = logging.getLogger(__name__)
+
+# upper bounds, in milliseconds, of the buckets of the histograms; longer durations are counted in
+# an extra, unbounded bucket
+HISTOGRAM_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000]
+
+_registry_lock = threading.Lock()
+
+
+class Histogram:
+    """A count of durations in fixed buckets, with their total and maximum."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+        self._count = 0
+        self._total_ms = 0.0
+        self._max_ms = 0.0
+
+    def observe(self, milliseconds: float) -> None:
+        with self._lock:
+            self._buckets[bisect.bisect_left(HISTOGRAM_BUCKETS_MS, milliseconds)] += 1
+            self._count += 1
+            self._total_ms += milliseconds
+            self._max_ms = max(self._max_ms, milliseconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Get the counts of the histogram.
+
+        Returns:
+            Dict[str, Any] -- the number of durations, their mean and maximum in milliseconds and
+            the number in each bucket, keyed by the upper bound of the bucket ("+Inf" for the last)
+        """
+        with self._lock:
+            labels = [str(bound) for bound in HISTOGRAM_BUCKETS_MS] + ["+Inf"]
+            return {
+                "count": self._count,
+                "mean_ms": round(self._total_ms / self._count, 3) if self._count else 0.0,
+                "max_ms": round(self._max_ms, 3),
+                "buckets": dict(zip(labels, self._buckets)),
+            }
+
+
+class TimingRegistry:
+    """The histograms of the durations of requests and of their stages, keyed by name, and the
+    timings of the slowest requests."""
+
+    def __init__(self, slow_samples_kept: int):
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Histogram] = {}
+        self._slow_samples: Deque[Dict[str, Any]] = deque(maxlen=slow_samples_kept)
+
+    def observe(self, name: str, milliseconds: float) -> None:
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = Histogram()
+                self._histograms[name] = histogram
+
+        histogram.observe(milliseconds)
+
+    def add_slow_sample(self, timings: Dict[str, Any]) -> None:
+        with self._lock:
+            self._slow_samples.append(timings)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Get the histograms and the timings of the slowest requests.
+
+        Returns:
+            Dict[str, Any] -- the "histograms", keyed by name, and the "slow_samples"
+        """
+        with self._lock:
+            histograms = dict(self._histograms)
+            slow_samples = list(self._slow_samples)
+
+        return {
+            "histograms": {name: histogram.snapshot() for name, histogram in histograms.items()},
+            "slow_samples": slow_samples,
+        }
+
+
+class StageTimer:
+    """The timings of the stages of a request. Stages may run at the same time, in different
+    threads."""
+
+    def __init__(self, name: Optional[str]):
+        self.name = name
+        self._lock = threading.Lock()
+        self._started_at = time.perf_counter()
+        self._stages: List[Tuple[str, float, bool]] = []
+
+    @contextmanager
+    def stage(self, stage: str) -> Iterator[None]:
+        """Time a stage of the request.
+
+        Arguments:
+            stage {str} -- the name of the stage
+        """
+        started_at = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            milliseconds = (time.perf_counter() - started_at) * 1000
+            with self._lock:
+                self._stages.append((stage, milliseconds, ok))
+
+    def wrap(self, stage: str, call: Callable[[], Any]) -> Callable[[], Any]:
+        """Wrap a call so that it is timed as a stage of the request, e.g. to run it in another
+        thread.
+
+        Arguments:
+            stage {str} -- the name of the stage
+            call {Callable[[], Any]} -- the call to time
+
+        Returns:
+            Callable[[], Any] -- the wrapped call
+        """
+
+        def timed_call() -> Any:
+            with self.stage(stage):
+                return call()
+
+        return timed_call
+
+    def timings(self, status_code: Optional[int] = None) -> Dict[str, Any]:
+        """Get the timings of the request so far, e.g. to add them to an error message.
+
+        Arguments:
+            status_code {Optional[int]} -- the status code of the response (default: {None})
+
+        Returns:
+            Dict[str, Any] -- the name of the request, its status code, its total duration in
+            milliseconds and the stages in the order they finished, with their duration and
+            whether they raised an exception
+        """
+        with self._lock:
+            stages = list(self._stages)
+
+        return {
+            "request": self.name,
+            "status_code": status_code,
+            "total_ms": round((time.perf_counter() - self._started_at) * 1000, 3),
+            "stages": [
+                {"stage": stage, "ms": round(milliseconds, 3), "ok": ok}
+                for stage, milliseconds, ok in stages
+            ],
+        }
+
+    def finish(self, status_code: int) -> Dict[str, Any]:
+        """Record the timings of the request in the timing registry and log them.
+
+        Arguments:
+            status_code {int} -- the status code of the response
+
+        Returns:
+            Dict[str, Any] -- the timings of the request
+        """
+        timings = self.timings(int(status_code))
+        if self.name is None:
+            return timings
+
+        registry = get_timing_registry()
+        registry.observe(self.name, timings["total_ms"])
+        for stage in timings["stages"]:
+            registry.observe(f"{self.name}.{stage['stage']}", stage["ms"])
+
+        slow = timings["total_ms"] >= app.config["TIMING_SLOW_REQUEST_SECONDS"] * 1000
+        if slow:
+            registry.add_slow_sample(timings)
+
+        line = json.dumps(timings)
+        if timings["status_code"] >= 500:
+            logger.error(f"Timings of failed request: {line}")
+        elif slow:
+            logger.warning(f"Timings of slow request: {line}")
+        elif random.random() < app.config["TIMING_SAMPLE_RATE"]:
+            logger.info(f"Timings of sampled request: {line}")
+        else:
+            logger.debug(f"Timings: {line}")
+
+        return timings
+
+
+def timed_request(name: str) -> Callable:
+    """Decorate a Flask view to time it, and the stages timed with timed_stage while it runs. The
+    view should return a tuple of its response and status code.
+
+    Arguments:
+        name {str} -- the name to record the timings of the view with
+
+    Returns:
+        Callable -- the decorator
+    """
+
+    def decorator(view: Callable) -> Callable:
+        @wraps(view)
+        def timed_view(*args: Any, **kwargs: Any) -> Any:
+            timer = StageTimer(name)
+            g.stage_timer = timer
+            status_code = 500
+            try:
+                result = view(*args, **kwargs)
+                if isinstance(result, tuple) and len(result) > 1:
+                    status_code = result[1]
+                else:
+                    status_code = 200
+                return result
+            finally:
+                timer.finish(status_code)
+
+        return timed_view
+
+    return decorator
+
+
+def current_stage_timer() -> StageTimer:
+    """Get the timer of the current request. Outside of a timed request a timer which is never
+    recorded is returned, so stages can be timed unconditionally.
+
+    Returns:
+        StageTimer -- the timer of the current request
+    """
+    timer = g.get("stage_timer")
+    if timer is None:
+        timer = StageTimer(None)
+
+    return timer
+
+
+def timed_stage(stage: str):
+    """Time a stage of the current request.
+
+    Arguments:
+        stage {str} -- the name of the stage
+
+    Returns:
+        a context manager timing the stage
+    """
+    return current_stage_timer().stage(stage)
+
+
+def get_timing_registry() -> TimingRegistry:
+    """Get the timing registry of the current app, creating it on first use.
+
+    Returns:
+        TimingRegistry -- the app's timing registry
+    """
+    with _registry_lock:
+        registry = app.extensions.get("timing_registry")
+        if registry is None:
+            registry = TimingRegistry(app.config["TIMING_SLOW_SAMPLES_KEPT"])
+            app.extensions["timing_registry"] = registry
+
+    return registry
@@ -0,0 +1,20 @@
+import logging
+
+from lighthouse import scheduler
+from lighthouse.helpers.cog_barcodes import refill_cog_barcode_reservoirs
+
+logger = logging.getLogger(__name__)
+
+
+def refill_cog_barcode_reservoirs_job():
+    """Scheduler's job to top up the COG-UK barcode reservoirs within the scheduler's app context.
+
+    Returns:
+        Dict[str, int] -- number of barcodes added to the reservoir of each centre prefix
+    """
+    with scheduler.app.app_context():
+        if not scheduler.app.config["COG_BARCODE_RESERVOIR_ENABLE"]:
+            return {}
+
+        logger.info("Starting refill_cog_barcode_reservoirs job")
+        return refill_cog_barcode_reservoirs()
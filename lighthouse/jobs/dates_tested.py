@@ -0,0 +1,17 @@
+import logging
+
+from lighthouse import scheduler
+from lighthouse.helpers.dates_tested import update_dates_tested
+
+logger = logging.getLogger(__name__)
+
+
+def update_dates_tested_job():
+    """Scheduler's job to set the parsed date tested of samples within the scheduler's app context.
+
+    Returns:
+        int -- number of samples updated
+    """
+    logger.info("Starting update_dates_tested job")
+    with scheduler.app.app_context():
+        return update_dates_tested()
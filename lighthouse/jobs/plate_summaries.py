@@ -0,0 +1,21 @@
+import logging
+
+from lighthouse import scheduler
+from lighthouse.helpers.plate_summaries import update_plate_summaries
+
+logger = logging.getLogger(__name__)
+
+
+def update_plate_summaries_job():
+    """Scheduler's job to update the plate summaries within the scheduler's app context.
+
+    Returns:
+        int -- number of plates recounted
+    """
+    with scheduler.app.app_context():
+        if not scheduler.app.config.get("PLATE_SUMMARIES_ENABLE", False):
+            logger.info("Plate summaries are disabled, skipping update_plate_summaries job")
+            return 0
+
+        logger.info("Starting update_plate_summaries job")
+        return update_plate_summaries()
@@ -5,6 +5,7 @@ import pandas as pd
 from flask import current_app as app
 from lighthouse import scheduler
 from lighthouse.constants import FIELD_PLATE_BARCODE, REPORT_COLUMNS
+from lighthouse.helpers.dates_tested import update_dates_tested
 from lighthouse.helpers.reports import (
     add_cherrypicked_column,
     get_all_positive_samples,
@@ -27,6 +28,10 @@ def create_report() -> str:
     logger.info("Creating positive samples report")
     start = time.time()
 
+    # parse the date tested of the samples imported since the update_dates_tested job last ran, so
+    # that they are found by get_all_positive_samples
+    update_dates_tested()
+
     # get samples collection
     logger.debug("Getting all positive samples")
     samples_collection = app.data.driver.db.samples
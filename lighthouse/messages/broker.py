@@ -1,10 +1,17 @@
-import pika
 import logging
-from lighthouse.messages.message import Message
+import threading
+import time
+from typing import Optional
+
+import pika
 from flask import current_app as app
+from lighthouse.messages.message import Message
+from pika.exceptions import AMQPError
 
 logger = logging.getLogger(__name__)
 
+_publisher_lock = threading.Lock()
+
 
 class Broker:
     """Controls the connection, exchange and publishing to RabbitMQ."""
@@ -45,3 +52,172 @@ class Broker:
         exchange_name = app.config["RMQ_EXCHANGE"]
         logger.debug(f"Declaring exchange '{exchange_name}'")
         self.channel.exchange_declare(exchange_name, exchange_type=app.config["RMQ_EXCHANGE_TYPE"])
+
+
+class BrokerPublisher:
+    """Publishes messages to RabbitMQ over a connection and channel which are kept open between
+    messages, so that publishing a message does not need a new connection.
+
+    The exchange is declared once per connection. The connection is checked, and its pending
+    events processed, before each message, and when it has been lost it is reopened with an
+    exponential backoff and the message is published again. By default the broker confirms each
+    message, so that a message it did not accept raises rather than being lost. Publishing is
+    serialised by a lock, as pika connections must not be shared between threads, so a publisher
+    can be used from several request threads at once.
+
+    The configuration is read from the current app when the publisher is created.
+    """
+
+    def __init__(self, confirm_delivery: bool = True):
+        """
+        Arguments:
+            confirm_delivery {bool} -- wait for the broker to confirm each message before returning
+            from publishing it (default: {True})
+        """
+        self._host = app.config["RMQ_HOST"]
+        self._port = app.config["RMQ_PORT"]
+        self._vhost = app.config["RMQ_VHOST"]
+        self._username = app.config["RMQ_USERNAME"]
+        self._password = app.config["RMQ_PASSWORD"]
+        self._declare_exchange = app.config["RMQ_DECLARE_EXCHANGE"]
+        self._exchange = app.config["RMQ_EXCHANGE"]
+        self._exchange_type = app.config["RMQ_EXCHANGE_TYPE"]
+        self._publish_attempts = app.config["RMQ_PUBLISH_RETRY_ATTEMPTS"]
+        self._backoff = app.config["RMQ_RECONNECT_BACKOFF_SECONDS"]
+        self._max_backoff = app.config["RMQ_RECONNECT_MAX_BACKOFF_SECONDS"]
+        self._heartbeat = app.config["RMQ_HEARTBEAT_SECONDS"]
+        self._blocked_connection_timeout = app.config["RMQ_BLOCKED_CONNECTION_TIMEOUT_SECONDS"]
+        self._socket_timeout = app.config["RMQ_SOCKET_TIMEOUT_SECONDS"]
+        self._confirm_delivery = confirm_delivery
+
+        self._lock = threading.Lock()
+        self._connection = None
+        self._channel = None
+
+    def publish(self, message: Optional[Message], routing_key: Optional[str]) -> None:
+        """Publish a message to the exchange, opening the connection if it is not open.
+
+        Arguments:
+            message {Optional[Message]} -- the message to publish; nothing is published if None
+            routing_key {Optional[str]} -- the routing key; nothing is published if None
+
+        Raises:
+            AMQPError: the message could not be published after all the attempts
+        """
+        if message is None or routing_key is None:
+            return
+
+        self.publish_payload(message.payload(), routing_key)
+
+    def publish_payload(self, body: str, routing_key: str) -> None:
+        """Publish the payload of a message to the exchange, opening the connection if it is not
+        open.
+
+        Arguments:
+            body {str} -- the payload of the message
+            routing_key {str} -- the routing key
+
+        Raises:
+            AMQPError: the message could not be published (or, when delivery is confirmed, was not
+            confirmed by the broker) after all the attempts
+        """
+        with self._lock:
+            attempt = 1
+            while True:
+                try:
+                    channel = self._get_channel()
+                    logger.debug("Publishing message")
+                    channel.basic_publish(
+                        exchange=self._exchange, routing_key=routing_key, body=body
+                    )
+                    return
+                except AMQPError as e:
+                    self._reset()
+                    if attempt >= self._publish_attempts:
+                        logger.error(f"Failed to publish message after {attempt} attempts")
+                        raise
+
+                    delay = min(self._backoff * 2 ** (attempt - 1), self._max_backoff)
+                    logger.warning(
+                        f"Failed to publish message ({type(e).__name__}), reconnecting in "
+                        f"{delay} seconds"
+                    )
+                    time.sleep(delay)
+                    attempt += 1
+
+    def close(self) -> None:
+        """Close the connection, if it is open. It is opened again by the next publish."""
+        with self._lock:
+            self._reset()
+
+    def _get_channel(self):
+        if (
+            self._connection is not None
+            and self._connection.is_open
+            and self._channel is not None
+            and self._channel.is_open
+        ):
+            # process the frames received while the connection was idle, which raises if the broker
+            # has closed it
+            self._connection.process_data_events(time_limit=0)
+            return self._channel
+
+        self._reset()
+
+        logger.debug(f"Creating messaging connection to '{self._host}'")
+        credentials = pika.PlainCredentials(self._username, self._password)
+        # the timeouts make a publish on a dead or blocked connection fail, to be retried, rather
+        # than wait forever while holding the lock
+        parameters = pika.ConnectionParameters(
+            self._host,
+            self._port,
+            self._vhost,
+            credentials,
+            heartbeat=self._heartbeat,
+            blocked_connection_timeout=self._blocked_connection_timeout,
+            socket_timeout=self._socket_timeout,
+        )
+        connection = pika.BlockingConnection(parameters)
+
+        logger.debug("Opening channel")
+        channel = connection.channel()
+
+        if self._declare_exchange:
+            logger.debug(f"Declaring exchange '{self._exchange}'")
+            channel.exchange_declare(self._exchange, exchange_type=self._exchange_type)
+
+        if self._confirm_delivery:
+            channel.confirm_delivery()
+
+        self._connection = connection
+        self._channel = channel
+
+        return channel
+
+    def _reset(self) -> None:
+        connection = self._connection
+        self._connection = None
+        self._channel = None
+
+        if connection is not None and connection.is_open:
+            logger.debug("Closing connection")
+            try:
+                connection.close()
+            except AMQPError as e:
+                logger.warning(f"Failed to close connection: {type(e).__name__}")
+
+
+def get_publisher() -> BrokerPublisher:
+    """Get the publisher of the current app, creating it on first use. The publisher keeps its
+    connection open and is shared by all the requests of the app.
+
+    Returns:
+        BrokerPublisher -- the app's publisher
+    """
+    with _publisher_lock:
+        publisher = app.extensions.get("broker_publisher")
+        if publisher is None:
+            publisher = BrokerPublisher()
+            app.extensions["broker_publisher"] = publisher
+
+    return publisher
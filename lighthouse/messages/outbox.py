@@ -0,0 +1,327 @@
+"""Publish event messages through a durable local outbox
+
+When the outbox is enabled (OUTBOX_ENABLE), the payloads of event messages are appended to an
+SQLite file and the request returns without waiting for the broker. A background thread, the
+flusher, publishes the stored messages in batches with publisher confirms and removes them from the
+outbox once the broker has confirmed them, so messages are not lost while the broker is slow or
+down.
+
+Several processes can share an outbox file: a flusher claims a batch of messages for a while
+(OUTBOX_CLAIM_SECONDS) before publishing it, and a batch which is not published in that time, e.g.
+because its process died, can be claimed again. Each flusher and each replay of the outbox claims
+messages with its own owner id, so that a batch is published by only one of them.
+
+This file contains the following functions:
+
+  * send_message - publish a message, through the outbox when it is enabled
+  * get_outbox - get the outbox of the current app, starting its flusher on first use
+  * new_outbox_owner - get a new owner id to claim the messages of an outbox with
+  * flush_outbox - publish a batch of the messages in an outbox
+"""
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from flask import current_app as app
+from flask import has_request_context
+from lighthouse.messages.broker import BrokerPublisher, get_publisher
+from lighthouse.messages.message import Message
+from pika.exceptions import AMQPError
+
+logger = logging.getLogger(__name__)
+
+_outbox_lock = threading.Lock()
+
+
+class OutboxEntry(NamedTuple):
+    id: int
+    routing_key: str
+    body: str
+    attempts: int
+
+
+class MessageOutbox:
+    """A durable queue of message payloads stored in an SQLite file."""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=FULL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                routing_key TEXT NOT NULL,
+                body TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                claimed_by TEXT,
+                claimed_until REAL
+            )
+            """
+        )
+
+    def append(self, message: Message, routing_key: str) -> int:
+        """Store a message in the outbox. The message is on disk when this returns.
+
+        Arguments:
+            message {Message} -- the message to store
+            routing_key {str} -- the routing key to publish the message with
+
+        Returns:
+            int -- the id of the message in the outbox
+        """
+        with self._lock:
+            cursor = self._connection.execute(
+                "INSERT INTO outbox (routing_key, body, created_at) VALUES (?, ?, ?)",
+                (routing_key, message.payload(), time.time()),
+            )
+            return cursor.lastrowid
+
+    def claim(self, owner: str, limit: int, claim_seconds: float) -> List[OutboxEntry]:
+        """Claim the oldest messages which are not claimed, or whose claim has expired, in the order
+        they were stored. Messages already claimed by the same owner are not claimed again.
+
+        Arguments:
+            owner {str} -- who is claiming the messages
+            limit {int} -- the maximum number of messages to claim
+            claim_seconds {float} -- how long the messages are claimed for
+
+        Returns:
+            List[OutboxEntry] -- the claimed messages
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            rows = connection.execute(
+                """
+                SELECT id, routing_key, body, attempts FROM outbox
+                WHERE claimed_by IS NULL OR claimed_until < ?
+                ORDER BY id LIMIT ?
+                """,
+                (now, limit),
+            ).fetchall()
+            connection.executemany(
+                "UPDATE outbox SET claimed_by = ?, claimed_until = ? WHERE id = ?",
+                [(owner, now + claim_seconds, row[0]) for row in rows],
+            )
+
+        return [OutboxEntry(*row) for row in rows]
+
+    def remove(self, ids: List[int]) -> None:
+        """Remove published messages from the outbox.
+
+        Arguments:
+            ids {List[int]} -- the ids of the messages to remove
+        """
+        if not ids:
+            return
+
+        with self._transaction() as connection:
+            connection.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in ids])
+
+    def release(self, ids: List[int], error: str) -> None:
+        """Release the claim on messages which failed to publish, so they are tried again.
+
+        Arguments:
+            ids {List[int]} -- the ids of the messages to release
+            error {str} -- why the messages failed to publish
+        """
+        if not ids:
+            return
+
+        with self._transaction() as connection:
+            connection.executemany(
+                """
+                UPDATE outbox
+                SET attempts = attempts + 1, last_error = ?, claimed_by = NULL, claimed_until = NULL
+                WHERE id = ?
+                """,
+                [(error, i) for i in ids],
+            )
+
+    def metrics(self) -> Dict[str, Optional[float]]:
+        """Get the size of the backlog of messages in the outbox.
+
+        Returns:
+            Dict[str, Optional[float]] -- the number of messages waiting to be published
+            ("backlog"), the age in seconds of the oldest one ("oldest_age_seconds") and the number
+            of those which have failed to publish at least once ("failed")
+        """
+        with self._lock:
+            backlog, oldest, failed = self._connection.execute(
+                "SELECT COUNT(*), MIN(created_at), COALESCE(SUM(attempts > 0), 0) FROM outbox"
+            ).fetchone()
+
+        return {
+            "backlog": backlog,
+            "oldest_age_seconds": None if oldest is None else round(time.time() - oldest, 3),
+            "failed": failed,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        # an immediate transaction takes the write lock of the file straight away, so that a batch
+        # cannot be claimed by two processes
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._connection
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+
+class OutboxFlusher(threading.Thread):
+    """A background thread which publishes the messages in an outbox. It wakes up when it is
+    notified of a new message and at least every OUTBOX_FLUSH_INTERVAL_SECONDS, and keeps publishing
+    batches until the outbox is empty or publishing fails."""
+
+    def __init__(self, flask_app, outbox: MessageOutbox):
+        super().__init__(name="lighthouse-outbox-flusher", daemon=True)
+        self._app = flask_app
+        self._outbox = outbox
+        self._owner = new_outbox_owner()
+        self._interval = flask_app.config["OUTBOX_FLUSH_INTERVAL_SECONDS"]
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+
+    def notify(self) -> None:
+        self._wake.set()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._wake.set()
+
+    def run(self) -> None:
+        with self._app.app_context():
+            publisher = BrokerPublisher(confirm_delivery=True)
+            while not self._stopped.is_set():
+                self._wake.wait(self._interval)
+                self._wake.clear()
+                try:
+                    while not self._stopped.is_set():
+                        published, failed = flush_outbox(self._outbox, publisher, self._owner)
+                        if failed or published < self._app.config["OUTBOX_BATCH_SIZE"]:
+                            break
+                except Exception as e:
+                    logger.exception(e)
+
+            publisher.close()
+
+
+def get_outbox() -> MessageOutbox:
+    """Get the outbox of the current app, creating it on first use. Its flusher is started (unless
+    OUTBOX_FLUSHER_RUN is False) on first use within a request, so that it runs only in the
+    process serving the app and not in flask CLI commands. The outbox is created with the first
+    request when OUTBOX_ENABLE and OUTBOX_FLUSHER_RUN are set, so that the messages stored before
+    the app started are published without waiting for a new message.
+
+    Returns:
+        MessageOutbox -- the app's outbox
+    """
+    with _outbox_lock:
+        outbox = app.extensions.get("message_outbox")
+        if outbox is None:
+            outbox = MessageOutbox(app.config["OUTBOX_PATH"])
+            app.extensions["message_outbox"] = outbox
+
+        if (
+            app.config["OUTBOX_FLUSHER_RUN"]
+            and has_request_context()
+            and "message_outbox_flusher" not in app.extensions
+        ):
+            flusher = OutboxFlusher(app._get_current_object(), outbox)
+            flusher.start()
+            app.extensions["message_outbox_flusher"] = flusher
+
+    return outbox
+
+
+def send_message(message: Message, routing_key: str) -> None:
+    """Publish a message. When the outbox is enabled the message is stored in the outbox, to be
+    published by its flusher, otherwise it is published straight away.
+
+    Arguments:
+        message {Message} -- the message to publish
+        routing_key {str} -- the routing key to publish the message with
+    """
+    if not app.config["OUTBOX_ENABLE"]:
+        get_publisher().publish(message, routing_key)
+        return
+
+    if message is None or routing_key is None:
+        return
+
+    message_id = get_outbox().append(message, routing_key)
+    logger.debug(f"Stored message {message_id} in the outbox")
+
+    flusher = app.extensions.get("message_outbox_flusher")
+    if flusher is not None:
+        flusher.notify()
+
+
+def new_outbox_owner() -> str:
+    """Get a new owner id to claim the messages of an outbox with. Every flusher and every replay of
+    an outbox needs its own, so that they do not publish the same messages.
+
+    Returns:
+        str -- the owner id, made of the host, the process and a random part
+    """
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+
+
+def flush_outbox(outbox: MessageOutbox, publisher: BrokerPublisher, owner: str) -> Tuple[int, int]:
+    """Publish a batch of the messages in an outbox, in the order they were stored, and remove those
+    confirmed by the broker. Publishing stops at the first message which fails; it and the rest of
+    the batch are left in the outbox to be tried again.
+
+    Arguments:
+        outbox {MessageOutbox} -- the outbox to publish the messages of
+        publisher {BrokerPublisher} -- the publisher to publish the messages with, which should
+        confirm delivery
+        owner {str} -- the owner id to claim the messages with, from new_outbox_owner
+
+    Returns:
+        Tuple[int, int] -- the number of messages published and the number which failed
+    """
+    entries = outbox.claim(
+        owner, app.config["OUTBOX_BATCH_SIZE"], app.config["OUTBOX_CLAIM_SECONDS"]
+    )
+    if not entries:
+        return 0, 0
+
+    published: List[int] = []
+    try:
+        for entry in entries:
+            publisher.publish_payload(entry.body, entry.routing_key)
+            published.append(entry.id)
+    except AMQPError as e:
+        failed = [entry.id for entry in entries[len(published) :]]  # noqa: E203
+        logger.error(f"Failed to publish {len(failed)} messages from the outbox: {repr(e)}")
+        outbox.release(failed, repr(e))
+        return len(published), len(failed)
+    finally:
+        outbox.remove(published)
+
+    logger.info(f"Published {len(published)} messages from the outbox")
+
+    return len(published), 0
+
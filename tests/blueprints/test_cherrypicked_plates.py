@@ -2,6 +2,7 @@ import json
 from http import HTTPStatus
 from unittest.mock import patch
 
+import pytest
 import responses
 from lighthouse.messages.message import Message
 
@@ -153,6 +154,58 @@ def test_get_cherrypicked_plates_mlwh_update_failure(
             }
 
 
+def test_get_cherrypicked_plates_endpoint_retry_returns_recorded_response(
+    app, client, dart_samples_for_bp_test, samples_with_lab_id, mocked_responses, source_plates
+):
+    with patch(
+        "lighthouse.blueprints.cherrypicked_plates.add_cog_barcodes",
+        return_value="TS1",
+    ) as mock_add_cog_barcodes:
+        ss_url = f"http://{app.config['SS_HOST']}/api/v2/heron/plates"
+        mocked_responses.add(
+            responses.POST,
+            ss_url,
+            body=json.dumps({"barcode": "plate_1"}),
+            status=HTTPStatus.OK,
+        )
+
+        responses_json = []
+        for _ in range(2):
+            response = client.get(
+                "/cherrypicked-plates/create?barcode=plate_1&robot=BKRB0001&user_id=test",
+                content_type="application/json",
+            )
+            assert response.status_code == HTTPStatus.OK
+            responses_json.append(response.json)
+
+        assert responses_json[0] == responses_json[1]
+        mock_add_cog_barcodes.assert_called_once()
+        assert len(mocked_responses.calls) == 1
+
+
+def test_get_cherrypicked_plates_endpoint_retry_after_ss_failure(
+    app, client, dart_samples_for_bp_test, samples_with_lab_id, mocked_responses, source_plates
+):
+    with patch(
+        "lighthouse.blueprints.cherrypicked_plates.add_cog_barcodes",
+        return_value="TS1",
+    ) as mock_add_cog_barcodes:
+        ss_url = f"http://{app.config['SS_HOST']}/api/v2/heron/plates"
+        mocked_responses.add(responses.POST, ss_url, body="{}", status=HTTPStatus.BAD_GATEWAY)
+        mocked_responses.add(responses.POST, ss_url, body="{}", status=HTTPStatus.OK)
+
+        for expected_status in (HTTPStatus.BAD_GATEWAY, HTTPStatus.OK):
+            response = client.get(
+                "/cherrypicked-plates/create?barcode=plate_1&robot=BKRB0001&user_id=test",
+                content_type="application/json",
+            )
+            assert response.status_code == expected_status
+
+        assert len(mocked_responses.calls) == 2
+        # the retry reuses the COG UK ids reserved by the first request
+        mock_add_cog_barcodes.assert_called_once()
+
+
 def test_post_plates_endpoint_mismatched_sample_numbers(
     app, client, dart_samples_for_bp_test, samples_with_lab_id
 ):
@@ -161,8 +214,8 @@ def test_post_plates_endpoint_mismatched_sample_numbers(
         return_value="TS1",
     ):
         with patch(
-            "lighthouse.blueprints.cherrypicked_plates.check_matching_sample_numbers",
-            return_value=False,
+            "lighthouse.blueprints.cherrypicked_plates.join_dart_rows_with_samples",
+            return_value=([], []),
         ):
             barcode = "plate_1"
             response = client.get(
@@ -323,56 +376,12 @@ def test_fail_plate_from_barcode_internal_server_error_constructing_message_none
             assert test_error in response.json["errors"][0]
 
 
-def test_fail_plate_from_barcode_internal_error_failed_broker_initialise(client):
-    with patch(
-        "lighthouse.blueprints.cherrypicked_plates.construct_cherrypicking_plate_failed_message"
-    ) as mock_construct:
-        with patch(
-            "lighthouse.blueprints.cherrypicked_plates.Broker", side_effect=Exception("Boom!")
-        ):
-            mock_construct.return_value = [], Message("test message content")
-
-            response = client.get(
-                "/cherrypicked-plates/fail?barcode=plate_1&user_id=test_user"
-                "&robot=BKRB0001&failure_type=robot_crashed"
-            )
-
-            assert response.status_code == HTTPStatus.INTERNAL_SERVER_ERROR
-            assert len(response.json["errors"]) == 1
-            assert (
-                "An unexpected error occurred attempting to record cherrypicking plate failure"
-                in response.json["errors"][0]
-            )
-
-
-def test_fail_plate_from_barcode_internal_error_failed_broker_connect(client):
-    with patch(
-        "lighthouse.blueprints.cherrypicked_plates.construct_cherrypicking_plate_failed_message"
-    ) as mock_construct:
-        with patch(
-            "lighthouse.blueprints.cherrypicked_plates.Broker.connect",
-            side_effect=Exception("Boom!"),
-        ):
-            mock_construct.return_value = [], Message("test message content")
-
-            response = client.get(
-                "/cherrypicked-plates/fail?barcode=plate_1&user_id=test_user"
-                "&robot=BKRB0001&failure_type=robot_crashed"
-            )
-
-            assert response.status_code == HTTPStatus.INTERNAL_SERVER_ERROR
-            assert (
-                "An unexpected error occurred attempting to record cherrypicking plate failure"
-                in response.json["errors"][0]
-            )
-
-
 def test_fail_plate_from_barcode_internal_error_failed_broker_publish(client):
     with patch(
         "lighthouse.blueprints.cherrypicked_plates.construct_cherrypicking_plate_failed_message"
     ) as mock_construct:
-        with patch("lighthouse.blueprints.cherrypicked_plates.Broker") as mock_broker:
-            mock_broker().publish.side_effect = Exception("Boom!")
+        with patch("lighthouse.blueprints.cherrypicked_plates.send_message") as mock_send_message:
+            mock_send_message.side_effect = Exception("Boom!")
             mock_construct.return_value = [], Message("test message content")
 
             response = client.get(
@@ -395,7 +404,9 @@ def test_fail_plate_from_barcode_success(client):
         with patch(
             "lighthouse.blueprints.cherrypicked_plates.get_routing_key", return_value=routing_key
         ):
-            with patch("lighthouse.blueprints.cherrypicked_plates.Broker") as mock_broker:
+            with patch(
+                "lighthouse.blueprints.cherrypicked_plates.send_message"
+            ) as mock_send_message:
                 test_errors = ["error 1", "error 2"]
                 test_message = Message("test message content")
                 mock_construct.return_value = test_errors, test_message
@@ -405,7 +416,17 @@ def test_fail_plate_from_barcode_success(client):
                     "&robot=BKRB0001&failure_type=robot_crashed"
                 )
 
-                mock_broker().publish.assert_called_with(test_message, routing_key)
-                mock_broker().close_connection.assert_called()
+                mock_send_message.assert_called_with(test_message, routing_key)
                 assert response.status_code == HTTPStatus.OK
                 assert response.json["errors"] == test_errors
+
+
+# module-specific test helpers
+
+
+@pytest.fixture(autouse=True)
+def idempotency_records(app):
+    yield
+
+    with app.app_context():
+        app.data.driver.db.idempotency_records.delete_many({})
@@ -1,13 +1,17 @@
 import json
+from datetime import datetime, timedelta
 from http import HTTPStatus
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
+import pytest
 import responses
+from lighthouse.helpers.plate_jobs import enqueue_plate_job, run_next_plate_job
+from lighthouse.helpers.plates import UnmatchedSampleError
 
 
 def test_post_plates_endpoint_successful(app, client, samples, mocked_responses, mlwh_lh_samples):
     with patch(
-        "lighthouse.blueprints.plates.add_cog_barcodes",
+        "lighthouse.helpers.plate_jobs.add_cog_barcodes",
         return_value="TS1",
     ):
         ss_url = f"http://{app.config['SS_HOST']}/api/v2/heron/plates"
@@ -73,7 +77,7 @@ def test_post_plates_endpoint_add_cog_barcodes_failed(
 
 def test_post_plates_endpoint_ss_failure(app, client, samples, mocked_responses):
     with patch(
-        "lighthouse.blueprints.plates.add_cog_barcodes",
+        "lighthouse.helpers.plate_jobs.add_cog_barcodes",
         return_value="TS1",
     ):
         ss_url = f"http://{app.config['SS_HOST']}/api/v2/heron/plates"
@@ -97,11 +101,11 @@ def test_post_plates_endpoint_ss_failure(app, client, samples, mocked_responses)
 
 def test_post_plates_mlwh_update_failure(app, client, samples, mocked_responses):
     with patch(
-        "lighthouse.blueprints.plates.add_cog_barcodes",
+        "lighthouse.helpers.plate_jobs.add_cog_barcodes",
         return_value="TS1",
     ):
         with patch(
-            "lighthouse.blueprints.plates.update_mlwh_with_cog_uk_ids",
+            "lighthouse.helpers.plate_jobs.update_mlwh_with_cog_uk_ids",
             side_effect=Exception("Boom!"),
         ):
             ss_url = f"http://{app.config['SS_HOST']}/api/v2/heron/plates"
@@ -130,6 +134,259 @@ def test_post_plates_mlwh_update_failure(app, client, samples, mocked_responses)
             }
 
 
+def test_post_plates_endpoint_async_enqueues_job(app, client, samples, plate_jobs):
+    app.config["PLATE_JOBS_ASYNC"] = True
+
+    response = client.post(
+        "/plates/new",
+        data=json.dumps({"barcode": "123"}),
+        content_type="application/json",
+    )
+    assert response.status_code == HTTPStatus.ACCEPTED
+
+    job_id = response.json["data"]["job_id"]
+    response = client.get(f"/plates/jobs/{job_id}")
+    assert response.status_code == HTTPStatus.OK
+    assert response.json["data"]["barcode"] == "123"
+    assert response.json["data"]["status"] == "queued"
+    assert response.json["data"]["stage"] == "queued"
+
+
+def test_get_plate_job_endpoint_completed_job(
+    app, client, samples, mocked_responses, mlwh_lh_samples, plate_jobs
+):
+    with patch(
+        "lighthouse.helpers.plate_jobs.add_cog_barcodes",
+        return_value="TS1",
+    ):
+        ss_url = f"http://{app.config['SS_HOST']}/api/v2/heron/plates"
+        mocked_responses.add(responses.POST, ss_url, body="{}", status=HTTPStatus.CREATED)
+
+        with app.app_context():
+            job_id = enqueue_plate_job("123")
+            assert run_next_plate_job("test") is True
+
+        response = client.get(f"/plates/jobs/{job_id}")
+        assert response.status_code == HTTPStatus.OK
+        assert response.json["data"]["status"] == "completed"
+        assert response.json["data"]["stage"] == "done"
+        assert response.json["data"]["status_code"] == HTTPStatus.CREATED
+        assert response.json["data"]["response"] == {
+            "data": {"plate_barcode": "123", "centre": "TS1", "number_of_positives": 3}
+        }
+
+
+def test_run_next_plate_job_recovers_abandoned_jobs(
+    app, client, samples, mocked_responses, mlwh_lh_samples, plate_jobs
+):
+    with patch(
+        "lighthouse.helpers.plate_jobs.add_cog_barcodes",
+        return_value="TS1",
+    ):
+        ss_url = f"http://{app.config['SS_HOST']}/api/v2/heron/plates"
+        mocked_responses.add(responses.POST, ss_url, body="{}", status=HTTPStatus.CREATED)
+
+        with app.app_context():
+            plate_jobs_collection = app.data.driver.db.plate_jobs
+            expired = datetime.utcnow() - timedelta(seconds=1)
+            job_ids = []
+            for stage in ["adding_cog_barcodes", "sending_to_sequencescape"]:
+                job_id = enqueue_plate_job("123")
+                plate_jobs_collection.update_one(
+                    {"status": "queued"},
+                    {
+                        "$set": {
+                            "status": "running",
+                            "stage": stage,
+                            "claimed_by": "dead worker",
+                            "claimed_until": expired,
+                        }
+                    },
+                )
+                job_ids.append(job_id)
+
+            # the job which had not reached Sequencescape is run again, the other one is failed
+            assert run_next_plate_job("test") is True
+            assert run_next_plate_job("test") is False
+
+        response = client.get(f"/plates/jobs/{job_ids[0]}")
+        assert response.json["data"]["status"] == "completed"
+        assert response.json["data"]["status_code"] == HTTPStatus.CREATED
+
+        response = client.get(f"/plates/jobs/{job_ids[1]}")
+        assert response.json["data"]["status"] == "failed"
+
+
+def test_run_next_plate_job_stops_when_claim_lost(app, client, samples, plate_jobs):
+    with app.app_context():
+        job_id = enqueue_plate_job("123")
+
+        def claim_job(samples):
+            # another worker claims the job while COG barcodes are being added
+            app.data.driver.db.plate_jobs.update_one(
+                {"status": "running"}, {"$set": {"claimed_by": "other worker"}}
+            )
+            return "TS1"
+
+        with patch("lighthouse.helpers.plate_jobs.add_cog_barcodes", side_effect=claim_job):
+            with patch("lighthouse.helpers.plate_jobs.send_to_ss") as send_to_ss:
+                assert run_next_plate_job("test") is True
+                send_to_ss.assert_not_called()
+
+    response = client.get(f"/plates/jobs/{job_id}")
+    assert response.json["data"]["status"] == "running"
+
+
+def test_run_next_plate_job_stops_when_claim_lost_before_adding_cog_barcodes(
+    app, client, samples, plate_jobs
+):
+    with app.app_context():
+        job_id = enqueue_plate_job("123")
+
+        def claim_job(barcode):
+            # another worker claims the job while its samples are being fetched
+            app.data.driver.db.plate_jobs.update_one(
+                {"status": "running"}, {"$set": {"claimed_by": "other worker"}}
+            )
+            return [{"plate_barcode": barcode}]
+
+        with patch("lighthouse.helpers.plate_jobs.get_positive_samples", side_effect=claim_job):
+            with patch("lighthouse.helpers.plate_jobs.add_cog_barcodes") as add_cog_barcodes:
+                assert run_next_plate_job("test") is True
+                add_cog_barcodes.assert_not_called()
+
+    response = client.get(f"/plates/jobs/{job_id}")
+    assert response.json["data"]["status"] == "running"
+    assert response.json["data"]["response"] is None
+
+def test_run_next_plate_job_finishes_when_claim_lost_after_sending_to_ss(
+    app, client, samples, plate_jobs
+):
+    with app.app_context():
+        job_id = enqueue_plate_job("123")
+
+        def claim_job(body):
+            # another worker claims the job while the plate is being sent to Sequencescape
+            app.data.driver.db.plate_jobs.update_one(
+                {"status": "running"}, {"$set": {"claimed_by": "other worker"}}
+            )
+            return MagicMock(ok=True, status_code=HTTPStatus.CREATED)
+
+        with patch("lighthouse.helpers.plate_jobs.add_cog_barcodes", return_value="TS1"):
+            with patch("lighthouse.helpers.plate_jobs.send_to_ss", side_effect=claim_job):
+                with patch(
+                    "lighthouse.helpers.plate_jobs.update_mlwh_with_cog_uk_ids"
+                ) as update_mlwh:
+                    assert run_next_plate_job("test") is True
+                    update_mlwh.assert_called_once()
+
+    response = client.get(f"/plates/jobs/{job_id}")
+    assert response.json["data"]["status"] == "completed"
+    assert response.json["data"]["status_code"] == HTTPStatus.CREATED
+
+
+def test_get_plate_job_endpoint_unknown_job(app, client, plate_jobs):
+    response = client.get("/plates/jobs/not-a-job")
+    assert response.status_code == HTTPStatus.NOT_FOUND
+    assert response.json == {"errors": ["No job with id: not-a-job"]}
+
+
+def test_post_plates_bulk_endpoint(
+    app, client, centres, samples_different_plates, mocked_responses
+):
+    baracoda_url = f"http://{app.config['BARACODA_URL']}/barcodes_group/TS1/new?count=2"
+    mocked_responses.add(
+        responses.POST,
+        baracoda_url,
+        body=json.dumps({"barcodes_group": {"barcodes": ["COG1", "COG2"]}}),
+        status=HTTPStatus.CREATED,
+    )
+    ss_url = f"http://{app.config['SS_HOST']}/api/v2/heron/plates"
+    mocked_responses.add(responses.POST, ss_url, body="{}", status=HTTPStatus.CREATED)
+    mocked_responses.add(
+        responses.POST,
+        ss_url,
+        body=json.dumps({"errors": ["Plate already exists"]}),
+        status=HTTPStatus.UNPROCESSABLE_ENTITY,
+    )
+
+    with patch("lighthouse.helpers.plate_jobs.update_mlwh_with_cog_uk_ids") as mock_update:
+        response = client.post(
+            "/plates/new/bulk",
+            data=json.dumps({"barcodes": ["123", "456", "789"]}),
+            content_type="application/json",
+        )
+
+    assert response.status_code == HTTPStatus.OK
+    assert len(mocked_responses.calls) == 3
+
+    plates = response.json["plates"]
+    assert [plate["barcode"] for plate in plates] == ["123", "456", "789"]
+    assert plates[2] == {
+        "barcode": "789",
+        "status_code": HTTPStatus.BAD_REQUEST,
+        "errors": ["No samples for this barcode: 789"],
+    }
+    # the plates are sent to SS concurrently, so either could be the one which failed
+    created = [plate for plate in plates[:2] if plate["status_code"] == HTTPStatus.CREATED]
+    assert len(created) == 1
+    assert created[0]["data"]["centre"] == "TS1"
+
+    # only the samples of the plate created in SS are written to the MLWH, with one update
+    mock_update.assert_called_once()
+    assert len(mock_update.call_args[0][0]) == 1
+
+
+def test_post_plates_bulk_endpoint_mlwh_update_fails_for_one_plate(
+    app, client, centres, samples_different_plates, mocked_responses
+):
+    baracoda_url = f"http://{app.config['BARACODA_URL']}/barcodes_group/TS1/new?count=2"
+    mocked_responses.add(
+        responses.POST,
+        baracoda_url,
+        body=json.dumps({"barcodes_group": {"barcodes": ["COG1", "COG2"]}}),
+        status=HTTPStatus.CREATED,
+    )
+    ss_url = f"http://{app.config['SS_HOST']}/api/v2/heron/plates"
+    mocked_responses.add(responses.POST, ss_url, body="{}", status=HTTPStatus.CREATED)
+
+    def update_mlwh(samples):
+        # the samples of plate 456 have no match in the MLWH
+        if any(sample["plate_barcode"] == "456" for sample in samples):
+            raise UnmatchedSampleError("Only some of the samples had matches in the MLWH")
+
+    with patch(
+        "lighthouse.helpers.plate_jobs.update_mlwh_with_cog_uk_ids", side_effect=update_mlwh
+    ) as mock_update:
+        response = client.post(
+            "/plates/new/bulk",
+            data=json.dumps({"barcodes": ["123", "456"]}),
+            content_type="application/json",
+        )
+
+    assert response.status_code == HTTPStatus.OK
+
+    # the batched update failed, so each plate was updated on its own
+    assert mock_update.call_count == 3
+    plates = {plate["barcode"]: plate for plate in response.json["plates"]}
+    assert plates["123"]["status_code"] == HTTPStatus.CREATED
+    assert plates["456"]["status_code"] == HTTPStatus.INTERNAL_SERVER_ERROR
+    assert plates["456"]["errors"] == [
+        "Failed to update MLWH with COG UK ids. The samples should have been successfully "
+        "inserted into Sequencescape."
+    ]
+
+
+def test_post_plates_bulk_endpoint_no_barcodes_in_request(app, client):
+    response = client.post(
+        "/plates/new/bulk",
+        data=json.dumps({"barcodes": "123"}),
+        content_type="application/json",
+    )
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    assert response.json == {"errors": ["POST request needs 'barcodes' in body"]}
+
+
 def test_get_plates_endpoint_successful(app, client, samples, mocked_responses):
     response = client.get(
         "/plates?barcodes[]=123&barcodes[]=456",
@@ -146,7 +403,7 @@ def test_get_plates_endpoint_successful(app, client, samples, mocked_responses):
 
 def test_get_plates_endpoint_fail(app, client, samples, mocked_responses):
     with patch(
-        "lighthouse.blueprints.plates.has_sample_data",
+        "lighthouse.blueprints.plates.get_plates_sample_counts",
         side_effect=Exception("Boom!"),
     ):
         response = client.get(
@@ -155,3 +412,29 @@ def test_get_plates_endpoint_fail(app, client, samples, mocked_responses):
         )
         assert response.status_code == HTTPStatus.INTERNAL_SERVER_ERROR
         assert response.json == {"errors": ["Failed to lookup plates: Exception"]}
+
+
+def test_get_plates_endpoint_keeps_requested_order(app, client, samples_different_plates):
+    response = client.get(
+        "/plates?barcodes[]=456&barcodes[]=789&barcodes[]=123",
+        content_type="application/json",
+    )
+    assert response.status_code == HTTPStatus.OK
+    assert response.json == {
+        "plates": [
+            {"plate_barcode": "456", "plate_map": True, "number_of_positives": 1},
+            {"plate_barcode": "789", "plate_map": False, "number_of_positives": None},
+            {"plate_barcode": "123", "plate_map": True, "number_of_positives": 1},
+        ]
+    }
+
+
+# module-specific test helpers
+
+
+@pytest.fixture
+def plate_jobs(app):
+    yield
+
+    with app.app_context():
+        app.data.driver.db.plate_jobs.delete_many({})
@@ -8,6 +8,7 @@ import responses
 from lighthouse import create_app
 from lighthouse.constants import PLATE_EVENT_SOURCE_ALL_NEGATIVES, PLATE_EVENT_SOURCE_COMPLETED
 from lighthouse.helpers.dart_db import create_dart_connection, load_sql_server_script
+from lighthouse.helpers.dates_tested import DATES_TESTED_WATERMARK
 from lighthouse.helpers.mysql_db import create_mysql_connection_engine, get_table
 from lighthouse.messages.message import Message
 
@@ -123,6 +124,8 @@ def samples(app):
     # clear up after the fixture is used
     with app.app_context():
         samples_collection.delete_many({})
+        # the dates tested of the next samples are parsed by the report from scratch
+        app.data.driver.db.watermarks.delete_many({"_id": DATES_TESTED_WATERMARK})
 
 
 @pytest.fixture
@@ -151,6 +154,8 @@ def samples_no_declaration(app):
     # clear up after the fixture is used
     with app.app_context():
         samples_collection.delete_many({})
+        # the dates tested of the next samples are parsed by the report from scratch
+        app.data.driver.db.watermarks.delete_many({"_id": DATES_TESTED_WATERMARK})
 
 
 @pytest.fixture
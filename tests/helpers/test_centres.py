@@ -0,0 +1,73 @@
+import pytest
+from lighthouse.exceptions import DataError
+from lighthouse.helpers.centres import get_centre_prefix_from_cache, reload_centre_prefixes
+
+
+def test_get_centre_prefix_from_cache_ignores_case(app, centres):
+    with app.app_context():
+        assert get_centre_prefix_from_cache("TEST1") == "TS1"
+        assert get_centre_prefix_from_cache("test2") == "TS2"
+        assert get_centre_prefix_from_cache("TeSt3") == "TS3"
+
+
+def test_get_centre_prefix_from_cache_unknown_centre(app, centres):
+    with app.app_context():
+        assert get_centre_prefix_from_cache("unknown") is None
+
+
+def test_get_centre_prefix_from_cache_does_not_query_known_centres(app, centres):
+    with app.app_context():
+        assert get_centre_prefix_from_cache("test1") == "TS1"
+
+        app.data.driver.db.centres.update_one({"name": "test1"}, {"$set": {"prefix": "NEW"}})
+
+        # still cached
+        assert get_centre_prefix_from_cache("test1") == "TS1"
+
+        reload_centre_prefixes()
+
+        assert get_centre_prefix_from_cache("test1") == "NEW"
+
+
+def test_get_centre_prefix_from_cache_reloads_for_new_centres(app, centres):
+    with app.app_context():
+        assert get_centre_prefix_from_cache("test1") == "TS1"
+
+        app.data.driver.db.centres.insert_one({"name": "test4", "prefix": "TS4"})
+
+        assert get_centre_prefix_from_cache("TEST4") == "TS4"
+
+
+def test_get_centre_prefix_from_cache_caches_unknown_centres(app, centres):
+    with app.app_context():
+        assert get_centre_prefix_from_cache("test4") is None
+
+        app.data.driver.db.centres.insert_one({"name": "test4", "prefix": "TS4"})
+
+        # still cached as unknown
+        assert get_centre_prefix_from_cache("test4") is None
+
+        reload_centre_prefixes()
+
+        assert get_centre_prefix_from_cache("test4") == "TS4"
+
+
+def test_get_centre_prefix_from_cache_expires(app, centres):
+    app.config["CENTRES_CACHE_TTL_SECONDS"] = 0
+
+    with app.app_context():
+        assert get_centre_prefix_from_cache("test1") == "TS1"
+
+        app.data.driver.db.centres.update_one({"name": "test1"}, {"$set": {"prefix": "NEW"}})
+
+        assert get_centre_prefix_from_cache("test1") == "NEW"
+
+
+def test_get_centre_prefix_from_cache_duplicate_names(app, centres):
+    with app.app_context():
+        app.data.driver.db.centres.insert_one({"name": "TEST1", "prefix": "DUP"})
+
+        with pytest.raises(DataError):
+            get_centre_prefix_from_cache("test1")
+
+        assert get_centre_prefix_from_cache("test2") == "TS2"
@@ -0,0 +1,175 @@
+import json
+from datetime import datetime, timedelta
+from http import HTTPStatus
+from unittest.mock import patch
+
+import pytest
+import requests
+import responses
+from lighthouse.constants import FIELD_COG_BARCODE
+from lighthouse.helpers.cog_barcodes import (
+    fetch_cog_barcodes,
+    refill_cog_barcode_reservoir,
+    take_cog_barcodes,
+)
+from lighthouse.helpers.plates import add_cog_barcodes
+
+
+def test_fetch_cog_barcodes(app, mocked_responses):
+    with app.app_context():
+        mocked_responses.add(
+            responses.POST,
+            baracoda_url(app, "TS1", 2),
+            body=json.dumps({"barcodes_group": {"barcodes": ["COG1", "COG2"]}}),
+            status=HTTPStatus.CREATED,
+        )
+
+        assert fetch_cog_barcodes("TS1", 2) == ["COG1", "COG2"]
+
+
+def test_fetch_cog_barcodes_retries_timeouts(app, mocked_responses):
+    with app.app_context():
+        mocked_responses.add(
+            responses.POST, baracoda_url(app, "TS1", 2), body=requests.ReadTimeout("Timed out")
+        )
+        mocked_responses.add(
+            responses.POST,
+            baracoda_url(app, "TS1", 2),
+            body=json.dumps({"barcodes_group": {"barcodes": ["COG1", "COG2"]}}),
+            status=HTTPStatus.CREATED,
+        )
+
+        assert fetch_cog_barcodes("TS1", 2) == ["COG1", "COG2"]
+        assert len(mocked_responses.calls) == 2
+
+
+def test_fetch_cog_barcodes_raises_connection_error_after_timeouts(app, mocked_responses):
+    with app.app_context():
+        mocked_responses.add(
+            responses.POST, baracoda_url(app, "TS1", 2), body=requests.ReadTimeout("Timed out")
+        )
+
+        with pytest.raises(requests.ConnectionError):
+            fetch_cog_barcodes("TS1", 2)
+
+        assert len(mocked_responses.calls) == app.config["BARACODA_RETRY_ATTEMPTS"]
+
+
+def test_take_cog_barcodes_in_reserved_order(app, reservoir):
+    fill_reservoir(app, "TS1", ["COG1", "COG2", "COG3"])
+
+    with app.app_context():
+        with patch("lighthouse.helpers.cog_barcodes.run_in_background") as mock_run_in_background:
+            assert take_cog_barcodes("TS1", 2) == ["COG1", "COG2"]
+
+            mock_run_in_background.assert_called_once()
+
+        assert [doc["barcode"] for doc in reservoir.find({})] == ["COG3"]
+
+
+def test_take_cog_barcodes_not_enough_barcodes(app, reservoir):
+    fill_reservoir(app, "TS1", ["COG1", "COG2"])
+    fill_reservoir(app, "TS2", ["COG3"])
+
+    with app.app_context():
+        with patch("lighthouse.helpers.cog_barcodes.run_in_background"):
+            assert take_cog_barcodes("TS1", 3) is None
+
+        assert reservoir.count_documents({"claimed_by": None}) == 3
+
+
+def test_refill_cog_barcode_reservoir(app, reservoir, mocked_responses):
+    app.config["COG_BARCODE_RESERVOIR_BLOCK_SIZE"] = 2
+    app.config["COG_BARCODE_RESERVOIR_LOW_WATER"] = 1
+
+    with app.app_context():
+        mocked_responses.add(
+            responses.POST,
+            baracoda_url(app, "TS1", 2),
+            body=json.dumps({"barcodes_group": {"barcodes": ["COG1", "COG2"]}}),
+            status=HTTPStatus.CREATED,
+        )
+
+        assert refill_cog_barcode_reservoir("TS1") == 2
+        # the reservoir is above the low water mark
+        assert refill_cog_barcode_reservoir("TS1") == 0
+
+        assert len(mocked_responses.calls) == 1
+        assert [doc["barcode"] for doc in reservoir.find({"centre_prefix": "TS1"})] == [
+            "COG1",
+            "COG2",
+        ]
+
+
+def test_take_cog_barcodes_without_centre_prefix(app, reservoir):
+    with app.app_context():
+        with patch("lighthouse.helpers.cog_barcodes.run_in_background") as mock_run_in_background:
+            assert take_cog_barcodes(None, 2) is None
+
+            mock_run_in_background.assert_not_called()
+
+
+def test_refill_cog_barcode_reservoir_releases_expired_claims(app, reservoir):
+    app.config["COG_BARCODE_RESERVOIR_LOW_WATER"] = 1
+    fill_reservoir(app, "TS1", ["COG1", "COG2"])
+
+    with app.app_context():
+        claimed_at = datetime.utcnow() - timedelta(
+            seconds=app.config["COG_BARCODE_RESERVOIR_CLAIM_TTL_SECONDS"] + 1
+        )
+        reservoir.update_one(
+            {"barcode": "COG1"}, {"$set": {"claimed_by": "gone", "claimed_at": claimed_at}}
+        )
+        reservoir.update_one(
+            {"barcode": "COG2"}, {"$set": {"claimed_by": "busy", "claimed_at": datetime.utcnow()}}
+        )
+
+        # the released barcode brings the reservoir back up to the low water mark
+        with patch("lighthouse.helpers.cog_barcodes.fetch_cog_barcodes") as mock_fetch:
+            assert refill_cog_barcode_reservoir("TS1") == 0
+
+            mock_fetch.assert_not_called()
+
+        assert reservoir.find_one({"barcode": "COG1"})["claimed_by"] is None
+        assert reservoir.find_one({"barcode": "COG2"})["claimed_by"] == "busy"
+
+
+def test_add_cog_barcodes_from_reservoir(app, centres, samples, reservoir, mocked_responses):
+    app.config["COG_BARCODE_RESERVOIR_ENABLE"] = True
+    cog_barcodes = [f"COG{i}" for i in range(len(samples))]
+    fill_reservoir(app, "TS1", cog_barcodes)
+
+    with app.app_context():
+        with patch("lighthouse.helpers.cog_barcodes.run_in_background"):
+            assert add_cog_barcodes(samples) == "TS1"
+
+    assert [sample[FIELD_COG_BARCODE] for sample in samples] == cog_barcodes
+    assert len(mocked_responses.calls) == 0
+
+
+# module-specific test helpers
+
+
+@pytest.fixture
+def reservoir(app):
+    with app.app_context():
+        reservoir = app.data.driver.db.cog_barcode_reservoir
+        reservoir.delete_many({})
+
+        yield reservoir
+
+        reservoir.delete_many({})
+
+
+def fill_reservoir(app, centre_prefix, barcodes):
+    with app.app_context():
+        app.data.driver.db.cog_barcode_reservoir.insert_many(
+            [
+                {"centre_prefix": centre_prefix, "barcode": barcode, "claimed_by": None}
+                for barcode in barcodes
+            ]
+        )
+
+
+def baracoda_url(app, centre_prefix, count):
+    return f"http://{app.config['BARACODA_URL']}/barcodes_group/{centre_prefix}/new?count={count}"
@@ -0,0 +1,82 @@
+import threading
+
+import pytest
+from flask import current_app
+from lighthouse.helpers.concurrency import (
+    ConcurrentCallError,
+    get_executor,
+    run_concurrently,
+    run_each_concurrently,
+)
+
+
+def test_run_concurrently_returns_results_by_name(app):
+    with app.app_context():
+        results = run_concurrently({"one": lambda: 1, "two": lambda: 2})
+
+    assert results == {"one": 1, "two": 2}
+
+
+def test_run_concurrently_runs_calls_in_app_context(app):
+    with app.app_context():
+        results = run_concurrently({"testing": lambda: current_app.config["TESTING"]})
+
+    assert results == {"testing": True}
+
+
+def test_run_concurrently_runs_calls_at_the_same_time(app):
+    # each call waits for the other one, so they can only finish if they run at the same time
+    barrier = threading.Barrier(2, timeout=5)
+
+    with app.app_context():
+        results = run_concurrently({"one": barrier.wait, "two": barrier.wait})
+
+    assert sorted(results.values()) == [0, 1]
+
+
+def test_run_concurrently_raises_first_failure(app):
+    def fail():
+        raise ValueError("Boom!")
+
+    with app.app_context():
+        with pytest.raises(ConcurrentCallError) as excinfo:
+            run_concurrently({"ok": lambda: 1, "fails": fail})
+
+    assert excinfo.value.name == "fails"
+    assert isinstance(excinfo.value.__cause__, ValueError)
+
+
+def test_run_each_concurrently_runs_every_call(app):
+    def fail():
+        raise ValueError("Boom!")
+
+    with app.app_context():
+        futures = run_each_concurrently({"one": lambda: 1, "fail": fail, "two": lambda: 2}, 2)
+
+    assert futures["one"].result() == 1
+    assert futures["two"].result() == 2
+    assert isinstance(futures["fail"].exception(), ValueError)
+
+
+def test_run_each_concurrently_bounds_calls_running_at_once(app):
+    lock = threading.Lock()
+    running = []
+    most_running = []
+
+    def call():
+        with lock:
+            running.append(1)
+            most_running.append(len(running))
+        threading.Event().wait(0.05)
+        with lock:
+            running.pop()
+
+    with app.app_context():
+        run_each_concurrently({str(i): call for i in range(6)}, 2)
+
+    assert max(most_running) == 2
+
+
+def test_get_executor_is_shared_by_the_app(app):
+    with app.app_context():
+        assert get_executor() is get_executor()
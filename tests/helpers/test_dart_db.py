@@ -1,7 +1,14 @@
-from unittest.mock import patch
+from http import HTTPStatus
+from unittest.mock import MagicMock, patch
 
 from lighthouse.constants import FIELD_DART_CONTROL, FIELD_DART_SOURCE_BARCODE
-from lighthouse.helpers.dart_db import find_dart_source_samples_rows
+from lighthouse.helpers.dart_db import (
+    DartConnectionPool,
+    DartConnectionPoolTimeoutError,
+    find_dart_source_samples_rows,
+    find_dart_source_samples_rows_for_barcodes,
+    get_dart_connection_pool,
+)
 from pytest import raises
 
 
@@ -19,6 +26,32 @@ def test_find_dart_source_samples_rows_not_found_barcode(app, dart_seed_reset):
         assert found == []
 
 
+def test_find_dart_source_samples_rows_does_not_inject_barcode(app, dart_seed_reset):
+    with app.app_context():
+        found = find_dart_source_samples_rows("test1' OR '1'='1")
+        assert found == []
+
+
+def test_find_dart_source_samples_rows_for_barcodes(app, dart_seed_reset):
+    with app.app_context():
+        found = find_dart_source_samples_rows_for_barcodes(["test1", "test2", "unknown"])
+        assert list(found.keys()) == ["test1", "test2", "unknown"]
+        assert len(found["test1"]) == 3
+        assert getattr(found["test1"][0], FIELD_DART_SOURCE_BARCODE) == "123"
+        assert len(found["test2"]) == 1
+        assert found["unknown"] == []
+
+
+def test_find_dart_source_samples_rows_for_barcodes_as_requested(app, dart_seed_reset):
+    with app.app_context():
+        # DART matches barcodes regardless of case and trailing spaces
+        found = find_dart_source_samples_rows_for_barcodes(["TEST1 ", "test2"])
+        assert len(found["TEST1 "]) == 3
+        assert len(found["test2"]) == 1
+
+        assert len(find_dart_source_samples_rows("Test1")) == 3
+
+
 def test_exceptions_are_propagated_up(app, dart_seed_reset):
     with app.app_context():
         with patch(
@@ -28,3 +61,80 @@ def test_exceptions_are_propagated_up(app, dart_seed_reset):
             with raises(Exception):
                 found = find_dart_source_samples_rows("unknown")
                 assert found is None
+
+
+def test_find_dart_source_samples_rows_reuses_connections(app, dart_seed_reset):
+    with app.app_context():
+        find_dart_source_samples_rows("test1")
+        find_dart_source_samples_rows("test1")
+
+        metrics = get_dart_connection_pool().metrics()
+        assert metrics["connections_created"] == 1
+        assert metrics["connections_reused"] == 1
+        assert metrics["checked_out"] == 0
+        assert metrics["idle"] == 1
+
+
+def test_dart_health_check(app, client, dart_seed_reset):
+    assert client.get("/health/dart").json == {}
+
+    with app.app_context():
+        find_dart_source_samples_rows("test1")
+
+    response = client.get("/health/dart")
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.json["connections_created"] == 1
+    assert response.json["checked_out"] == 0
+    assert response.json["idle"] == 1
+
+
+def test_dart_connection_pool_discards_connection_after_exception():
+    cnxn = MagicMock()
+    pool = DartConnectionPool(lambda: cnxn, max_size=1, max_idle_seconds=60, checkout_timeout=0)
+
+    with raises(Exception):
+        with pool.connection():
+            raise Exception("Boom!!")
+
+    cnxn.close.assert_called()
+    assert pool.metrics()["idle"] == 0
+    assert pool.metrics()["connections_discarded"] == 1
+
+
+def test_dart_connection_pool_discards_unhealthy_connection():
+    unhealthy, healthy = MagicMock(), MagicMock()
+    unhealthy.cursor.side_effect = Exception("Connection lost")
+    pool = DartConnectionPool(
+        MagicMock(side_effect=[unhealthy, healthy]),
+        max_size=1,
+        max_idle_seconds=60,
+        checkout_timeout=0,
+    )
+
+    pool.checkin(pool.checkout())
+
+    assert pool.checkout() is healthy
+    unhealthy.close.assert_called()
+
+
+def test_dart_connection_pool_discards_idle_connection():
+    old, new = MagicMock(), MagicMock()
+    pool = DartConnectionPool(
+        MagicMock(side_effect=[old, new]), max_size=1, max_idle_seconds=0, checkout_timeout=0
+    )
+
+    pool.checkin(pool.checkout())
+
+    assert pool.checkout() is new
+    old.close.assert_called()
+
+
+def test_dart_connection_pool_is_bounded():
+    pool = DartConnectionPool(MagicMock, max_size=1, max_idle_seconds=60, checkout_timeout=0)
+
+    pool.checkout()
+
+    with raises(DartConnectionPoolTimeoutError):
+        pool.checkout()
+    assert pool.metrics()["checkout_timeouts"] == 1
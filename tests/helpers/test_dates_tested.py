@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta
+
+import pytest
+from lighthouse.constants import (
+    FIELD_DATE_TESTED,
+    FIELD_PARSED_DATE_TESTED,
+    FIELD_ROOT_SAMPLE_ID,
+    FIELD_UPDATED_AT,
+)
+from lighthouse.helpers.dates_tested import update_dates_tested
+
+
+def test_update_dates_tested_parses_both_formats(app, dates_tested_samples):
+    with app.app_context():
+        assert update_dates_tested() == 3
+
+        dates_tested = {
+            sample[FIELD_ROOT_SAMPLE_ID]: sample.get(FIELD_PARSED_DATE_TESTED, "unset")
+            for sample in app.data.driver.db.samples.find()
+        }
+        assert dates_tested == {
+            "MCM001": datetime(2020, 5, 10, 7, 30),
+            "MCM002": datetime(2020, 5, 10, 7, 30),
+            "MCM003": None,
+            "MCM004": "unset",
+        }
+
+
+def test_update_dates_tested_only_updates_changed_samples(app, dates_tested_samples):
+    with app.app_context():
+        update_dates_tested()
+
+        samples_collection = app.data.driver.db.samples
+        samples_collection.insert_many(
+            [
+                {FIELD_ROOT_SAMPLE_ID: "MCM005", FIELD_DATE_TESTED: "2020-06-01 09:00:00 UTC"},
+                {
+                    FIELD_ROOT_SAMPLE_ID: "MCM006",
+                    FIELD_DATE_TESTED: "2020-06-01 09:00:00 UTC",
+                    FIELD_UPDATED_AT: datetime.utcnow() + timedelta(1),
+                },
+            ]
+        )
+
+        parsed = {FIELD_PARSED_DATE_TESTED: {"$exists": True}}
+
+        assert update_dates_tested() == 1
+        assert samples_collection.count_documents(parsed) == 4
+
+        assert update_dates_tested(full_backfill=True) == 1
+        assert samples_collection.count_documents(parsed) == 5
+
+
+def test_update_dates_tested_overlaps_the_watermark(app, dates_tested_samples):
+    with app.app_context():
+        update_dates_tested()
+
+        # a sample written by the crawler just before the previous update, but committed after it
+        written_at = datetime.utcnow() - timedelta(seconds=60)
+        app.data.driver.db.samples.insert_one(
+            {
+                FIELD_ROOT_SAMPLE_ID: "MCM005",
+                FIELD_DATE_TESTED: "2020-06-01 09:00:00 UTC",
+                FIELD_UPDATED_AT: written_at,
+            }
+        )
+
+        assert update_dates_tested() == 1
+
+
+# module-specific test helpers
+
+
+@pytest.fixture
+def dates_tested_samples(app):
+    with app.app_context():
+        app.data.driver.db.samples.insert_many(
+            [
+                {FIELD_ROOT_SAMPLE_ID: "MCM001", FIELD_DATE_TESTED: "2020-05-10 07:30:00 UTC"},
+                {FIELD_ROOT_SAMPLE_ID: "MCM002", FIELD_DATE_TESTED: "10/05/2020 07:30"},
+                {FIELD_ROOT_SAMPLE_ID: "MCM003", FIELD_DATE_TESTED: "not a date"},
+                {FIELD_ROOT_SAMPLE_ID: "MCM004", FIELD_DATE_TESTED: ""},
+            ]
+        )
+
+    yield
+
+    with app.app_context():
+        app.data.driver.db.samples.delete_many({})
+        app.data.driver.db.watermarks.delete_many({})
@@ -0,0 +1,62 @@
+from http import HTTPStatus
+from unittest.mock import patch
+
+import pytest
+import responses
+from lighthouse.helpers.http_client import (
+    UPSTREAM_BARACODA,
+    UPSTREAM_SEQUENCESCAPE,
+    get_http_client,
+    get_http_clients_metrics,
+)
+from requests import ConnectionError
+
+
+def test_get_http_client_is_shared_per_upstream(app):
+    with app.app_context():
+        client = get_http_client(UPSTREAM_BARACODA)
+
+        assert get_http_client(UPSTREAM_BARACODA) is client
+        assert get_http_client(UPSTREAM_SEQUENCESCAPE) is not client
+
+
+def test_get_http_client_uses_upstream_config(app):
+    app.config["HTTP_CLIENT_DEFAULTS"] = {
+        "connect_timeout": 1,
+        "read_timeout": 2,
+        "pool_maxsize": 3,
+    }
+    app.config["HTTP_CLIENTS"] = {UPSTREAM_BARACODA: {"read_timeout": 20}}
+
+    with app.app_context():
+        assert get_http_client(UPSTREAM_BARACODA).timeout == (1, 20)
+        assert get_http_client(UPSTREAM_SEQUENCESCAPE).timeout == (1, 2)
+
+
+def test_http_client_passes_timeout(app):
+    with app.app_context():
+        client = get_http_client(UPSTREAM_BARACODA)
+        with patch.object(client.session, "request") as mock_request:
+            client.post("http://baracoda/test", json={})
+
+            mock_request.assert_called_with(
+                "POST", "http://baracoda/test", json={}, timeout=client.timeout
+            )
+
+
+def test_http_client_counts_requests(app, mocked_responses):
+    mocked_responses.add(responses.POST, "http://baracoda/ok", status=HTTPStatus.CREATED)
+    mocked_responses.add(responses.POST, "http://baracoda/down", body=ConnectionError("Some error"))
+
+    with app.app_context():
+        client = get_http_client(UPSTREAM_BARACODA)
+        assert client.post("http://baracoda/ok").status_code == HTTPStatus.CREATED
+        with pytest.raises(ConnectionError):
+            client.post("http://baracoda/down")
+
+        metrics = get_http_clients_metrics()
+
+    assert list(metrics.keys()) == [UPSTREAM_BARACODA]
+    assert metrics[UPSTREAM_BARACODA]["requests"] == 2
+    assert metrics[UPSTREAM_BARACODA]["failures"] == 1
+    assert metrics[UPSTREAM_BARACODA]["max_ms"] >= metrics[UPSTREAM_BARACODA]["mean_ms"]
@@ -0,0 +1,149 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from http import HTTPStatus
+from unittest.mock import MagicMock
+
+import pytest
+from lighthouse.helpers.idempotency import IDEMPOTENCY_STATUS_IN_PROGRESS, run_idempotently
+
+
+def test_run_idempotently_returns_recorded_response(app, idempotency_records):
+    call = MagicMock(return_value=({"data": "created"}, HTTPStatus.CREATED, True))
+
+    with app.app_context():
+        first = run_idempotently("key", call)
+        second = run_idempotently("key", call)
+
+    assert first == ({"data": "created"}, HTTPStatus.CREATED)
+    assert second == first
+    call.assert_called_once()
+
+
+def test_run_idempotently_runs_again_when_response_not_kept(app, idempotency_records):
+    call = MagicMock(return_value=({"errors": ["Boom!"]}, HTTPStatus.BAD_GATEWAY, False))
+
+    with app.app_context():
+        run_idempotently("key", call)
+        run_idempotently("key", call)
+
+    assert call.call_count == 2
+
+
+def test_run_idempotently_runs_again_after_exception(app, idempotency_records):
+    call = MagicMock(side_effect=[Exception("Boom!"), ({}, HTTPStatus.OK, True)])
+
+    with app.app_context():
+        with pytest.raises(Exception):
+            run_idempotently("key", call)
+
+        assert run_idempotently("key", call) == ({}, HTTPStatus.OK)
+
+
+def test_run_idempotently_waits_for_request_in_progress(app, idempotency_records):
+    started = threading.Event()
+    results = []
+
+    def slow_call(idempotent_request):
+        started.set()
+        time.sleep(0.2)
+        return {"data": "created"}, HTTPStatus.CREATED, True
+
+    def run_first():
+        with app.app_context():
+            results.append(run_idempotently("key", slow_call))
+
+    first = threading.Thread(target=run_first)
+    first.start()
+    started.wait(5)
+
+    duplicate = MagicMock()
+    app.config["IDEMPOTENCY_WAIT_SECONDS"] = 5
+    app.config["IDEMPOTENCY_POLL_INTERVAL_SECONDS"] = 0.05
+    with app.app_context():
+        assert run_idempotently("key", duplicate) == ({"data": "created"}, HTTPStatus.CREATED)
+
+    first.join(5)
+    duplicate.assert_not_called()
+    assert results == [({"data": "created"}, HTTPStatus.CREATED)]
+
+
+def test_run_idempotently_conflict_while_request_in_progress(app, idempotency_records):
+    started = threading.Event()
+    finish = threading.Event()
+    results = []
+
+    def slow_call(idempotent_request):
+        started.set()
+        finish.wait(5)
+        return {"data": "created"}, HTTPStatus.CREATED, True
+
+    def run_first():
+        with app.app_context():
+            results.append(run_idempotently("key", slow_call))
+
+    first = threading.Thread(target=run_first)
+    first.start()
+    started.wait(5)
+
+    duplicate = MagicMock()
+    app.config["IDEMPOTENCY_WAIT_SECONDS"] = 0.1
+    app.config["IDEMPOTENCY_POLL_INTERVAL_SECONDS"] = 0.05
+    with app.app_context():
+        # the request is still in progress after the wait
+        _, status_code = run_idempotently("key", duplicate)
+        assert status_code == HTTPStatus.CONFLICT
+
+        finish.set()
+        first.join(5)
+
+        # a retry once the request has completed is given its response
+        assert run_idempotently("key", duplicate) == ({"data": "created"}, HTTPStatus.CREATED)
+
+    duplicate.assert_not_called()
+    assert results == [({"data": "created"}, HTTPStatus.CREATED)]
+
+
+def test_run_idempotently_gives_saved_values_to_next_attempt(app, idempotency_records):
+    def first_call(idempotent_request):
+        assert idempotent_request.get("reserved") is None
+        idempotent_request.save("reserved", ["COG1", "COG2"])
+        return {"errors": ["Boom!"]}, HTTPStatus.BAD_GATEWAY, False
+
+    def second_call(idempotent_request):
+        return {"reserved": idempotent_request.get("reserved")}, HTTPStatus.CREATED, True
+
+    with app.app_context():
+        run_idempotently("key", first_call)
+
+        assert run_idempotently("key", second_call) == (
+            {"reserved": ["COG1", "COG2"]},
+            HTTPStatus.CREATED,
+        )
+
+
+def test_run_idempotently_claims_expired_lease(app, idempotency_records):
+    with app.app_context():
+        app.data.driver.db.idempotency_records.insert_one(
+            {
+                "_id": "key",
+                "status": IDEMPOTENCY_STATUS_IN_PROGRESS,
+                "owner": "another",
+                "lease_expires_at": datetime.utcnow() - timedelta(seconds=1),
+            }
+        )
+
+        call = MagicMock(return_value=({}, HTTPStatus.OK, True))
+
+        assert run_idempotently("key", call) == ({}, HTTPStatus.OK)
+
+
+# module-specific test helpers
+
+
+@pytest.fixture
+def idempotency_records(app):
+    yield
+
+    with app.app_context():
+        app.data.driver.db.idempotency_records.delete_many({})
@@ -1,8 +1,13 @@
 import json
 from http import HTTPStatus
+from unittest.mock import MagicMock, call, patch
 
 import responses
-from lighthouse.helpers.labwhere import get_locations_from_labwhere, set_locations_in_labwhere
+from lighthouse.helpers.labwhere import (
+    ScanCoalescer,
+    get_locations_from_labwhere,
+    set_locations_in_labwhere,
+)
 
 
 def test_get_locations_from_labwhere(app, labwhere_samples_simple):
@@ -41,3 +46,111 @@ def test_set_locations_in_labwhere(app, mocked_responses):
 
         response = set_locations_in_labwhere(["123"], "location-1-1", "robot-1")
         assert response
+
+
+def test_scan_coalescer_merges_scans_with_the_same_key(app):
+    with patch("lighthouse.helpers.labwhere.set_locations_in_labwhere") as mock_set_locations:
+        coalescer = scan_coalescer(app, window_seconds=60)
+        coalescer.add(["plate-1"], "bin", "robot-1")
+        coalescer.add(["plate-2", "plate-1"], "bin", "robot-1")
+        coalescer.add(["plate-3"], "bin", "robot-2")
+        coalescer.flush()
+
+        assert coalescer.wait_until_idle(timeout=5)
+
+        assert mock_set_locations.call_count == 2
+        mock_set_locations.assert_has_calls(
+            [
+                call(
+                    labware_barcodes=["plate-1", "plate-2"],
+                    location_barcode="bin",
+                    user_barcode="robot-1",
+                ),
+                call(labware_barcodes=["plate-3"], location_barcode="bin", user_barcode="robot-2"),
+            ],
+            any_order=True,
+        )
+        assert coalescer.scans_requested == 3
+        assert coalescer.scans_sent == 2
+
+
+def test_scan_coalescer_sends_scan_when_window_ends(app):
+    with patch("lighthouse.helpers.labwhere.set_locations_in_labwhere") as mock_set_locations:
+        coalescer = scan_coalescer(app, window_seconds=0.1)
+        coalescer.add(["plate-1"], "bin", "robot-1")
+
+        assert coalescer.wait_until_idle(timeout=5)
+
+        mock_set_locations.assert_called_once_with(
+            labware_barcodes=["plate-1"], location_barcode="bin", user_barcode="robot-1"
+        )
+
+
+def test_scan_coalescer_sends_scan_when_full(app):
+    with patch("lighthouse.helpers.labwhere.set_locations_in_labwhere") as mock_set_locations:
+        coalescer = scan_coalescer(app, window_seconds=60, max_labware=2)
+        coalescer.add(["plate-1", "plate-2"], "bin", "robot-1")
+
+        assert coalescer.wait_until_idle(timeout=5)
+
+        mock_set_locations.assert_called_once_with(
+            labware_barcodes=["plate-1", "plate-2"], location_barcode="bin", user_barcode="robot-1"
+        )
+
+
+def test_scan_coalescer_retries_and_reports_failed_scans(app):
+    on_failure = MagicMock()
+    with patch(
+        "lighthouse.helpers.labwhere.set_locations_in_labwhere",
+        return_value=MagicMock(ok=False, status_code=500),
+    ) as mock_set_locations:
+        coalescer = scan_coalescer(app, window_seconds=0, attempts=3, on_failure=on_failure)
+        coalescer.add(["plate-1"], "bin", "robot-1")
+
+        assert coalescer.wait_until_idle(timeout=5)
+
+        assert mock_set_locations.call_count == 3
+        on_failure.assert_called_once_with(
+            "robot-1", "bin", ["plate-1"], ["LabWhere responded with status 500"], 3
+        )
+
+
+def test_scan_coalescer_sends_merged_scans_separately_when_they_fail(app):
+    def set_locations(labware_barcodes, location_barcode, user_barcode):
+        # labwhere rejects scans of unknown labware
+        return MagicMock(ok="unknown" not in labware_barcodes, status_code=422)
+
+    on_failure = MagicMock()
+    with patch(
+        "lighthouse.helpers.labwhere.set_locations_in_labwhere", side_effect=set_locations
+    ) as mock_set_locations:
+        coalescer = scan_coalescer(app, window_seconds=60, on_failure=on_failure)
+        good_scan = coalescer.add(["plate-1"], "bin", "robot-1")
+        bad_scan = coalescer.add(["unknown"], "bin", "robot-1")
+        coalescer.flush()
+
+        assert coalescer.wait_until_idle(timeout=5)
+
+        assert mock_set_locations.call_count == 3
+        assert good_scan.wait(timeout=0)
+        assert good_scan.errors == []
+        assert bad_scan.wait(timeout=0)
+        assert bad_scan.errors == ["LabWhere responded with status 422"]
+        on_failure.assert_called_once_with(
+            "robot-1", "bin", ["unknown"], ["LabWhere responded with status 422"], 1
+        )
+
+
+# module-specific test helpers
+
+
+def scan_coalescer(app, window_seconds, max_labware=50, attempts=1, on_failure=None):
+    return ScanCoalescer(
+        app,
+        window_seconds=window_seconds,
+        max_labware=max_labware,
+        attempts=attempts,
+        backoff_seconds=0,
+        max_backoff_seconds=0,
+        on_failure=on_failure,
+    )
@@ -1,5 +1,6 @@
 from unittest.mock import patch
 from lighthouse.helpers.mongo_db import (
+    count_samples_for_plates,
     get_source_plate_uuid,
     get_positive_samples_in_source_plate,
 )
@@ -56,3 +57,13 @@ def test_get_positive_samples_in_source_plate_returns_none_failure_fetching_samp
                 samples_with_uuids[0][FIELD_LH_SOURCE_PLATE_UUID]
             )
             assert result is None
+
+
+def test_count_samples_for_plates(app, samples):
+    with app.app_context():
+        assert count_samples_for_plates(["123", "456"]) == {"123": {"total": 10, "positives": 3}}
+
+
+def test_count_samples_for_plates_no_barcodes(app, samples):
+    with app.app_context():
+        assert count_samples_for_plates([]) == {}
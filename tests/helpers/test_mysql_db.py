@@ -0,0 +1,84 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+from lighthouse.helpers.mysql_db import (
+    MYSQL_ER_LOCK_DEADLOCK,
+    clear_registry,
+    get_mysql_connection_engine,
+    get_table,
+    with_deadlock_retry,
+)
+from sqlalchemy.exc import OperationalError
+
+
+def test_get_mysql_connection_engine_reuses_engine(app):
+    conn_string = app.config["WAREHOUSES_RW_CONN_STRING"]
+
+    engine = get_mysql_connection_engine(conn_string, app.config["MLWH_DB"])
+
+    assert get_mysql_connection_engine(conn_string, app.config["MLWH_DB"]) is engine
+    assert get_mysql_connection_engine(conn_string, app.config["EVENTS_WH_DB"]) is not engine
+
+
+def test_get_table_caches_reflected_table(app, mlwh_sql_engine):
+    table_name = app.config["MLWH_LIGHTHOUSE_SAMPLE_TABLE"]
+
+    table = get_table(mlwh_sql_engine, table_name)
+
+    with patch("lighthouse.helpers.mysql_db.MetaData") as mock_metadata:
+        assert get_table(mlwh_sql_engine, table_name) is table
+        mock_metadata.assert_not_called()
+
+
+def test_get_table_refreshes_expired_table(app, mlwh_sql_engine):
+    table_name = app.config["MLWH_LIGHTHOUSE_SAMPLE_TABLE"]
+
+    table = get_table(mlwh_sql_engine, table_name)
+    refreshed = get_table(mlwh_sql_engine, table_name, max_age=0)
+
+    assert refreshed is not table
+    assert refreshed.name == table_name
+
+
+def test_with_deadlock_retry_retries_deadlocks():
+    transaction = MagicMock(side_effect=[mysql_error(MYSQL_ER_LOCK_DEADLOCK), 3])
+
+    with patch("lighthouse.helpers.mysql_db.time.sleep") as mock_sleep:
+        assert with_deadlock_retry(transaction, attempts=3, backoff_seconds=0.5) == 3
+
+    assert transaction.call_count == 2
+    mock_sleep.assert_called_once_with(0.5)
+
+
+def test_with_deadlock_retry_gives_up_after_attempts():
+    transaction = MagicMock(side_effect=mysql_error(MYSQL_ER_LOCK_DEADLOCK))
+
+    with patch("lighthouse.helpers.mysql_db.time.sleep"):
+        with pytest.raises(OperationalError):
+            with_deadlock_retry(transaction, attempts=3, backoff_seconds=0.5)
+
+    assert transaction.call_count == 3
+
+
+def test_with_deadlock_retry_does_not_retry_other_errors():
+    # 2003: can't connect to the MySQL server
+    transaction = MagicMock(side_effect=mysql_error(2003))
+
+    with pytest.raises(OperationalError):
+        with_deadlock_retry(transaction, attempts=3, backoff_seconds=0)
+
+    transaction.assert_called_once()
+
+
+# module-specific test helpers
+
+
+def mysql_error(code):
+    return OperationalError("UPDATE ...", {}, Exception(code, "error"))
+
+
+@pytest.fixture(autouse=True)
+def clear_mysql_registry():
+    clear_registry()
+    yield
+    clear_registry()
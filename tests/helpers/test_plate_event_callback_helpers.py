@@ -1,6 +1,11 @@
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
-from lighthouse.helpers.plate_event_callbacks import fire_callbacks
+import pytest
+from lighthouse.helpers.plate_event_callbacks import (
+    CallbackWorker,
+    dispatch_callbacks,
+    fire_callbacks,
+)
 
 
 def test_fire_callbacks_unrecognised_event(app, message_unknown):
@@ -58,8 +63,150 @@ def test_fire_callbacks_source_fully_picked(app, message_source_complete):
             assert success is True
 
 
+def test_fire_callbacks_with_labwhere_error_response(app, message_source_complete):
+    app.config["PLATE_EVENT_CALLBACKS_ASYNC"] = True
+    with app.app_context():
+        with patch(
+            "lighthouse.helpers.plate_event_callbacks.set_locations_in_labwhere",
+            return_value=MagicMock(ok=False, status_code=500),
+        ):
+            success, errors = fire_callbacks(message_source_complete)
+
+            assert errors == ["LabWhere responded with status 500"]
+            assert success is False
+
+
+def test_fire_callbacks_with_labwhere_error_response_inline(app, message_source_complete):
+    app.config["PLATE_EVENT_CALLBACKS_ASYNC"] = False
+    with app.app_context():
+        with patch(
+            "lighthouse.helpers.plate_event_callbacks.set_locations_in_labwhere",
+            return_value=MagicMock(ok=False, status_code=500),
+        ):
+            success, errors = fire_callbacks(message_source_complete)
+
+            assert errors == []
+            assert success is True
+
+
+def test_dispatch_callbacks_fires_inline_when_not_async(app, message_source_complete):
+    app.config["PLATE_EVENT_CALLBACKS_ASYNC"] = False
+    with app.app_context():
+        with patch(
+            "lighthouse.helpers.plate_event_callbacks.set_locations_in_labwhere",
+            side_effect=Exception("Labwhere was down"),
+        ):
+            success, errors = dispatch_callbacks(message_source_complete)
+
+            assert errors == ["Exception: Labwhere was down"]
+            assert success is False
+
+
+def test_dispatch_callbacks_fires_in_background(app, message_source_complete):
+    app.config["PLATE_EVENT_CALLBACKS_ASYNC"] = True
+    with app.app_context():
+        with patch(
+            "lighthouse.helpers.plate_event_callbacks.set_locations_in_labwhere"
+        ) as mock_set_locations_in_labwhere:
+            success, errors = dispatch_callbacks(message_source_complete)
+
+            assert success is True
+            assert errors == []
+
+            worker = app.extensions["plate_event_callback_worker"]
+            assert worker.wait_until_idle(timeout=5)
+
+            mock_set_locations_in_labwhere.assert_called_once()
+
+
+def test_callback_worker_retries_failed_callbacks(app, message_source_complete, no_backoff):
+    with app.app_context():
+        with patch(
+            "lighthouse.helpers.plate_event_callbacks.set_locations_in_labwhere",
+            side_effect=[Exception("Labwhere was down"), MagicMock(ok=True)],
+        ) as mock_set_locations_in_labwhere:
+            worker = CallbackWorker(app)
+            worker.submit(message_source_complete)
+
+            assert worker.wait_until_idle(timeout=5)
+
+            assert mock_set_locations_in_labwhere.call_count == 2
+            assert app.data.driver.db.plate_event_callback_failures.count_documents({}) == 0
+
+
+def test_callback_worker_records_failure_after_all_attempts(
+    app, message_source_complete, no_backoff
+):
+    with app.app_context():
+        with patch(
+            "lighthouse.helpers.plate_event_callbacks.set_locations_in_labwhere",
+            side_effect=Exception("Labwhere was down"),
+        ) as mock_set_locations_in_labwhere:
+            worker = CallbackWorker(app)
+            worker.submit(message_source_complete)
+
+            assert worker.wait_until_idle(timeout=5)
+
+            attempts = app.config["PLATE_EVENT_CALLBACK_RETRY_ATTEMPTS"]
+            assert mock_set_locations_in_labwhere.call_count == attempts
+
+            failures = list(app.data.driver.db.plate_event_callback_failures.find({}))
+            assert len(failures) == 1
+            assert failures[0]["event"] == message_source_complete.message
+            assert failures[0]["errors"] == ["Exception: Labwhere was down"]
+            assert failures[0]["attempts"] == attempts
+
+
+def test_fire_callbacks_coalesces_transfers_to_bin(app, message_source_complete):
+    app.config["LABWHERE_SCAN_COALESCE_SECONDS"] = 60
+    app.config["PLATE_EVENT_CALLBACKS_ASYNC"] = True
+    with app.app_context():
+        with patch(
+            "lighthouse.helpers.plate_event_callbacks.get_scan_coalescer"
+        ) as mock_get_scan_coalescer:
+            success, errors = fire_callbacks(message_source_complete)
+
+            mock_get_scan_coalescer().add.assert_called_with(
+                labware_barcodes=["plate-barcode"],
+                location_barcode="heron-bin",
+                user_barcode="robot-serial",
+            )
+            assert errors == []
+            assert success is True
+
+
+def test_fire_callbacks_reports_coalesced_scan_failure_inline(app, message_source_complete):
+    app.config["LABWHERE_SCAN_COALESCE_SECONDS"] = 60
+    app.config["PLATE_EVENT_CALLBACKS_ASYNC"] = False
+    with app.app_context():
+        with patch(
+            "lighthouse.helpers.plate_event_callbacks.get_scan_coalescer"
+        ) as mock_get_scan_coalescer:
+            scan = mock_get_scan_coalescer().add.return_value
+            scan.wait.return_value = True
+            scan.errors = ["LabWhere responded with status 422"]
+
+            success, errors = fire_callbacks(message_source_complete)
+
+            assert errors == ["LabWhere responded with status 422"]
+            assert success is False
+
+
 # TODO: test_fire_callbacks_control_plate_used
 #       It is currently unclear which event to use for this.
 #       We *Could* use the destination complete event, and extract
 #       the information from the control sample friendly name but
 #       there may be a more robust approach
+
+
+# module-specific test helpers
+
+
+@pytest.fixture
+def no_backoff(app):
+    app.config["PLATE_EVENT_CALLBACK_RETRY_BACKOFF_SECONDS"] = 0
+
+    yield
+
+    with app.app_context():
+        app.data.driver.db.plate_event_callback_failures.delete_many({})
@@ -0,0 +1,116 @@
+from datetime import datetime, timedelta
+
+import pytest
+from lighthouse.constants import (
+    FIELD_LH_SOURCE_PLATE_UUID,
+    FIELD_PLATE_BARCODE,
+    FIELD_UPDATED_AT,
+)
+from lighthouse.helpers.plate_summaries import get_plate_summaries_counts, update_plate_summaries
+from lighthouse.helpers.plates import get_plates_sample_counts, get_positive_samples_count
+
+
+def test_update_plate_summaries_builds_all_summaries(app, samples_different_plates, source_plates):
+    with app.app_context():
+        assert update_plate_summaries() == 2
+
+        summaries = {
+            summary[FIELD_PLATE_BARCODE]: summary
+            for summary in app.data.driver.db.plate_summaries.find()
+        }
+        assert summaries["123"]["total"] == 1
+        assert summaries["123"]["positives"] == 1
+        assert summaries["123"][FIELD_LH_SOURCE_PLATE_UUID] == source_plates[0][
+            FIELD_LH_SOURCE_PLATE_UUID
+        ]
+        assert summaries["456"]["total"] == 1
+
+
+def test_update_plate_summaries_only_updates_changed_plates(app, samples_different_plates):
+    with app.app_context():
+        update_plate_summaries()
+
+        samples_collection = app.data.driver.db.samples
+        samples_collection.insert_one(
+            {FIELD_PLATE_BARCODE: "789", FIELD_UPDATED_AT: datetime.utcnow() + timedelta(1)}
+        )
+
+        assert update_plate_summaries() == 1
+        assert get_plate_summaries_counts(["123", "789"]) == {
+            "123": {"total": 1, "positives": 1},
+            "789": {"total": 1},
+        }
+
+
+def test_update_plate_summaries_full_rebuild_removes_empty_plates(app, samples_different_plates):
+    with app.app_context():
+        update_plate_summaries()
+        app.data.driver.db.samples.delete_many({FIELD_PLATE_BARCODE: "456"})
+
+        assert update_plate_summaries(full_rebuild=True) == 1
+        assert get_plate_summaries_counts(["123", "456"]) == {"123": {"total": 1, "positives": 1}}
+
+
+def test_update_plate_summaries_periodically_recounts_plates_samples_moved_from(
+    app, samples_different_plates
+):
+    with app.app_context():
+        update_plate_summaries()
+
+        # moving a sample does not necessarily touch its updated_at
+        app.data.driver.db.samples.update_many(
+            {FIELD_PLATE_BARCODE: "456"}, {"$set": {FIELD_PLATE_BARCODE: "789"}}
+        )
+
+        assert update_plate_summaries() == 0
+        assert "456" in get_plate_summaries_counts(["456"])
+
+        app.config["PLATE_SUMMARIES_FULL_REBUILD_SECONDS"] = 0
+
+        assert update_plate_summaries() == 2
+        assert get_plate_summaries_counts(["123", "456", "789"]) == {
+            "123": {"total": 1, "positives": 1},
+            "789": {"total": 1, "positives": 1},
+        }
+
+
+def test_update_plate_summaries_overlaps_the_watermark(app, samples_different_plates):
+    with app.app_context():
+        update_plate_summaries()
+
+        # a sample written by the crawler just before the previous update, but committed after it
+        written_at = datetime.utcnow() - timedelta(seconds=60)
+        app.data.driver.db.samples.insert_one(
+            {FIELD_PLATE_BARCODE: "789", FIELD_UPDATED_AT: written_at}
+        )
+
+        assert update_plate_summaries() == 1
+        assert get_plate_summaries_counts(["789"]) == {"789": {"total": 1}}
+
+
+def test_get_plates_sample_counts_reads_summaries(app, samples_different_plates):
+    with app.app_context():
+        app.config["PLATE_SUMMARIES_ENABLE"] = True
+        app.data.driver.db.plate_summaries.insert_one(
+            {FIELD_PLATE_BARCODE: "123", "total": 96, "positives": 5}
+        )
+
+        # plate 456 has no summary so is counted from the samples
+        assert get_plates_sample_counts(["123", "456"]) == {
+            "123": {"total": 96, "positives": 5},
+            "456": {"total": 1, "positives": 1},
+        }
+        assert get_positive_samples_count("123") == 5
+        assert get_positive_samples_count("456") == 1
+
+
+# module-specific test helpers
+
+
+@pytest.fixture(autouse=True)
+def clear_plate_summaries(app):
+    yield
+
+    with app.app_context():
+        app.data.driver.db.plate_summaries.delete_many({})
+        app.data.driver.db.watermarks.delete_many({})
@@ -24,6 +24,7 @@ from lighthouse.constants import (
     FIELD_RESULT,
     FIELD_RNA_ID,
     FIELD_ROOT_SAMPLE_ID,
+    FIELD_SOURCE,
     FIELD_SS_BARCODE,
     FIELD_SS_CONTROL,
     FIELD_SS_CONTROL_TYPE,
@@ -43,28 +44,31 @@ from lighthouse.constants import (
 from lighthouse.helpers.plates import (
     UnmatchedSampleError,
     add_cog_barcodes,
-    add_controls_to_samples,
-    check_matching_sample_numbers,
+    add_cog_barcodes_to_plates,
+    bulk_update_mlwh_with_cog_uk_ids,
     construct_cherrypicking_plate_failed_message,
     create_cherrypicked_post_body,
     create_post_body,
-    equal_row_and_sample,
-    find_sample_matching_row,
+    filter_cherrypicked_samples,
+    find_cherrypicked_samples,
     find_samples,
     find_source_plates,
     get_centre_prefix,
+    get_plates_sample_counts,
     get_positive_samples,
     get_positive_samples_count,
+    get_positive_samples_for_plates,
     get_source_plates_for_samples,
     get_unique_plate_barcodes,
+    index_samples_by_row_key,
+    join_dart_rows_with_samples,
     join_rows_with_samples,
     map_to_ss_columns,
+    partition_rows,
     query_for_cherrypicked_samples,
     query_for_source_plate_uuids,
     row_is_normal_sample,
     row_to_dict,
-    rows_with_controls,
-    rows_without_controls,
     update_mlwh_with_cog_uk_ids,
 )
 from requests import ConnectionError
@@ -332,6 +336,47 @@ def test_create_post_body(app, samples):
         assert create_post_body(barcode, samples) == correct_body
 
 
+def test_add_cog_barcodes_to_plates_one_request_per_centre(
+    app, centres, samples_different_plates, mocked_responses
+):
+    with app.app_context():
+        baracoda_url = f"http://{current_app.config['BARACODA_URL']}/barcodes_group/TS1/new?count=2"
+        mocked_responses.add(
+            responses.POST,
+            baracoda_url,
+            body=json.dumps({"barcodes_group": {"barcodes": ["COG1", "COG2"]}}),
+            status=HTTPStatus.CREATED,
+        )
+        samples_by_plate = {
+            "123": [samples_different_plates[0]],
+            "456": [samples_different_plates[1]],
+            "789": [{**samples_different_plates[1], FIELD_SOURCE: ""}],
+        }
+
+        centre_prefixes, failures = add_cog_barcodes_to_plates(samples_by_plate)
+
+    assert len(mocked_responses.calls) == 1
+    assert centre_prefixes == {"123": "TS1", "456": "TS1"}
+    assert list(failures.keys()) == ["789"]
+    assert samples_by_plate["123"][0][FIELD_COG_BARCODE] == "COG1"
+    assert samples_by_plate["456"][0][FIELD_COG_BARCODE] == "COG2"
+
+
+def test_add_cog_barcodes_to_plates_baracoda_fails(
+    app, centres, samples_different_plates, mocked_responses
+):
+    with app.app_context():
+        baracoda_url = f"http://{current_app.config['BARACODA_URL']}/barcodes_group/TS1/new?count=2"
+        mocked_responses.add(responses.POST, baracoda_url, status=HTTPStatus.BAD_REQUEST)
+
+        centre_prefixes, failures = add_cog_barcodes_to_plates(
+            {"123": [samples_different_plates[0]], "456": [samples_different_plates[1]]}
+        )
+
+    assert centre_prefixes == {}
+    assert list(failures.keys()) == ["123", "456"]
+
+
 def test_get_positive_samples(app, samples):
     with app.app_context():
         assert len(get_positive_samples("123")) == 3
@@ -342,6 +387,15 @@ def test_get_positive_samples_different_plates(app, samples_different_plates):
         assert len(get_positive_samples("123")) == 1
 
 
+def test_get_positive_samples_for_plates(app, samples_different_plates):
+    with app.app_context():
+        samples_by_plate = get_positive_samples_for_plates(["123", "456", "789"])
+
+    assert list(samples_by_plate.keys()) == ["123", "456"]
+    assert [sample[FIELD_ROOT_SAMPLE_ID] for sample in samples_by_plate["123"]] == ["MCM001"]
+    assert [sample[FIELD_ROOT_SAMPLE_ID] for sample in samples_by_plate["456"]] == ["MCM002"]
+
+
 def test_get_positive_samples_count_valid_barcode(app, samples):
     with app.app_context():
         assert get_positive_samples_count("123") == 3
@@ -357,6 +411,24 @@ def test_get_positive_samples_count_different_plates(app, samples_different_plat
         assert get_positive_samples_count("123") == 1
 
 
+def test_get_plates_sample_counts(app, samples):
+    with app.app_context():
+        assert get_plates_sample_counts(["123", "456"]) == {"123": {"total": 10, "positives": 3}}
+
+
+def test_get_plates_sample_counts_different_plates(app, samples_different_plates):
+    with app.app_context():
+        assert get_plates_sample_counts(["123", "456"]) == {
+            "123": {"total": 1, "positives": 1},
+            "456": {"total": 1, "positives": 1},
+        }
+
+
+def test_get_plates_sample_counts_no_barcodes(app, samples):
+    with app.app_context():
+        assert get_plates_sample_counts([]) == {}
+
+
 def test_update_mlwh_with_cog_uk_ids(
     app, mlwh_lh_samples_multiple, samples_for_mlwh_update, cog_uk_ids, mlwh_sql_engine
 ):
@@ -385,6 +457,21 @@ def test_update_mlwh_with_cog_uk_ids(
         assert after_cog_uk_ids == set(cog_uk_ids)
 
 
+def test_update_mlwh_with_cog_uk_ids_in_chunks(
+    app, mlwh_lh_samples_multiple, samples_for_mlwh_update, cog_uk_ids, mlwh_sql_engine
+):
+    with app.app_context():
+        app.config["MLWH_BULK_UPDATE_CHUNK_SIZE"] = 2
+
+        assert bulk_update_mlwh_with_cog_uk_ids(samples_for_mlwh_update) == 3
+
+        after_cog_uk_ids = {
+            row[MLWH_LH_SAMPLE_COG_UK_ID]
+            for row in retrieve_samples_cursor(app.config, mlwh_sql_engine)
+        }
+        assert after_cog_uk_ids == set(cog_uk_ids)
+
+
 def test_update_mlwh_with_cog_uk_ids_connection_fails(
     app, mlwh_lh_samples_multiple, samples_for_mlwh_update
 ):
@@ -494,29 +581,48 @@ def test_query_for_cherrypicked_samples_generates_list(app):
     ]
 
     assert query_for_cherrypicked_samples(test) == {
-        "$or": [
-            {
-                FIELD_ROOT_SAMPLE_ID: "sample_1",
-                FIELD_RNA_ID: "plate1:A01",
-                FIELD_LAB_ID: "ABC",
-                FIELD_RESULT: {"$regex": "^positive", "$options": "i"},
-            },
-            {
-                FIELD_ROOT_SAMPLE_ID: "sample_1",
-                FIELD_RNA_ID: "plate1:A02",
-                FIELD_LAB_ID: "ABC",
-                FIELD_RESULT: {"$regex": "^positive", "$options": "i"},
-            },
-            {
-                FIELD_ROOT_SAMPLE_ID: "sample_2",
-                FIELD_RNA_ID: "plate1:A03",
-                FIELD_LAB_ID: "ABC",
-                FIELD_RESULT: {"$regex": "^positive", "$options": "i"},
-            },
-        ]
+        FIELD_ROOT_SAMPLE_ID: {"$in": ["sample_1", "sample_2"]}
     }
 
 
+def test_filter_cherrypicked_samples_keeps_matching_positive_samples(app):
+    rows = [
+        DartRow("DN1111", "A01", "DN2222", "C03", None, "sample_1", "plate1:A01", "ABC"),
+        DartRow("DN1111", "A02", "DN2222", "C04", None, "sample_2", "plate1:A02", "ABC"),
+        DartRow("DN3333", "A02", "DN2222", "C01", "positive", None, None, None),
+    ]
+    samples = [
+        {FIELD_ROOT_SAMPLE_ID: "sample_1", FIELD_RNA_ID: "plate1:A01", FIELD_LAB_ID: "ABC"},
+        {FIELD_ROOT_SAMPLE_ID: "sample_2", FIELD_RNA_ID: "plate1:A02", FIELD_LAB_ID: "ABC"},
+        {FIELD_ROOT_SAMPLE_ID: "sample_2", FIELD_RNA_ID: "plate1:A03", FIELD_LAB_ID: "ABC"},
+        {FIELD_ROOT_SAMPLE_ID: "sample_1", FIELD_RNA_ID: "plate1:A01", FIELD_LAB_ID: "DEF"},
+    ]
+    samples[0][FIELD_RESULT] = "POSITIVE"
+    samples[1][FIELD_RESULT] = "Negative"
+    samples[2][FIELD_RESULT] = "Positive"
+    samples[3][FIELD_RESULT] = "Positive"
+
+    assert filter_cherrypicked_samples(rows, samples) == [samples[0]]
+
+
+def test_find_cherrypicked_samples(app, samples_different_plates):
+    rows = [
+        DartRow("DN1111", "A01", "123", "A01", None, "MCM001", "rna_1", "Lab 1"),
+        DartRow("DN1111", "A02", "456", "A01", None, "MCM002", "rna_2", "Lab 1"),
+        DartRow("DN1111", "A03", "789", "A01", "positive", None, None, None),
+    ]
+
+    with app.app_context():
+        found = find_cherrypicked_samples(rows)
+
+    assert [sample[FIELD_ROOT_SAMPLE_ID] for sample in found] == ["MCM001"]
+
+
+def test_find_cherrypicked_samples_returns_none_if_no_rows(app):
+    with app.app_context():
+        assert find_cherrypicked_samples([]) is None
+
+
 def test_query_for_cherrypicked_samples_returns_empty_if_none(app):
     assert query_for_cherrypicked_samples([]) is None
     assert query_for_cherrypicked_samples(None) is None
@@ -540,60 +646,6 @@ def test_row_is_normal_sample_detects_if_sample_is_control(app):
     )
 
 
-def test_rows_without_controls_filters_out_controls(app):
-    test = [
-        DartRow("DN1111", "A01", "DN2222", "C03", None, "sample_1", "plate1:A01", "ABC"),
-        DartRow("DN1111", "A02", "DN2222", "C04", None, "sample_1", "plate1:A02", "ABC"),
-        DartRow("DN1111", "A03", "DN2222", "C06", None, "sample_2", "plate1:A03", "ABC"),
-        DartRow("DN3333", "A02", "DN2222", "C01", "positive", None, None, None),
-        DartRow("DN3333", "A03", "DN2222", "C05", "negative", None, None, None),
-    ]
-
-    assert rows_without_controls(test) == [test[0], test[1], test[2]]
-
-
-def test_rows_with_controls_returns_controls(app):
-    test = [
-        DartRow("DN1111", "A01", "DN2222", "C03", None, "sample_1", "plate1:A01", "ABC"),
-        DartRow("DN1111", "A02", "DN2222", "C04", None, "sample_1", "plate1:A02", "ABC"),
-        DartRow("DN1111", "A03", "DN2222", "C06", None, "sample_2", "plate1:A03", "ABC"),
-        DartRow("DN3333", "A02", "DN2222", "C01", "positive", None, None, None),
-        DartRow("DN3333", "A03", "DN2222", "C05", "negative", None, None, None),
-    ]
-
-    assert rows_with_controls(test) == [test[3], test[4]]
-
-
-def test_equal_row_and_sample_compares_row_and_sample(app, samples_different_plates):
-    # Different root sample id
-    row = DartRow("DN1111", "A01", "123", "A01", None, "MCM002", "rna_1", "Lab 1")
-    assert not equal_row_and_sample(row, samples_different_plates[0])
-
-    # Different rna id
-    row = DartRow("DN1111", "A01", "123", "A01", None, "MCM001", "rna_3", "Lab 1")
-    assert not equal_row_and_sample(row, samples_different_plates[0])
-
-    # Different lab id
-    row = DartRow("DN1111", "A01", "123", "A01", None, "MCM001", "rna_1", "Lab 2")
-    assert not equal_row_and_sample(row, samples_different_plates[0])
-
-    # Same 3 values (root sample id, rna id, lab id)
-    row = DartRow("DN1111", "A01", "123", "A01", None, "MCM001", "rna_1", "Lab 1")
-    assert equal_row_and_sample(row, samples_different_plates[0])
-
-
-def test_find_sample_matching_row(app, samples_different_plates):
-    row = DartRow("DN1111", "A01", "123", "A01", None, "MCM002", "rna_2", "Lab 2")
-
-    assert find_sample_matching_row(row, samples_different_plates) == samples_different_plates[1]
-
-
-def test_find_sample_matching_row_returns_none_if_not_found(app, samples_different_plates):
-    row = DartRow("DN1111", "A01", "123", "A01", None, "MCM002", "rna_2", "Lab 3")
-
-    assert find_sample_matching_row(row, samples_different_plates) is None
-
-
 def test_join_rows_with_samples(app, samples_different_plates):
     rows = [
         DartRow("DN1111", "A01", "123", "A01", None, "MCM001", "rna_1", "Lab 1"),
@@ -629,50 +681,41 @@ def test_join_rows_with_samples_filters_out_controls(app, samples_different_plat
     ]
 
 
-def test_add_controls_to_samples(app, samples_different_plates):
-    rows = [
-        DartRow("DN1111", "A01", "123", "A01", "positive", "MCM001", "rna_1", "Lab 1"),
-        DartRow("DN1111", "A01", "123", "A01", "negative", "MCM002", "rna_2", "Lab 2"),
-    ]
-
-    samples_without_controls = [
-        {"row": row_to_dict(rows[0]), "sample": samples_different_plates[0]},
-        {"row": row_to_dict(rows[1]), "sample": samples_different_plates[1]},
+def test_partition_rows_separates_samples_and_controls(app):
+    test = [
+        DartRow("DN1111", "A01", "DN2222", "C03", None, "sample_1", "plate1:A01", "ABC"),
+        DartRow("DN3333", "A02", "DN2222", "C01", "positive", None, None, None),
+        DartRow("DN1111", "A02", "DN2222", "C04", "", "sample_1", "plate1:A02", "ABC"),
+        DartRow("DN3333", "A03", "DN2222", "C05", "negative", None, None, None),
     ]
 
-    assert add_controls_to_samples(rows, samples_without_controls) == [
-        {"row": row_to_dict(rows[0]), "sample": samples_different_plates[0]},
-        {"row": row_to_dict(rows[1]), "sample": samples_different_plates[1]},
-        {"row": row_to_dict(rows[0]), "sample": None},
-        {"row": row_to_dict(rows[1]), "sample": None},
-    ]
+    assert partition_rows(test) == ([test[0], test[2]], [test[1], test[3]])
 
 
-def test_check_matching_sample_numbers_returns_false_mismatch(app, samples_different_plates):
-    rows = [
-        DartRow("DN1111", "A01", "DN2222", "C03", None, "sample_1", "plate1:A01", "ABC"),
-        DartRow("DN1111", "A02", "DN2222", "C04", None, "sample_1", "plate1:A02", "ABC"),
-        DartRow("DN1111", "A03", "DN2222", "C06", None, "sample_2", "plate1:A03", "ABC"),
-        DartRow("DN1111", "A04", "DN2222", "C07", None, "sample_2", "plate1:A03", "ABC"),
-        DartRow("DN1111", "A05", "DN2222", "C08", None, "sample_2", "plate1:A03", "ABC"),
-        DartRow("DN3333", "A04", "DN2222", "C01", "positive", None, None, None),
-        DartRow("DN3333", "A04", "DN2222", "C01", "negative", None, None, None),
-    ]
+def test_index_samples_by_row_key_only_indexes_positives(app, samples_different_plates):
+    samples_different_plates[1][FIELD_RESULT] = "Negative"
 
-    result = check_matching_sample_numbers(rows, samples_different_plates)
-    assert result is False
+    assert index_samples_by_row_key(samples_different_plates) == {
+        ("MCM001", "rna_1", "Lab 1"): samples_different_plates[0]
+    }
 
 
-def test_check_matching_sample_numbers_returns_true_match(app, samples_different_plates):
+def test_join_dart_rows_with_samples(app, samples_different_plates):
     rows = [
-        DartRow("DN1111", "A01", "DN2222", "C03", None, "sample_1", "plate1:A01", "ABC"),
-        DartRow("DN1111", "A02", "DN2222", "C04", None, "sample_1", "plate1:A02", "ABC"),
-        DartRow("DN3333", "A04", "DN2222", "C01", "positive", None, None, None),
-        DartRow("DN3333", "A04", "DN2222", "C01", "negative", None, None, None),
+        DartRow("DN1111", "A01", "123", "A01", "positive", None, None, None),
+        DartRow("DN1111", "A02", "123", "A01", None, "MCM002", "rna_2", "Lab 2"),
+        DartRow("DN1111", "A03", "123", "A01", None, "MCM001", "rna_1", "Lab 1"),
+        DartRow("DN1111", "A04", "123", "A01", None, "MCM003", "rna_3", "Lab 3"),
     ]
 
-    result = check_matching_sample_numbers(rows, samples_different_plates)
-    assert result is True
+    assert join_dart_rows_with_samples(rows, samples_different_plates) == (
+        [
+            {"row": row_to_dict(rows[1]), "sample": samples_different_plates[1]},
+            {"row": row_to_dict(rows[2]), "sample": samples_different_plates[0]},
+            {"row": row_to_dict(rows[3]), "sample": None},
+        ],
+        [{"row": row_to_dict(rows[0]), "sample": None}],
+    )
 
 
 def test_map_to_ss_columns(app, dart_mongo_merged_samples):
@@ -1,4 +1,6 @@
 import os
+import random
+import time
 from datetime import datetime, timedelta
 from shutil import copy
 from unittest.mock import Mock, patch
@@ -12,6 +14,7 @@ from lighthouse.constants import (
     FIELD_ROOT_SAMPLE_ID,
     FIELD_SOURCE,
 )
+from lighthouse.helpers.dates_tested import update_dates_tested
 from lighthouse.helpers.reports import (
     add_cherrypicked_column,
     delete_reports,
@@ -89,21 +92,20 @@ def test_delete_reports(app, freezer):
 # - No chunking: a single query is made in which all matches are returned
 # - No duplication of returned matches
 def test_get_cherrypicked_samples_no_beckman(app, freezer):
-    expected = [
-        pd.DataFrame(
-            ["MCM001", "MCM003", "MCM005"], columns=[FIELD_ROOT_SAMPLE_ID], index=[0, 1, 2]
-        ),  # Sentinel query response
-        pd.DataFrame([]),  # Beckman query response
-    ]
+    read_sql = read_sql_by_query(
+        sentinel={
+            "MCM001": pd.DataFrame(
+                ["MCM001", "MCM003", "MCM005"], columns=[FIELD_ROOT_SAMPLE_ID], index=[0, 1, 2]
+            )
+        },
+        beckman={"MCM001": pd.DataFrame([])},
+    )
     samples = ["MCM001", "MCM002", "MCM003", "MCM004", "MCM005"]
     plate_barcodes = ["123", "456"]
 
     with app.app_context():
         with patch("sqlalchemy.create_engine", return_value=Mock()):
-            with patch(
-                "pandas.read_sql",
-                side_effect=expected,
-            ):
+            with patch("pandas.read_sql", side_effect=read_sql):
                 returned_samples = get_cherrypicked_samples(samples, plate_barcodes)
                 assert returned_samples.at[0, FIELD_ROOT_SAMPLE_ID] == "MCM001"
                 assert returned_samples.at[1, FIELD_ROOT_SAMPLE_ID] == "MCM003"
@@ -116,17 +118,21 @@ def test_get_cherrypicked_samples_no_beckman(app, freezer):
 # - Chunking: multiple queries are made, with all matches contained in the sum of these queries
 # - No duplication of returned matches
 def test_get_cherrypicked_samples_chunking_no_beckman(app, freezer):
-    # Note: This represents the results of three different (Sentinel, Beckman) sets of
-    # database queries, each Sentinel query getting indexed from 0. Do not change the
-    # indices here unless you have modified the behaviour of the query.
-    query_results = [
-        pd.DataFrame(["MCM001"], columns=[FIELD_ROOT_SAMPLE_ID], index=[0]),  # Sentinel query resp.
-        pd.DataFrame([]),  # Beckman query response
-        pd.DataFrame(["MCM003"], columns=[FIELD_ROOT_SAMPLE_ID], index=[0]),  # Sentinel query resp.
-        pd.DataFrame([]),  # Beckman query response
-        pd.DataFrame(["MCM005"], columns=[FIELD_ROOT_SAMPLE_ID], index=[0]),  # Sentinel query resp.
-        pd.DataFrame([]),  # Beckman query response
-    ]
+    # Note: This represents the results of the (Sentinel, Beckman) queries of three different
+    # chunks, keyed by the first root sample id of the chunk, each query getting indexed from 0.
+    # Do not change the indices here unless you have modified the behaviour of the query.
+    read_sql = read_sql_by_query(
+        sentinel={
+            "MCM001": pd.DataFrame(["MCM001"], columns=[FIELD_ROOT_SAMPLE_ID], index=[0]),
+            "MCM003": pd.DataFrame(["MCM003"], columns=[FIELD_ROOT_SAMPLE_ID], index=[0]),
+            "MCM005": pd.DataFrame(["MCM005"], columns=[FIELD_ROOT_SAMPLE_ID], index=[0]),
+        },
+        beckman={
+            "MCM001": pd.DataFrame([]),
+            "MCM003": pd.DataFrame([]),
+            "MCM005": pd.DataFrame([]),
+        },
+    )
     expected = pd.DataFrame(
         ["MCM001", "MCM003", "MCM005"], columns=[FIELD_ROOT_SAMPLE_ID], index=[0, 1, 2]
     )
@@ -136,10 +142,7 @@ def test_get_cherrypicked_samples_chunking_no_beckman(app, freezer):
 
     with app.app_context():
         with patch("sqlalchemy.create_engine", return_value=Mock()):
-            with patch(
-                "pandas.read_sql",
-                side_effect=query_results,
-            ):
+            with patch("pandas.read_sql", side_effect=read_sql):
                 returned_samples = get_cherrypicked_samples(samples, plate_barcodes, 2)
                 pd.testing.assert_frame_equal(expected, returned_samples)
 
@@ -176,21 +179,20 @@ def test_get_cherrypicked_samples_repeat_tests_no_beckman(
 # - No chunking: a single query is made in which all matches are returned
 # - No duplication of returned matches
 def test_get_cherrypicked_samples_no_sentinel(app, freezer):
-    expected = [
-        pd.DataFrame([]),  # Sentinel query response
-        pd.DataFrame(
-            ["MCM001", "MCM003", "MCM005"], columns=[FIELD_ROOT_SAMPLE_ID], index=[0, 1, 2]
-        ),  # Beckman query response
-    ]
+    read_sql = read_sql_by_query(
+        sentinel={"MCM001": pd.DataFrame([])},
+        beckman={
+            "MCM001": pd.DataFrame(
+                ["MCM001", "MCM003", "MCM005"], columns=[FIELD_ROOT_SAMPLE_ID], index=[0, 1, 2]
+            )
+        },
+    )
     samples = ["MCM001", "MCM002", "MCM003", "MCM004", "MCM005"]
     plate_barcodes = ["123", "456"]
 
     with app.app_context():
         with patch("sqlalchemy.create_engine", return_value=Mock()):
-            with patch(
-                "pandas.read_sql",
-                side_effect=expected,
-            ):
+            with patch("pandas.read_sql", side_effect=read_sql):
                 returned_samples = get_cherrypicked_samples(samples, plate_barcodes)
                 assert returned_samples.at[0, FIELD_ROOT_SAMPLE_ID] == "MCM001"
                 assert returned_samples.at[1, FIELD_ROOT_SAMPLE_ID] == "MCM003"
@@ -203,17 +205,21 @@ def test_get_cherrypicked_samples_no_sentinel(app, freezer):
 # - Chunking: multiple queries are made, with all matches contained in the sum of these queries
 # - No duplication of returned matches
 def test_get_cherrypicked_samples_chunking_no_sentinel(app, freezer):
-    # Note: This represents the results of three different (Sentinel, Beckman) sets of
-    # database queries, each Sentinel query getting indexed from 0. Do not change the
-    # indices here unless you have modified the behaviour of the query.
-    query_results = [
-        pd.DataFrame([]),  # Sentinel query resp.
-        pd.DataFrame(["MCM001"], columns=[FIELD_ROOT_SAMPLE_ID], index=[0]),  # Beckman query resp.
-        pd.DataFrame([]),  # Sentinel query resp.
-        pd.DataFrame(["MCM003"], columns=[FIELD_ROOT_SAMPLE_ID], index=[0]),  # Beckman query resp.
-        pd.DataFrame([]),  # Sentinel query resp.
-        pd.DataFrame(["MCM005"], columns=[FIELD_ROOT_SAMPLE_ID], index=[0]),  # Beckman query resp.
-    ]
+    # Note: This represents the results of the (Sentinel, Beckman) queries of three different
+    # chunks, keyed by the first root sample id of the chunk, each query getting indexed from 0.
+    # Do not change the indices here unless you have modified the behaviour of the query.
+    read_sql = read_sql_by_query(
+        sentinel={
+            "MCM001": pd.DataFrame([]),
+            "MCM003": pd.DataFrame([]),
+            "MCM005": pd.DataFrame([]),
+        },
+        beckman={
+            "MCM001": pd.DataFrame(["MCM001"], columns=[FIELD_ROOT_SAMPLE_ID], index=[0]),
+            "MCM003": pd.DataFrame(["MCM003"], columns=[FIELD_ROOT_SAMPLE_ID], index=[0]),
+            "MCM005": pd.DataFrame(["MCM005"], columns=[FIELD_ROOT_SAMPLE_ID], index=[0]),
+        },
+    )
     expected = pd.DataFrame(
         ["MCM001", "MCM003", "MCM005"], columns=[FIELD_ROOT_SAMPLE_ID], index=[0, 1, 2]
     )
@@ -223,10 +229,7 @@ def test_get_cherrypicked_samples_chunking_no_sentinel(app, freezer):
 
     with app.app_context():
         with patch("sqlalchemy.create_engine", return_value=Mock()):
-            with patch(
-                "pandas.read_sql",
-                side_effect=query_results,
-            ):
+            with patch("pandas.read_sql", side_effect=read_sql):
                 returned_samples = get_cherrypicked_samples(samples, plate_barcodes, 2)
                 pd.testing.assert_frame_equal(expected, returned_samples)
 
@@ -263,23 +266,24 @@ def test_get_cherrypicked_samples_repeat_tests_no_sentinel(
 # - No chunking: a single query is made (per workflow) in which all matches are returned
 # - Duplication of returned matches across different workflows: duplicates should be filtered out
 def test_get_cherrypicked_samples_sentinel_and_beckman(app, freezer):
-    expected = [
-        pd.DataFrame(
-            ["MCM001", "MCM006"], columns=[FIELD_ROOT_SAMPLE_ID], index=[0, 1]
-        ),  # Sentinel query response
-        pd.DataFrame(
-            ["MCM001", "MCM003", "MCM005"], columns=[FIELD_ROOT_SAMPLE_ID], index=[0, 1, 2]
-        ),  # Beckman query response
-    ]
+    read_sql = read_sql_by_query(
+        sentinel={
+            "MCM001": pd.DataFrame(
+                ["MCM001", "MCM006"], columns=[FIELD_ROOT_SAMPLE_ID], index=[0, 1]
+            )
+        },
+        beckman={
+            "MCM001": pd.DataFrame(
+                ["MCM001", "MCM003", "MCM005"], columns=[FIELD_ROOT_SAMPLE_ID], index=[0, 1, 2]
+            )
+        },
+    )
     samples = ["MCM001", "MCM002", "MCM003", "MCM004", "MCM005", "MCM006"]
     plate_barcodes = ["123", "456"]
 
     with app.app_context():
         with patch("sqlalchemy.create_engine", return_value=Mock()):
-            with patch(
-                "pandas.read_sql",
-                side_effect=expected,
-            ):
+            with patch("pandas.read_sql", side_effect=read_sql):
                 returned_samples = get_cherrypicked_samples(samples, plate_barcodes)
                 assert returned_samples.at[0, FIELD_ROOT_SAMPLE_ID] == "MCM001"
                 assert returned_samples.at[1, FIELD_ROOT_SAMPLE_ID] == "MCM006"
@@ -293,17 +297,27 @@ def test_get_cherrypicked_samples_sentinel_and_beckman(app, freezer):
 # - Chunking: multiple queries are made (per workflow), with all matches contained in the sum
 # - Duplication of returned matches across different workflows: duplicates should be filtered out
 def test_get_cherrypicked_samples_chunking_sentinel_and_beckman(app, freezer):
-    # Note: This represents the results of three different (Sentinel, Beckman) sets of
-    # database queries, each query getting indexed from 0. Do not changes the
-    # indicies here unless you have modified the behaviour of the query.
-    query_results = [
-        pd.DataFrame(["MCM001"], columns=[FIELD_ROOT_SAMPLE_ID], index=[0]),  # Sentinel
-        pd.DataFrame(["MCM001", "MCM002"], columns=[FIELD_ROOT_SAMPLE_ID], index=[0, 1]),  # Beckman
-        pd.DataFrame(["MCM003"], columns=[FIELD_ROOT_SAMPLE_ID], index=[0]),  # Sentinel
-        pd.DataFrame(["MCM003", "MCM004"], columns=[FIELD_ROOT_SAMPLE_ID], index=[0, 1]),  # Beckman
-        pd.DataFrame(["MCM005"], columns=[FIELD_ROOT_SAMPLE_ID], index=[0]),  # Sentinel
-        pd.DataFrame(["MCM005", "MCM006"], columns=[FIELD_ROOT_SAMPLE_ID], index=[0, 1]),  # Beckman
-    ]
+    # Note: This represents the results of the (Sentinel, Beckman) queries of three different
+    # chunks, keyed by the first root sample id of the chunk, each query getting indexed from 0.
+    # Do not change the indices here unless you have modified the behaviour of the query.
+    read_sql = read_sql_by_query(
+        sentinel={
+            "MCM001": pd.DataFrame(["MCM001"], columns=[FIELD_ROOT_SAMPLE_ID], index=[0]),
+            "MCM003": pd.DataFrame(["MCM003"], columns=[FIELD_ROOT_SAMPLE_ID], index=[0]),
+            "MCM005": pd.DataFrame(["MCM005"], columns=[FIELD_ROOT_SAMPLE_ID], index=[0]),
+        },
+        beckman={
+            "MCM001": pd.DataFrame(
+                ["MCM001", "MCM002"], columns=[FIELD_ROOT_SAMPLE_ID], index=[0, 1]
+            ),
+            "MCM003": pd.DataFrame(
+                ["MCM003", "MCM004"], columns=[FIELD_ROOT_SAMPLE_ID], index=[0, 1]
+            ),
+            "MCM005": pd.DataFrame(
+                ["MCM005", "MCM006"], columns=[FIELD_ROOT_SAMPLE_ID], index=[0, 1]
+            ),
+        },
+    )
     expected = pd.DataFrame(
         ["MCM001", "MCM002", "MCM003", "MCM004", "MCM005", "MCM006"],
         columns=[FIELD_ROOT_SAMPLE_ID],
@@ -315,12 +329,141 @@ def test_get_cherrypicked_samples_chunking_sentinel_and_beckman(app, freezer):
 
     with app.app_context():
         with patch("sqlalchemy.create_engine", return_value=Mock()):
-            with patch(
-                "pandas.read_sql",
-                side_effect=query_results,
-            ):
+            with patch("pandas.read_sql", side_effect=read_sql):
+                returned_samples = get_cherrypicked_samples(samples, plate_barcodes, 2)
+                pd.testing.assert_frame_equal(expected, returned_samples)
+
+
+# Test Scenario
+# - Mocking database responses, which take longer for earlier queries
+# - Both Sentinel and Beckman queries return matches
+# - Chunking: the queries of the chunks and workflows are run concurrently
+# - The frames are merged in the order the queries were made, not the order they finished in
+def test_get_cherrypicked_samples_concurrent_queries(app, freezer):
+    def read_sql(sql, connection, params):
+        root_sample_ids = params["root_sample_ids"]
+        # the first chunk finishes last
+        time.sleep(0.05 if "MCM001" in root_sample_ids else 0)
+        # the Sentinel query joins stock_resource, the Beckman query joins lighthouse_sample
+        if "stock_resource" in sql:
+            return pd.DataFrame([root_sample_ids[0]], columns=[FIELD_ROOT_SAMPLE_ID])
+        return pd.DataFrame(list(root_sample_ids), columns=[FIELD_ROOT_SAMPLE_ID])
+
+    expected = pd.DataFrame(
+        ["MCM001", "MCM002", "MCM003", "MCM004", "MCM005"],
+        columns=[FIELD_ROOT_SAMPLE_ID],
+        index=[0, 1, 2, 3, 4],
+    )
+
+    samples = ["MCM001", "MCM002", "MCM003", "MCM004", "MCM005"]
+    plate_barcodes = ["123", "456"]
+
+    with app.app_context():
+        app.config["REPORTS_WAREHOUSE_QUERY_WORKERS"] = 4
+        with patch("sqlalchemy.create_engine", return_value=Mock()):
+            with patch("pandas.read_sql", side_effect=read_sql) as mock_read_sql:
                 returned_samples = get_cherrypicked_samples(samples, plate_barcodes, 2)
                 pd.testing.assert_frame_equal(expected, returned_samples)
+                assert mock_read_sql.call_count == 6
+
+
+# Test Scenario
+# - Mocking database responses, which take a random time
+# - Both Sentinel and Beckman queries return matches, with duplicates across chunks and workflows
+# - The queries run by several workers give the same frame as those run one at a time
+def test_get_cherrypicked_samples_concurrent_queries_match_serial(app, freezer):
+    def read_sql(sql, connection, params):
+        time.sleep(random.uniform(0, 0.02))
+        root_sample_ids = list(params["root_sample_ids"])
+        if "stock_resource" in sql:
+            rows = root_sample_ids[::-1]
+        else:
+            rows = ["MCM001"] + root_sample_ids
+        return pd.DataFrame(rows, columns=[FIELD_ROOT_SAMPLE_ID])
+
+    samples = [f"MCM{i:03}" for i in range(1, 21)]
+    plate_barcodes = ["123", "456"]
+
+    returned_samples = {}
+    with app.app_context():
+        for workers in (1, 4):
+            app.config["REPORTS_WAREHOUSE_QUERY_WORKERS"] = workers
+            with patch("sqlalchemy.create_engine", return_value=Mock()):
+                with patch("pandas.read_sql", side_effect=read_sql):
+                    returned_samples[workers] = get_cherrypicked_samples(samples, plate_barcodes, 3)
+
+    assert len(returned_samples[1].index) == len(samples)
+    pd.testing.assert_frame_equal(returned_samples[1], returned_samples[4])
+
+
+# Test Scenario
+# - Mocking database responses
+# - Streaming: the rows of each query are read in chunks from a server side cursor
+# - Duplicate rows, within and across the queries, are folded into the distinct rows as they arrive
+def test_get_cherrypicked_samples_streaming(app, freezer):
+    def read_sql(sql, connection, params, chunksize):
+        assert chunksize == 2
+        root_sample_ids = list(params["root_sample_ids"])
+        # the Sentinel query joins stock_resource, the Beckman query joins lighthouse_sample
+        if "stock_resource" in sql:
+            rows = root_sample_ids + root_sample_ids[:1]
+        else:
+            rows = root_sample_ids[::-1]
+        return iter(
+            pd.DataFrame(rows[x : (x + chunksize)], columns=[FIELD_ROOT_SAMPLE_ID])  # noqa: E203
+            for x in range(0, len(rows), chunksize)
+        )
+
+    expected = pd.DataFrame(
+        ["MCM001", "MCM002", "MCM003", "MCM004", "MCM005"],
+        columns=[FIELD_ROOT_SAMPLE_ID],
+        index=[0, 1, 2, 3, 4],
+    )
+
+    samples = ["MCM001", "MCM002", "MCM003", "MCM004", "MCM005"]
+    plate_barcodes = ["123", "456"]
+
+    with app.app_context():
+        app.config["REPORTS_WAREHOUSE_STREAM_RESULTS"] = True
+        app.config["REPORTS_WAREHOUSE_STREAM_CHUNK_SIZE"] = 2
+        mock_engine = Mock()
+        with patch("sqlalchemy.create_engine", return_value=mock_engine):
+            with patch("pandas.read_sql", side_effect=read_sql) as mock_read_sql:
+                returned_samples = get_cherrypicked_samples(samples, plate_barcodes, 3)
+                pd.testing.assert_frame_equal(expected, returned_samples)
+                assert mock_read_sql.call_count == 4
+
+        mock_engine.connect.return_value.execution_options.assert_called_with(stream_results=True)
+
+
+def test_get_cherrypicked_samples_streaming_no_rows(app, freezer):
+    # a query without any rows is not read as any chunks
+    existing_dataframe = pd.DataFrame(
+        [["MCM001", "123", "TEST", "Positive", "A1"]],
+        columns=[
+            FIELD_ROOT_SAMPLE_ID,
+            FIELD_PLATE_BARCODE,
+            "Lab ID",
+            FIELD_RESULT,
+            FIELD_COORDINATE,
+        ],
+    )
+
+    with app.app_context():
+        app.config["REPORTS_WAREHOUSE_STREAM_RESULTS"] = True
+        with patch("sqlalchemy.create_engine", return_value=Mock()):
+            with patch("pandas.read_sql", side_effect=lambda *args, **kwargs: iter([])):
+                returned_samples = get_cherrypicked_samples(["MCM001"], ["123"])
+                assert returned_samples.empty
+                assert list(returned_samples.columns) == [
+                    FIELD_ROOT_SAMPLE_ID,
+                    FIELD_PLATE_BARCODE,
+                    "Result_lower",
+                    FIELD_COORDINATE,
+                ]
+
+                with_cherrypicked = add_cherrypicked_column(existing_dataframe)
+                assert with_cherrypicked["LIMS submission"].to_list() == ["No"]
 
 
 # Test Scenario
@@ -357,12 +500,40 @@ def test_get_cherrypicked_samples_repeat_tests_sentinel_and_beckman(
         pd.testing.assert_frame_equal(expected, returned_samples)
 
 
+def test_get_cherrypicked_samples_with_temp_table_join(
+    app, freezer, mlwh_sentinel_and_beckman_cherrypicked, event_wh_data
+):
+    # the same samples as test_get_cherrypicked_samples_repeat_tests_sentinel_and_beckman, found
+    # by joining to temporary tables of the root sample ids and plate barcodes
+    root_sample_ids = ["root_1", "root_2", "root_3", "root_4", "root_5", "root_1"]
+    plate_barcodes = ["pb_1", "pb_2", "pb_3", "pb_4", "pb_5", "pb_6"]
+
+    expected_rows = [
+        ["root_1", "pb_1", "positive", "A1"],
+        ["root_2", "pb_2", "positive", "A1"],
+        ["root_4", "pb_4", "positive", "A1"],
+        ["root_5", "pb_5", "positive", "A1"],
+    ]
+    expected_columns = [FIELD_ROOT_SAMPLE_ID, FIELD_PLATE_BARCODE, "Result_lower", FIELD_COORDINATE]
+    expected = pd.DataFrame(np.array(expected_rows), columns=expected_columns, index=[0, 1, 2, 3])
+
+    app.config["REPORTS_WAREHOUSE_TEMP_TABLE_JOIN"] = True
+    app.config["REPORTS_TEMP_TABLE_INSERT_CHUNK_SIZE"] = 2
+    with app.app_context():
+        returned_samples = get_cherrypicked_samples(root_sample_ids, plate_barcodes)
+
+    # rows joined to the temporary tables are not returned in any particular order
+    returned_samples = returned_samples.sort_values(FIELD_ROOT_SAMPLE_ID).reset_index(drop=True)
+    pd.testing.assert_frame_equal(expected, returned_samples)
+
+
 # ----- get_all_positive_samples tests -----
 
 
 def test_get_all_positive_samples(app, freezer, samples):
 
     with app.app_context():
+        update_dates_tested()
         samples = app.data.driver.db.samples
         positive_samples = get_all_positive_samples(samples)
 
@@ -378,6 +549,18 @@ def test_get_all_positive_samples(app, freezer, samples):
         assert positive_samples.at[2, FIELD_ROOT_SAMPLE_ID] == "MCM007"
 
 
+def test_get_all_positive_samples_parses_dates_not_yet_updated(app, freezer, samples):
+
+    with app.app_context():
+        samples = app.data.driver.db.samples
+        positive_samples = get_all_positive_samples(samples)
+
+        assert len(positive_samples) == 3
+        assert positive_samples.at[0, FIELD_ROOT_SAMPLE_ID] == "MCM001"
+        assert positive_samples.at[1, FIELD_ROOT_SAMPLE_ID] == "MCM005"
+        assert positive_samples.at[2, FIELD_ROOT_SAMPLE_ID] == "MCM007"
+
+
 # ----- add_cherrypicked_column tests -----
 
 
@@ -592,6 +775,7 @@ def test_get_distinct_plate_barcodes(app, freezer, samples):
 def test_join_samples_declarations(app, freezer, samples_declarations, samples_no_declaration):
 
     with app.app_context():
+        update_dates_tested()
         samples = app.data.driver.db.samples
         positive_samples = get_all_positive_samples(samples)
         joined = join_samples_declarations(positive_samples)
@@ -604,6 +788,7 @@ def test_join_samples_declarations_empty_collection(app, freezer, samples_no_dec
     # samples_declaration collection is empty because we are not passing in the fixture
 
     with app.app_context():
+        update_dates_tested()
         samples = app.data.driver.db.samples
         positive_samples = get_all_positive_samples(samples)
         joined = join_samples_declarations(positive_samples)
@@ -625,3 +810,19 @@ def test_report_query_window_start(app):
         assert report_query_window_start().hour == 0
         assert report_query_window_start().minute == 0
         assert report_query_window_start().second == 0
+
+
+# module-specific test helpers
+
+
+def read_sql_by_query(sentinel, beckman):
+    """A side effect for pandas.read_sql which responds to the Sentinel and Beckman queries of each
+    chunk with the response keyed by the first root sample id of the chunk, so that the responses
+    do not depend on the order the queries are made in."""
+
+    def read_sql(sql, connection, params):
+        # the Sentinel query joins stock_resource, the Beckman query joins lighthouse_sample
+        responses = sentinel if "stock_resource" in sql else beckman
+        return responses[params["root_sample_ids"][0]]
+
+    return read_sql
@@ -0,0 +1,113 @@
+import json
+from http import HTTPStatus
+from unittest.mock import patch
+
+import pytest
+from lighthouse.helpers.timing import (
+    Histogram,
+    StageTimer,
+    current_stage_timer,
+    get_timing_registry,
+    timed_request,
+    timed_stage,
+)
+
+
+def test_histogram_counts_durations_in_buckets():
+    histogram = Histogram()
+
+    for milliseconds in (1, 5, 7, 100000):
+        histogram.observe(milliseconds)
+
+    snapshot = histogram.snapshot()
+    assert snapshot["count"] == 4
+    assert snapshot["max_ms"] == 100000
+    assert snapshot["buckets"]["5"] == 2
+    assert snapshot["buckets"]["10"] == 1
+    assert snapshot["buckets"]["+Inf"] == 1
+
+
+def test_stage_timer_records_stages(app):
+    with app.app_context():
+        timer = StageTimer("test.request")
+
+        with timer.stage("first"):
+            pass
+
+        with pytest.raises(ValueError):
+            with timer.stage("second"):
+                raise ValueError("Boom!")
+
+        timer.wrap("third", lambda: None)()
+
+        timings = timer.finish(HTTPStatus.OK)
+
+        assert [stage["stage"] for stage in timings["stages"]] == ["first", "second", "third"]
+        assert [stage["ok"] for stage in timings["stages"]] == [True, False, True]
+
+        histograms = get_timing_registry().snapshot()["histograms"]
+        assert histograms["test.request"]["count"] == 1
+        assert histograms["test.request.second"]["count"] == 1
+
+
+def test_stage_timer_keeps_slow_requests(app):
+    with app.app_context():
+        app.config["TIMING_SLOW_REQUEST_SECONDS"] = 0
+
+        timer = StageTimer("test.request")
+        with patch("lighthouse.helpers.timing.logger") as mock_logger:
+            timer.finish(HTTPStatus.OK)
+
+        mock_logger.warning.assert_called_once()
+        assert get_timing_registry().snapshot()["slow_samples"][0]["request"] == "test.request"
+
+
+def test_stage_timer_logs_failed_requests_as_errors(app):
+    with app.app_context():
+        timer = StageTimer("test.request")
+        with timer.stage("dart"):
+            pass
+
+        with patch("lighthouse.helpers.timing.logger") as mock_logger:
+            timer.finish(HTTPStatus.INTERNAL_SERVER_ERROR)
+
+        mock_logger.error.assert_called_once()
+        assert '"stage": "dart"' in mock_logger.error.call_args[0][0]
+
+
+def test_timed_request_times_view_and_its_stages(app):
+    @timed_request("test.view")
+    def view():
+        with timed_stage("stage"):
+            return {}, HTTPStatus.CREATED
+
+    with app.test_request_context():
+        assert view() == ({}, HTTPStatus.CREATED)
+
+        histograms = get_timing_registry().snapshot()["histograms"]
+        assert histograms["test.view"]["count"] == 1
+        assert histograms["test.view.stage"]["count"] == 1
+
+
+def test_current_stage_timer_outside_timed_request(app):
+    with app.app_context():
+        with timed_stage("stage"):
+            pass
+
+        assert current_stage_timer().name is None
+        assert get_timing_registry().snapshot()["histograms"] == {}
+
+
+def test_timings_health_check(app, client, samples):
+    with patch("lighthouse.helpers.plate_jobs.add_cog_barcodes", side_effect=Exception("Boom!")):
+        client.post(
+            "/plates/new", data=json.dumps({"barcode": "123"}), content_type="application/json"
+        )
+
+    response = client.get("/health/timings")
+
+    assert response.status_code == HTTPStatus.OK
+    histograms = response.json["histograms"]
+    assert histograms["plates.create"]["count"] == 1
+    assert histograms["plates.create.fetching_samples"]["count"] == 1
+    assert histograms["plates.create.adding_cog_barcodes"]["count"] == 1
@@ -1,7 +1,8 @@
 from unittest.mock import MagicMock, patch
 
 import pytest
-from lighthouse.messages.broker import Broker
+from lighthouse.messages.broker import Broker, BrokerPublisher, get_publisher
+from pika.exceptions import AMQPConnectionError
 
 
 def test_broker_connect_connects(app, mock_pika):
@@ -100,6 +101,131 @@ def test_broker_close_connection_no_connection():
         broker.close_connection()
 
 
+def test_broker_publisher_keeps_connection_open(app, mock_pika, mock_message):
+    with app.app_context():
+        _, _, mock_channel, mock_connection, pika = mock_pika
+        test_payload, test_message = mock_message
+
+        publisher = BrokerPublisher()
+        publisher.publish(test_message, "routing key 1")
+        publisher.publish(test_message, "routing key 2")
+
+        pika.BlockingConnection.assert_called_once()
+        mock_connection.channel.assert_called_once()
+        if app.config["RMQ_DECLARE_EXCHANGE"]:
+            mock_channel.exchange_declare.assert_called_once_with(
+                app.config["RMQ_EXCHANGE"], exchange_type=app.config["RMQ_EXCHANGE_TYPE"]
+            )
+        mock_channel.basic_publish.assert_called_with(
+            exchange=app.config["RMQ_EXCHANGE"],
+            routing_key="routing key 2",
+            body=test_payload,
+        )
+        assert mock_channel.basic_publish.call_count == 2
+        mock_connection.close.assert_not_called()
+
+
+def test_broker_publisher_publish_no_message_or_routing_key(app, mock_pika, mock_message):
+    with app.app_context():
+        _, _, mock_channel, _, pika = mock_pika
+        _, test_message = mock_message
+
+        publisher = BrokerPublisher()
+        publisher.publish(None, "routing key")
+        publisher.publish(test_message, None)
+
+        pika.BlockingConnection.assert_not_called()
+        mock_channel.basic_publish.assert_not_called()
+
+
+def test_broker_publisher_reconnects_when_connection_lost(app, mock_pika, mock_message):
+    with app.app_context():
+        _, _, mock_channel, _, pika = mock_pika
+        _, test_message = mock_message
+        mock_channel.basic_publish.side_effect = [AMQPConnectionError(), None]
+
+        with patch("lighthouse.messages.broker.time.sleep") as mock_sleep:
+            publisher = BrokerPublisher()
+            publisher.publish(test_message, "routing key")
+
+            mock_sleep.assert_called_once_with(app.config["RMQ_RECONNECT_BACKOFF_SECONDS"])
+
+        assert pika.BlockingConnection.call_count == 2
+        assert mock_channel.basic_publish.call_count == 2
+
+
+def test_broker_publisher_reconnects_when_connection_closed(app, mock_pika, mock_message):
+    with app.app_context():
+        _, _, mock_channel, mock_connection, pika = mock_pika
+        _, test_message = mock_message
+
+        publisher = BrokerPublisher()
+        publisher.publish(test_message, "routing key")
+
+        # e.g. closed by the broker while the publisher was idle
+        mock_connection.is_open = False
+        publisher.publish(test_message, "routing key")
+
+        assert pika.BlockingConnection.call_count == 2
+        assert mock_channel.basic_publish.call_count == 2
+
+
+def test_broker_publisher_confirms_delivery_with_timeouts(app, mock_pika, mock_message):
+    with app.app_context():
+        _, _, mock_channel, _, pika = mock_pika
+        _, test_message = mock_message
+
+        publisher = BrokerPublisher()
+        publisher.publish(test_message, "routing key")
+
+        _, kwargs = pika.ConnectionParameters.call_args
+        assert kwargs["heartbeat"] == app.config["RMQ_HEARTBEAT_SECONDS"]
+        assert kwargs["heartbeat"] > 0
+        assert kwargs["blocked_connection_timeout"] == app.config[
+            "RMQ_BLOCKED_CONNECTION_TIMEOUT_SECONDS"
+        ]
+        assert kwargs["socket_timeout"] == app.config["RMQ_SOCKET_TIMEOUT_SECONDS"]
+        mock_channel.confirm_delivery.assert_called_once()
+
+
+def test_broker_publisher_raises_after_all_attempts(app, mock_pika, mock_message):
+    with app.app_context():
+        _, _, _, _, pika = mock_pika
+        _, test_message = mock_message
+        pika.BlockingConnection.side_effect = AMQPConnectionError()
+
+        with patch("lighthouse.messages.broker.time.sleep") as mock_sleep:
+            publisher = BrokerPublisher()
+            with pytest.raises(AMQPConnectionError):
+                publisher.publish(test_message, "routing key")
+
+            backoff = app.config["RMQ_RECONNECT_BACKOFF_SECONDS"]
+            assert [c.args[0] for c in mock_sleep.call_args_list] == [backoff, backoff * 2]
+
+        assert pika.BlockingConnection.call_count == app.config["RMQ_PUBLISH_RETRY_ATTEMPTS"]
+
+
+def test_broker_publisher_close(app, mock_pika, mock_message):
+    with app.app_context():
+        _, _, _, mock_connection, pika = mock_pika
+        _, test_message = mock_message
+
+        publisher = BrokerPublisher()
+        publisher.publish(test_message, "routing key")
+        publisher.close()
+
+        mock_connection.close.assert_called_once()
+
+        publisher.publish(test_message, "routing key")
+
+        assert pika.BlockingConnection.call_count == 2
+
+
+def test_get_publisher_is_shared_by_the_app(app, mock_pika):
+    with app.app_context():
+        assert get_publisher() is get_publisher()
+
+
 # class-specific test helpers
 
 
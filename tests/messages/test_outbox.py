@@ -0,0 +1,135 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+from lighthouse.messages.message import Message
+from lighthouse.messages.outbox import MessageOutbox, flush_outbox, new_outbox_owner, send_message
+from pika.exceptions import AMQPConnectionError
+
+
+def test_outbox_append_and_claim_in_order(outbox):
+    first_id = outbox.append(Message({"number": 1}), "routing.key.1")
+    second_id = outbox.append(Message({"number": 2}), "routing.key.2")
+
+    entries = outbox.claim("owner", 10, 60)
+
+    assert [entry.id for entry in entries] == [first_id, second_id]
+    assert [entry.routing_key for entry in entries] == ["routing.key.1", "routing.key.2"]
+    assert entries[0].body == '{"number": 1}'
+
+
+def test_outbox_claimed_messages_are_not_claimed_by_another_owner(outbox):
+    outbox.append(Message({"number": 1}), "routing.key")
+
+    assert len(outbox.claim("owner 1", 10, 60)) == 1
+    assert outbox.claim("owner 2", 10, 60) == []
+
+    # the claim has expired
+    assert len(outbox.claim("owner 2", 10, -1)) == 1
+
+
+def test_outbox_claimed_messages_are_not_claimed_again_by_the_same_owner(outbox):
+    outbox.append(Message({"number": 1}), "routing.key")
+
+    assert len(outbox.claim("owner", 10, 60)) == 1
+    assert outbox.claim("owner", 10, 60) == []
+
+
+def test_new_outbox_owner_is_unique():
+    assert new_outbox_owner() != new_outbox_owner()
+
+
+def test_outbox_is_durable(tmp_path):
+    path = str(tmp_path / "outbox.sqlite3")
+    outbox = MessageOutbox(path)
+    outbox.append(Message({"number": 1}), "routing.key")
+    outbox.close()
+
+    reopened = MessageOutbox(path)
+
+    assert reopened.metrics()["backlog"] == 1
+    reopened.close()
+
+
+def test_outbox_metrics(outbox):
+    assert outbox.metrics() == {"backlog": 0, "oldest_age_seconds": None, "failed": 0}
+
+    first_id = outbox.append(Message({"number": 1}), "routing.key")
+    outbox.append(Message({"number": 2}), "routing.key")
+    outbox.claim("owner", 1, 60)
+    outbox.release([first_id], "error")
+
+    metrics = outbox.metrics()
+    assert metrics["backlog"] == 2
+    assert metrics["failed"] == 1
+    assert metrics["oldest_age_seconds"] >= 0
+
+
+def test_flush_outbox_publishes_and_removes_messages(app, outbox):
+    outbox.append(Message({"number": 1}), "routing.key.1")
+    outbox.append(Message({"number": 2}), "routing.key.2")
+    publisher = MagicMock()
+
+    with app.app_context():
+        assert flush_outbox(outbox, publisher, "owner") == (2, 0)
+
+    assert [c.args for c in publisher.publish_payload.call_args_list] == [
+        ('{"number": 1}', "routing.key.1"),
+        ('{"number": 2}', "routing.key.2"),
+    ]
+    assert outbox.metrics()["backlog"] == 0
+
+
+def test_flush_outbox_keeps_messages_which_failed(app, outbox):
+    outbox.append(Message({"number": 1}), "routing.key")
+    outbox.append(Message({"number": 2}), "routing.key")
+    outbox.append(Message({"number": 3}), "routing.key")
+    publisher = MagicMock()
+    publisher.publish_payload.side_effect = [None, AMQPConnectionError(), None]
+
+    with app.app_context():
+        assert flush_outbox(outbox, publisher, "owner") == (1, 2)
+
+    assert outbox.metrics()["backlog"] == 2
+    assert outbox.metrics()["failed"] == 2
+
+    publisher.publish_payload.side_effect = None
+    with app.app_context():
+        assert flush_outbox(outbox, publisher, "owner") == (2, 0)
+
+    assert publisher.publish_payload.call_args_list[-2].args[0] == '{"number": 2}'
+    assert outbox.metrics()["backlog"] == 0
+
+
+def test_send_message_publishes_when_outbox_disabled(app):
+    message = Message({"number": 1})
+
+    with app.app_context():
+        with patch("lighthouse.messages.outbox.get_publisher") as mock_get_publisher:
+            send_message(message, "routing.key")
+
+            mock_get_publisher().publish.assert_called_with(message, "routing.key")
+
+
+def test_send_message_stores_message_when_outbox_enabled(app, outbox):
+    with app.app_context():
+        app.config["OUTBOX_ENABLE"] = True
+        try:
+            with patch("lighthouse.messages.outbox.get_outbox", return_value=outbox):
+                with patch("lighthouse.messages.outbox.get_publisher") as mock_get_publisher:
+                    send_message(Message({"number": 1}), "routing.key")
+
+                    mock_get_publisher.assert_not_called()
+        finally:
+            app.config["OUTBOX_ENABLE"] = False
+
+    assert outbox.metrics()["backlog"] == 1
+
+
+# module-specific test helpers
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    outbox = MessageOutbox(str(tmp_path / "outbox.sqlite3"))
+    yield outbox
+    outbox.close()